@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ADAPTIVE THROTTLE - AIMD CONCURRENCY CONTROL
+============================================
+
+Adjusts sending pressure to what the provider actually accepts:
+- Backs off on HTTP 429 + Retry-After, SMTP 421/45x replies and EWS ErrorServerBusy
+- Multiplicative decrease of in-flight sends and token-bucket rate on throttling
+- Additive increase back to the configured budget while the provider is healthy
+"""
+
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from config import Config
+from rate_limiter import RateLimiter, get_rate_limiter
+
+# SMTP replies that mean "slow down / try later" rather than a permanent failure
+SMTP_THROTTLE_CODES = {421, 450, 451, 452}
+
+# HTTP statuses that carry a provider throttling signal
+HTTP_THROTTLE_STATUSES = {429}
+
+
+def retry_after_from_response(response) -> Optional[float]:
+    """Seconds to wait from a Retry-After (seconds or HTTP date) or X-RateLimit-Reset header"""
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(value)
+                return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    reset = headers.get('X-RateLimit-Reset')
+    if reset:
+        try:
+            return max(0.0, float(reset) - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+def smtp_throttle_code(error: Exception) -> Optional[int]:
+    """SMTP reply code if the exception is a throttling reply, else None"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        throttled = [code for code in codes if code in SMTP_THROTTLE_CODES]
+        return throttled[0] if throttled else None
+    code = getattr(error, 'smtp_code', None)
+    if code in SMTP_THROTTLE_CODES:
+        return code
+    return None
+
+
+class AdaptiveThrottle:
+    """AIMD controller shared by every sender of one provider account"""
+
+    def __init__(self, rate_limiter: RateLimiter = None, max_concurrency: int = 8,
+                 min_concurrency: int = 1, decrease_factor: float = 0.5,
+                 rate_increase: float = 0.02, min_rate_scale: float = 0.05,
+                 base_backoff: float = 1.0, max_backoff: float = 300.0,
+                 name: str = 'default'):
+        self.name = name
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.decrease_factor = decrease_factor
+        self.rate_increase = rate_increase
+        self.min_rate_scale = min_rate_scale
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.limit = float(self.max_concurrency)
+        self.rate_scale = 1.0
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.consecutive_throttles = 0
+        self.condition = threading.Condition()
+
+        self.successes = 0
+        self.throttles = 0
+
+    def acquire(self):
+        """Wait for any provider pause to end and for a free in-flight slot"""
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    self.in_flight += 1
+                    return
+
+    def release(self):
+        """Free an in-flight slot"""
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Context manager around acquire()/release()"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def pause_remaining(self) -> float:
+        """Seconds left in the current provider pause (0 if none)"""
+        with self.condition:
+            return max(0.0, self.paused_until - time.monotonic())
+
+    def on_success(self):
+        """Additive increase: about one extra slot per window of successful sends"""
+        with self.condition:
+            self.successes += 1
+            self.consecutive_throttles = 0
+            if self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+                self.condition.notify_all()
+            if self.rate_scale < 1.0:
+                self._set_rate_scale(min(1.0, self.rate_scale + self.rate_increase))
+
+    def on_throttle(self, retry_after: float = None) -> float:
+        """Multiplicative decrease and a pause for everyone; returns the pause in seconds"""
+        with self.condition:
+            self.throttles += 1
+            self.consecutive_throttles += 1
+            self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+            self._set_rate_scale(max(self.min_rate_scale, self.rate_scale * self.decrease_factor))
+
+            if retry_after is None:
+                retry_after = min(self.max_backoff,
+                                  self.base_backoff * 2 ** (self.consecutive_throttles - 1))
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.condition.notify_all()
+            return retry_after
+
+    def _set_rate_scale(self, scale: float):
+        self.rate_scale = scale
+        if self.rate_limiter is not None:
+            self.rate_limiter.set_scale(scale)
+
+    def get_stats(self) -> Dict:
+        """Current limits and counters"""
+        with self.condition:
+            return {
+                'name': self.name,
+                'concurrency_limit': int(self.limit),
+                'max_concurrency': self.max_concurrency,
+                'rate_scale': round(self.rate_scale, 3),
+                'in_flight': self.in_flight,
+                'paused_for': round(max(0.0, self.paused_until - time.monotonic()), 2),
+                'successes': self.successes,
+                'throttles': self.throttles
+            }
+
+
+_throttles: Dict[Tuple[str, str], AdaptiveThrottle] = {}
+_throttles_lock = threading.Lock()
+
+
+def get_throttle(provider: str, account: str = None) -> AdaptiveThrottle:
+    """Shared throttle for a provider/account pair, driving that pair's rate limiter"""
+    account = (account or '').lower()
+    key = (provider, account)
+    with _throttles_lock:
+        throttle = _throttles.get(key)
+        if throttle is None:
+            throttle = AdaptiveThrottle(
+                rate_limiter=get_rate_limiter(provider, account),
+                max_concurrency=Config.SEND_CONCURRENCY,
+                name=f"{provider}:{account}" if account else provider
+            )
+            _throttles[key] = throttle
+        return throttle
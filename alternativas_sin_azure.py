@@ -116,6 +116,11 @@ def crear_sistema_gmail(email, password):
     gmail_system = f'''#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+# Generado por alternativas_sin_azure.py. No es un script independiente: usa
+# email_sender_smtp.py, rate_limiter.py, adaptive_throttle.py, config.py y sus
+# dependencias (smtp_pool.py, send_pool.py, template_engine.py, mime_template.py)
+# del sistema de emails; ejecútalo en la misma carpeta que esos módulos.
+
 import smtplib
 import ssl
 from email.mime.text import MIMEText
@@ -124,6 +129,9 @@ import time
 import logging
 from typing import List, Dict
 from tqdm import tqdm
+from rate_limiter import get_rate_limiter
+from adaptive_throttle import get_throttle
+from email_sender_smtp import EmailSenderSMTP
 
 # Configurar logging
 logging.basicConfig(
@@ -135,84 +143,48 @@ logging.basicConfig(
     ]
 )
 
-class GmailSender:
-    """Sistema de envío de emails usando Gmail SMTP"""
+class GmailSender(EmailSenderSMTP):
+    """Sistema de envío de emails usando Gmail SMTP (una sesión SMTP para muchos mensajes)"""
     
-    def __init__(self, email=None, password=None):
-        self.email = email or "{email}"
-        self.password = password or "{password}"
+    def __init__(self, email=None, password=None, **kwargs):
+        super().__init__(email or "{email}", password or "{password}", **kwargs)
         self.smtp_server = "smtp.gmail.com"
         self.smtp_port = 587
-        self.sent_count = 0
-        self.failed_count = 0
-        
-    def test_connection(self):
-        """Probar conexión SMTP con Gmail"""
-        try:
-            context = ssl.create_default_context()
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.email, self.password)
-                logging.info(f"✅ Conexión Gmail exitosa con {{self.email}}")
-                return True
-        except Exception as e:
-            logging.error(f"❌ Error de conexión Gmail: {{str(e)}}")
-            return False
-    
-    def send_email(self, to_email: str, subject: str, body: str, 
-                   sender_name: str = None) -> bool:
-        """Enviar un email usando Gmail SMTP"""
-        try:
-            msg = MIMEMultipart()
-            msg['From'] = f"{{sender_name or 'Tu Nombre'}} <{{self.email}}>"
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            msg.attach(MIMEText(body, 'html'))
-            
-            context = ssl.create_default_context()
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.email, self.password)
-                text = msg.as_string()
-                server.sendmail(self.email, to_email, text)
-                
-            self.sent_count += 1
-            logging.info(f"✅ Email enviado a {{to_email}}")
-            return True
-            
-        except Exception as e:
-            self.failed_count += 1
-            logging.error(f"❌ Error enviando email a {{to_email}}: {{str(e)}}")
-            return False
+        self.rate_limiter = get_rate_limiter('gmail', self.email)
+        self.throttle = get_throttle('gmail', self.email)
     
     def send_bulk_emails(self, emails: List[Dict], subject: str, 
                          template: str, sender_name: str = None) -> Dict:
         """Enviar emails en lote"""
         results = {{'total': len(emails), 'sent': 0, 'failed': 0, 'errors': []}}
         
-        if not self.test_connection():
+        # La sesión abierta aquí se reutiliza para todos los envíos
+        if not self.open_session():
             logging.error("❌ No se pudo establecer conexión Gmail")
             return results
         
-        with tqdm(total=len(emails), desc="Enviando emails") as pbar:
-            for email_data in emails:
-                try:
-                    # Personalizar contenido
-                    personalized_body = template.replace("{{{{name}}}}", email_data.get('name', ''))
-                    
-                    if self.send_email(email_data['email'], subject, personalized_body, sender_name):
-                        results['sent'] += 1
-                    else:
+        try:
+            with tqdm(total=len(emails), desc="Enviando emails") as pbar:
+                for email_data in emails:
+                    try:
+                        # Personalizar contenido
+                        personalized_body = template.replace("{{{{name}}}}", email_data.get('name', ''))
+                        
+                        if self.send_email(email_data['email'], subject, personalized_body, sender_name):
+                            results['sent'] += 1
+                        else:
+                            results['failed'] += 1
+                            results['errors'].append(f"Error enviando a {{email_data['email']}}")
+                        
+                        pbar.update(1)
+                        
+                    except Exception as e:
                         results['failed'] += 1
-                        results['errors'].append(f"Error enviando a {{email_data['email']}}")
-                    
-                    time.sleep(2)  # Delay entre emails
-                    pbar.update(1)
-                    
-                except Exception as e:
-                    results['failed'] += 1
-                    results['errors'].append(f"Error con {{email_data['email']}}: {{str(e)}}")
-                    pbar.update(1)
+                        results['errors'].append(f"Error con {{email_data['email']}}: {{str(e)}}")
+                        pbar.update(1)
+        finally:
+            # Cerrar la sesión aunque el envío se interrumpa
+            self.close_session()
         
         logging.info(f"✅ Envío completado: {{results['sent']}} enviados, {{results['failed']}} fallidos")
         return results
@@ -263,6 +235,7 @@ if __name__ == "__main__":
         with open('gmail_sender.py', 'w', encoding='utf-8') as f:
             f.write(gmail_system)
         print("✅ Sistema Gmail creado: gmail_sender.py")
+        print("ℹ️  Usa email_sender_smtp.py y los módulos del sistema: ejecútalo en esta carpeta")
         print("🚀 Ejecuta: python gmail_sender.py")
         return True
     except Exception as e:
@@ -370,6 +343,7 @@ import time
 import logging
 from typing import List, Dict
 from tqdm import tqdm
+from rate_limiter import get_rate_limiter
 
 # Configurar logging
 logging.basicConfig(
@@ -393,6 +367,7 @@ class SendGridSender:
         }}
         self.sent_count = 0
         self.failed_count = 0
+        self.rate_limiter = get_rate_limiter('sendgrid')
         
     def test_connection(self):
         """Probar conexión con SendGrid"""
@@ -432,6 +407,7 @@ class SendGridSender:
                 ]
             }}
             
+            self.rate_limiter.acquire()
             response = requests.post(
                 f"{{self.base_url}}/mail/send",
                 headers=self.headers,
@@ -473,7 +449,6 @@ class SendGridSender:
                         results['failed'] += 1
                         results['errors'].append(f"Error enviando a {{email_data['email']}}")
                     
-                    time.sleep(1)  # Delay entre emails
                     pbar.update(1)
                     
                 except Exception as e:
@@ -4,8 +4,9 @@ Sistema de Emails Masivos - Versión Web
 Interfaz web moderna y fácil de usar
 """
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for, flash
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, or_, tuple_
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import json
@@ -13,13 +14,23 @@ import pandas as pd
 from datetime import datetime, timezone
 import threading
 import time
+import functools
+import base64
 from email_sender import EmailSender
 from sendgrid_definitivo import SendGridDefinitive as SendGridSender
 from config import Config
+from template_engine import compile_template, referenced_fields
+from outbound_queue import get_outbound_queue, SENT, FAILED
+from campaign_progress import CampaignProgress
+from send_pool import run_pool
+from db_migrations import run_migrations
+from contact_ingest import (CountingReader, bulk_insert_contacts, clean_contacts, iter_csv_contacts,
+                            open_multipart_file, open_text_stream, parse_contact_lines, sync_contacts,
+                            unique_contacts)
 
 app = Flask(__name__)
 app.secret_key = 'tu_clave_secreta_aqui_2024'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///emails.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///emails.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
@@ -42,15 +53,31 @@ class EmailList(db.Model):
     
     # Relación con contactos
     contacts = db.relationship('EmailContact', backref='email_list', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        db.Index('ix_email_list_user_id_created_at', 'user_id', 'created_at'),
+    )
 
 class EmailContact(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), nullable=False)
-    name = db.Column(db.String(100))
-    company = db.Column(db.String(100))
+    name = db.Column(db.String(100), default='')
+    company = db.Column(db.String(100), default='')
     phone = db.Column(db.String(20))
     list_id = db.Column(db.Integer, db.ForeignKey('email_list.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    
+    # Keyset por lista (list_id, id), un mismo email solo una vez por lista (sin
+    # distinguir mayúsculas, como la importación) y un índice (list_id, columna, id)
+    # por cada orden de view_list
+    __table_args__ = (
+        db.Index('ix_email_contact_list_id_id', 'list_id', 'id'),
+        db.Index('uq_email_contact_list_lower_email', 'list_id', db.text('lower(email)'), unique=True),
+        db.Index('ix_email_contact_list_id_email_id', 'list_id', 'email', 'id'),
+        db.Index('ix_email_contact_list_id_name_id', 'list_id', 'name', 'id'),
+        db.Index('ix_email_contact_list_id_company_id', 'list_id', 'company', 'id'),
+        db.Index('ix_email_contact_list_id_created_at_id', 'list_id', 'created_at', 'id'),
+    )
 
 class EmailTemplate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -59,6 +86,10 @@ class EmailTemplate(db.Model):
     content = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        db.Index('ix_email_template_user_id_created_at', 'user_id', 'created_at'),
+    )
 
 class EmailCampaign(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -72,10 +103,20 @@ class EmailCampaign(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
     started_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_email_campaign_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_email_campaign_list_id', 'list_id'),
+    )
+
+# Campos de contacto disponibles como {{variable}} en los templates
+CONTACT_FIELDS = ('email', 'name', 'company', 'phone')
 
 # Crear tablas
 with app.app_context():
     db.create_all()
+    # Índices y restricciones añadidos después de crear la base de datos
+    run_migrations(db.engine)
     
     # Crear usuario por defecto si no existe
     default_user = User.query.filter_by(username='admin').first()
@@ -268,8 +309,11 @@ with app.app_context():
         print("ℹ️ Lista de prueba ya existe")
 
 # Variables globales para el estado de envío
-sending_status = {}
-current_campaigns = {}
+sending_status = {}  # campaign_id -> CampaignProgress de las campañas en envío
+current_campaigns = {}  # campaign_id -> hilo de envío activo
+campaigns_lock = threading.Lock()
+import_status = {}  # list_id -> progreso de la última importación de fichero
+import_lock = threading.Lock()
 
 @app.route('/favicon.ico')
 def favicon():
@@ -325,9 +369,9 @@ def dashboard():
     session['user_id'] = default_user.id
     session['username'] = default_user.username
     
-    campaigns = EmailCampaign.query.filter_by(user_id=default_user.id).order_by(EmailCampaign.created_at.desc()).limit(5)
-    lists = EmailList.query.filter_by(user_id=default_user.id).count()
-    templates = EmailTemplate.query.filter_by(user_id=default_user.id).count()
+    campaigns = recent_campaigns_query(default_user.id)
+    lists = user_lists_query(default_user.id).count()
+    templates = user_templates_query(default_user.id).count()
     
     return render_template('dashboard.html', 
                          user=default_user, 
@@ -341,8 +385,9 @@ def lists():
     default_user = User.query.filter_by(username='admin').first()
     if default_user:
         session['user_id'] = default_user.id
-        user_lists = EmailList.query.filter_by(user_id=default_user.id).all()
-        return render_template('lists.html', lists=user_lists)
+        user_lists = user_lists_query(default_user.id).all()
+        return render_template('lists.html', lists=user_lists,
+                               contact_counts=count_contacts_by_list([l.id for l in user_lists]))
     return redirect(url_for('dashboard'))
 
 @app.route('/lists/<int:list_id>')
@@ -359,8 +404,126 @@ def view_list(list_id):
         flash('Acceso denegado', 'error')
         return redirect(url_for('lists'))
     
-    contacts = EmailContact.query.filter_by(list_id=list_id).all()
-    return render_template('view_list.html', email_list=email_list, contacts=contacts)
+    # Una página (keyset) con búsqueda y orden en el servidor; el resto llega por /api/.../contacts
+    try:
+        page = contact_page(list_id, **contact_page_args(request.args))
+    except ValueError:
+        return redirect(url_for('view_list', list_id=list_id))
+    return render_template('view_list.html', email_list=email_list, contacts=page['contacts'],
+                           next_cursor=page['next'], contact_count=count_contacts(list_id),
+                           q=page['q'], sort=page['sort'], direction=page['direction'])
+
+@app.route('/api/lists/<int:list_id>/contacts')
+def list_contacts_api(list_id):
+    """Páginas JSON de contactos para el scroll infinito de view_list"""
+    # Usar usuario por defecto automáticamente
+    default_user = User.query.filter_by(username='admin').first()
+    if not default_user:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    session['user_id'] = default_user.id
+    
+    email_list = EmailList.query.get_or_404(list_id)
+    if email_list.user_id != default_user.id:
+        return jsonify({'error': 'Acceso denegado'}), 403
+    
+    try:
+        page = contact_page(list_id, **contact_page_args(request.args))
+    except ValueError:
+        return jsonify({'error': 'Cursor no válido'}), 400
+    page['contacts'] = [contact_json(contact) for contact in page['contacts']]
+    return jsonify(page)
+
+# Columnas por las que se puede ordenar view_list (desempate siempre por id); cada una
+# tiene su índice (list_id, columna, id), así que ninguna página ordena la lista entera
+CONTACT_SORTS = {
+    'id': EmailContact.id,
+    'email': EmailContact.email,
+    'name': EmailContact.name,
+    'company': EmailContact.company,
+    'created': EmailContact.created_at
+}
+
+def encode_cursor(value, contact_id):
+    """Cursor opaco con la clave de orden y el id del último contacto de la página"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, contact_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor, sort):
+    try:
+        value, contact_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if sort == 'created':
+            value = datetime.fromisoformat(value)
+        return value, int(contact_id)
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise ValueError(f"Cursor no válido: {cursor}") from e
+
+def contact_page_args(args):
+    """Parámetros de paginación de la query string"""
+    return {
+        'q': args.get('q', '').strip(),
+        'sort': args.get('sort', 'id'),
+        'direction': args.get('dir', 'asc'),
+        'cursor': args.get('after') or None,
+        'limit': args.get('limit', type=int)
+    }
+
+def contact_page(list_id, q='', sort='id', direction='asc', cursor=None, limit=None):
+    """Una página de contactos ordenada por (sort, id), empezando tras el cursor.
+    
+    WHERE (clave, id) > (cursor) + LIMIT sobre el índice (list_id, clave, id): sin
+    búsqueda, el coste no depende de la página ni del tamaño de la lista. Con q, el
+    ILIKE '%q%' no puede usar índice: se recorren en orden los contactos de la lista
+    hasta llenar la página, así que una búsqueda con pocos resultados lee la lista entera.
+    """
+    if sort not in CONTACT_SORTS:
+        sort = 'id'
+    if direction not in ('asc', 'desc'):
+        direction = 'asc'
+    limit = max(1, min(limit or Config.CONTACT_PAGE_SIZE, Config.CONTACT_PAGE_MAX))
+    
+    # Una fila de más para saber si hay otra página
+    rows = contact_page_query(list_id, q, sort, direction, cursor).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].sort_key, rows[limit - 1].id) if len(rows) > limit else None
+    return {'contacts': rows[:limit], 'next': next_cursor, 'q': q, 'sort': sort, 'direction': direction}
+
+def contact_page_query(list_id, q, sort, direction, cursor=None):
+    """Consulta (sin LIMIT) de contact_page; verificar_indices.py comprueba su plan"""
+    # Sin coalesce(): la clave tiene que ser la columna indexada. name y company se
+    # guardan como '' (nunca NULL) para que el keyset pueda compararlas
+    key = CONTACT_SORTS[sort]
+    
+    query = db.session.query(EmailContact.id, EmailContact.email, EmailContact.name, EmailContact.company,
+                             EmailContact.phone, EmailContact.created_at, key.label('sort_key')) \
+        .filter(EmailContact.list_id == list_id)
+    if q:
+        pattern = f"%{q}%"
+        query = query.filter(or_(EmailContact.email.ilike(pattern), EmailContact.name.ilike(pattern),
+                                 EmailContact.company.ilike(pattern)))
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        if sort == 'id':
+            query = query.filter(EmailContact.id > last_id if direction == 'asc' else EmailContact.id < last_id)
+        elif direction == 'asc':
+            query = query.filter(tuple_(key, EmailContact.id) > tuple_(value, last_id))
+        else:
+            query = query.filter(tuple_(key, EmailContact.id) < tuple_(value, last_id))
+    
+    if direction == 'asc':
+        return query.order_by(key.asc(), EmailContact.id.asc())
+    return query.order_by(key.desc(), EmailContact.id.desc())
+
+def contact_json(contact):
+    return {
+        'id': contact.id,
+        'email': contact.email,
+        'name': contact.name,
+        'company': contact.company,
+        'phone': contact.phone,
+        'created_at': contact.created_at.strftime('%d/%m/%Y %H:%M') if contact.created_at else None
+    }
 
 @app.route('/lists/<int:list_id>/edit', methods=['GET', 'POST'])
 def edit_list(list_id):
@@ -380,37 +543,125 @@ def edit_list(list_id):
         email_list.name = request.form['name']
         emails_data = request.form['emails_data']
         
-        # Eliminar contactos existentes
-        EmailContact.query.filter_by(list_id=list_id).delete()
+        # Lista demasiado grande para el textarea: las líneas se añaden (sin repetir emails).
+        # Se decide aquí y no solo por el campo oculto: un formulario antiguo o un POST directo
+        # sin mode=append borraría con sync_contacts todo lo que no cabía en el textarea
+        if request.form.get('mode') == 'append' or count_contacts(list_id) > Config.EDIT_TEXTAREA_LIMIT:
+            seen = {email.lower() for _, email in iter_contact_rows(list_id, [EmailContact.email])}
+            stats = {'processed': 0, 'duplicates': 0, 'invalid': 0}
+            added = bulk_insert_contacts(db.session, EmailContact.__table__, list_id,
+                                         clean_contacts(parse_contact_lines(emails_data), seen, stats),
+                                         chunk_size=Config.CONTACT_CHUNK_SIZE)
+            db.session.commit()
+            flash(f"Lista actualizada exitosamente ({added} nuevos, {stats['duplicates']} duplicados, "
+                  f"{stats['invalid']} inválidos)", 'success')
+            return redirect(url_for('lists'))
         
-        # Procesar nuevos emails
-        lines = emails_data.strip().split('\n')
-        for line in lines:
-            if line.strip():
-                parts = line.split(',')
-                email = parts[0].strip()
-                name = parts[1].strip() if len(parts) > 1 else ''
-                company = parts[2].strip() if len(parts) > 2 else ''
-                phone = parts[3].strip() if len(parts) > 3 else ''
-                
-                contact = EmailContact(
-                    email=email,
-                    name=name,
-                    company=company,
-                    phone=phone,
-                    list_id=email_list.id
-                )
-                db.session.add(contact)
+        # Comparar con los contactos guardados: solo se tocan las filas que cambian
+        existing = iter_contact_rows(list_id, [EmailContact.email, EmailContact.name,
+                                               EmailContact.company, EmailContact.phone])
+        changes = sync_contacts(db.session, EmailContact.__table__, list_id,
+                                parse_contact_lines(emails_data), existing,
+                                chunk_size=Config.CONTACT_CHUNK_SIZE)
         
         db.session.commit()
-        flash('Lista actualizada exitosamente', 'success')
+        flash(f"Lista actualizada exitosamente ({changes['inserted']} nuevos, "
+              f"{changes['updated']} modificados, {changes['deleted']} eliminados)", 'success')
         return redirect(url_for('lists'))
     
-    # Obtener contactos actuales para mostrar en el formulario
-    contacts = EmailContact.query.filter_by(list_id=list_id).all()
-    emails_data = '\n'.join([f"{c.email}, {c.name}, {c.company}, {c.phone}" for c in contacts])
+    # Obtener contactos actuales para mostrar en el formulario (solo si caben en el textarea)
+    contact_count = count_contacts(list_id)
+    append_only = contact_count > Config.EDIT_TEXTAREA_LIMIT
+    emails_data = ''
+    if not append_only:
+        rows = iter_contact_rows(list_id, [EmailContact.email, EmailContact.name,
+                                           EmailContact.company, EmailContact.phone])
+        emails_data = '\n'.join(f"{email}, {name or ''}, {company or ''}, {phone or ''}"
+                                 for _, email, name, company, phone in rows)
+    
+    return render_template('edit_list.html', email_list=email_list, emails_data=emails_data,
+                           append_only=append_only, contact_count=contact_count)
+
+@app.route('/lists/<int:list_id>/import', methods=['POST'])
+def import_list(list_id):
+    """Importar un CSV/TSV: se lee del cuerpo de la petición a medida que llega
+    (o del campo 'file' de un formulario multipart, decodificado también según
+    llega, sin pasar por request.files), validando, quitando duplicados e
+    insertando por bloques."""
+    # Usar usuario por defecto automáticamente
+    default_user = User.query.filter_by(username='admin').first()
+    if not default_user:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    session['user_id'] = default_user.id
+    
+    email_list = EmailList.query.get_or_404(list_id)
+    if email_list.user_id != default_user.id:
+        return jsonify({'error': 'Acceso denegado'}), 403
     
-    return render_template('edit_list.html', email_list=email_list, emails_data=emails_data)
+    status = {
+        'list_id': list_id, 'user_id': default_user.id, 'status': 'running',
+        'filename': request.args.get('filename'),
+        'bytes_read': 0, 'total_bytes': request.content_length,
+        'processed': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0
+    }
+    # Comprobar y registrar a la vez: dos subidas simultáneas no pasan las dos
+    with import_lock:
+        current = import_status.get(list_id)
+        if current is not None and current['status'] == 'running':
+            return jsonify({'error': 'Ya hay una importación en curso para esta lista'}), 409
+        import_status[list_id] = status
+    
+    def on_read(count):
+        status['bytes_read'] += count
+    
+    def on_chunk(count):
+        # Cada bloque queda confirmado: el progreso es visible y la sesión no acumula filas
+        db.session.commit()
+        status['inserted'] += count
+    
+    try:
+        # Los emails ya guardados en la lista cuentan como duplicados
+        seen = {email.lower() for _, email in iter_contact_rows(list_id, [EmailContact.email])}
+        if request.mimetype == 'multipart/form-data':
+            # request.files leería y guardaría todo el cuerpo antes de devolver el fichero
+            upload = open_multipart_file(CountingReader(request.stream, on_read),
+                                         request.mimetype_params.get('boundary', '').encode('latin-1'))
+            status['filename'] = upload.filename or status['filename']
+            stream = open_text_stream(upload)
+        else:
+            stream = open_text_stream(request.stream, on_read)
+        rows = clean_contacts(iter_csv_contacts(stream, request.args.get('delimiter')), seen, status)
+        bulk_insert_contacts(db.session, EmailContact.__table__, list_id, rows,
+                             chunk_size=Config.CONTACT_CHUNK_SIZE, on_chunk=on_chunk)
+        status['status'] = 'completed'
+    except Exception as e:
+        db.session.rollback()
+        status['status'] = 'failed'
+        status['error'] = str(e)
+        print(f"❌ Error importando contactos en la lista {list_id}: {e}")
+        return jsonify(status), 400
+    
+    print(f"📥 Importados {status['inserted']} contactos en la lista {list_id} "
+          f"({status['duplicates']} duplicados, {status['invalid']} inválidos)")
+    return jsonify(status)
+
+@app.route('/api/lists/<int:list_id>/import-status')
+def import_list_status(list_id):
+    """Progreso de la importación en curso (o la última) de una lista"""
+    # Usar usuario por defecto automáticamente
+    default_user = User.query.filter_by(username='admin').first()
+    if not default_user:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    session['user_id'] = default_user.id
+    
+    status = import_status.get(list_id)
+    if status is None:
+        return jsonify({'list_id': list_id, 'status': 'idle'})
+    if status['user_id'] != default_user.id:
+        return jsonify({'error': 'Acceso denegado'}), 403
+    return jsonify(status)
 
 @app.route('/lists/create', methods=['GET', 'POST'])
 def create_list():
@@ -428,26 +679,12 @@ def create_list():
         # Crear lista
         email_list = EmailList(name=name, user_id=default_user.id)
         db.session.add(email_list)
-        db.session.commit()
+        db.session.flush()
         
-        # Procesar emails
-        lines = emails_data.strip().split('\n')
-        for line in lines:
-            if line.strip():
-                parts = line.split(',')
-                email = parts[0].strip()
-                name = parts[1].strip() if len(parts) > 1 else ''
-                company = parts[2].strip() if len(parts) > 2 else ''
-                phone = parts[3].strip() if len(parts) > 3 else ''
-                
-                contact = EmailContact(
-                    email=email,
-                    name=name,
-                    company=company,
-                    phone=phone,
-                    list_id=email_list.id
-                )
-                db.session.add(contact)
+        # Procesar emails: INSERT por bloques, sin un objeto ORM por contacto (un email por lista)
+        bulk_insert_contacts(db.session, EmailContact.__table__, email_list.id,
+                             unique_contacts(parse_contact_lines(emails_data)),
+                             chunk_size=Config.CONTACT_CHUNK_SIZE)
         
         db.session.commit()
         flash('Lista creada exitosamente', 'success')
@@ -461,7 +698,7 @@ def templates():
     default_user = User.query.filter_by(username='admin').first()
     if default_user:
         session['user_id'] = default_user.id
-        user_templates = EmailTemplate.query.filter_by(user_id=default_user.id).all()
+        user_templates = user_templates_query(default_user.id).all()
         return render_template('templates.html', templates=user_templates)
     return redirect(url_for('dashboard'))
 
@@ -499,7 +736,7 @@ def campaigns():
     default_user = User.query.filter_by(username='admin').first()
     if default_user:
         session['user_id'] = default_user.id
-        user_campaigns = EmailCampaign.query.filter_by(user_id=default_user.id).all()
+        user_campaigns = user_campaigns_query(default_user.id).all()
         return render_template('campaigns.html', campaigns=user_campaigns)
     return redirect(url_for('dashboard'))
 
@@ -529,9 +766,10 @@ def create_campaign():
         flash('Campaña creada exitosamente', 'success')
         return redirect(url_for('campaigns'))
     
-    templates = EmailTemplate.query.filter_by(user_id=default_user.id).all()
-    lists = EmailList.query.filter_by(user_id=default_user.id).all()
-    return render_template('create_campaign.html', templates=templates, lists=lists)
+    templates = user_templates_query(default_user.id).all()
+    lists = user_lists_query(default_user.id).all()
+    return render_template('create_campaign.html', templates=templates, lists=lists,
+                           contact_counts=count_contacts_by_list([l.id for l in lists]))
 
 @app.route('/campaigns/<int:campaign_id>')
 def view_campaign(campaign_id):
@@ -547,13 +785,15 @@ def view_campaign(campaign_id):
         flash('Acceso denegado', 'error')
         return redirect(url_for('campaigns'))
     
-    # Obtener contactos de la lista
-    contacts = EmailContact.query.filter_by(list_id=campaign.list_id).all()
+    # Obtener contactos de la lista: el total con COUNT(*) y solo una muestra para la tabla
+    contact_count = count_contacts(campaign.list_id)
+    contacts = contact_preview_query(campaign.list_id).all()
     
     # Obtener template
     template = EmailTemplate.query.get(campaign.template_id)
     
-    return render_template('view_campaign.html', campaign=campaign, contacts=contacts, template=template)
+    return render_template('view_campaign.html', campaign=campaign, contacts=contacts,
+                           contact_count=contact_count, template=template)
 
 @app.route('/campaigns/<int:campaign_id>/start')
 def start_campaign(campaign_id):
@@ -569,24 +809,215 @@ def start_campaign(campaign_id):
         flash('Acceso denegado', 'error')
         return redirect(url_for('campaigns'))
     
+    if campaign_in_progress(campaign_id):
+        flash('La campaña ya se está enviando', 'info')
+        return redirect(url_for('campaigns'))
+    
     # Actualizar el total_count antes de iniciar
-    contacts = EmailContact.query.filter_by(list_id=campaign.list_id).all()
-    campaign.total_count = len(contacts)
+    campaign.total_count = count_contacts(campaign.list_id)
     campaign.status = 'running'
     campaign.started_at = datetime.now(timezone.utc)
     db.session.commit()
     
     # Iniciar envío en background
-    thread = threading.Thread(target=send_campaign_emails, args=(campaign_id,))
-    thread.daemon = True
-    thread.start()
+    if not launch_campaign(campaign_id):
+        flash('La campaña ya se está enviando', 'info')
+        return redirect(url_for('campaigns'))
     
     flash('Campaña iniciada', 'success')
     return redirect(url_for('campaigns'))
 
+@app.route('/campaigns/<int:campaign_id>/resume')
+def resume_campaign(campaign_id):
+    # Usar usuario por defecto automáticamente
+    default_user = User.query.filter_by(username='admin').first()
+    if not default_user:
+        return redirect(url_for('dashboard'))
+    
+    session['user_id'] = default_user.id
+    
+    campaign = EmailCampaign.query.get_or_404(campaign_id)
+    if campaign.user_id != default_user.id:
+        flash('Acceso denegado', 'error')
+        return redirect(url_for('campaigns'))
+    
+    if campaign_in_progress(campaign_id):
+        flash('La campaña ya se está enviando', 'info')
+        return redirect(url_for('campaigns'))
+    
+    # Ningún proceso vivo envía esta campaña: todo lo reclamado y no confirmado
+    # vuelve a la cola, y los fallidos definitivos tienen otra tanda de reintentos
+    queue = get_outbound_queue()
+    queue.recover(campaign_id, lease=0)
+    queue.retry_failed(campaign_id)
+    
+    campaign.status = 'running'
+    campaign.completed_at = None
+    db.session.commit()
+    
+    launch_campaign(campaign_id)
+    
+    flash('Campaña reanudada: solo se envían los destinatarios pendientes', 'success')
+    return redirect(url_for('campaigns'))
+
+def campaign_fields(template):
+    """Campos de contacto que usa el template (asunto y contenido), siempre con el email"""
+    return [field for field in referenced_fields(compile_template(template.subject),
+                                                 compile_template(template.content))
+            if field in CONTACT_FIELDS]
+
+# Consultas frecuentes: las rutas las construyen aquí y verificar_indices.py comprueba
+# con EXPLAIN QUERY PLAN que cada una usa un índice
+def user_lists_query(user_id):
+    return EmailList.query.filter_by(user_id=user_id)
+
+def user_templates_query(user_id):
+    return EmailTemplate.query.filter_by(user_id=user_id)
+
+def user_campaigns_query(user_id):
+    return EmailCampaign.query.filter_by(user_id=user_id)
+
+def recent_campaigns_query(user_id, limit=5):
+    """Últimas campañas del usuario (dashboard)"""
+    return user_campaigns_query(user_id).order_by(EmailCampaign.created_at.desc()).limit(limit)
+
+def contact_count_query(list_id):
+    return db.session.query(func.count(EmailContact.id)).filter(EmailContact.list_id == list_id)
+
+def contact_counts_query(list_ids):
+    return db.session.query(EmailContact.list_id, func.count(EmailContact.id)) \
+        .filter(EmailContact.list_id.in_(list_ids)).group_by(EmailContact.list_id)
+
+def contact_rows_query(list_id, columns, after_id, limit):
+    """Una página keyset (id > after_id) de iter_contact_rows"""
+    return db.session.query(EmailContact.id, *columns) \
+        .filter(EmailContact.list_id == list_id, EmailContact.id > after_id) \
+        .order_by(EmailContact.id).limit(limit)
+
+def contact_preview_query(list_id):
+    """Muestra de contactos de la vista de campaña"""
+    return EmailContact.query.filter_by(list_id=list_id).order_by(EmailContact.id) \
+        .limit(Config.CONTACT_PREVIEW_LIMIT)
+
+def count_contacts(list_id):
+    """Número de contactos de una lista (COUNT(*), sin cargar filas)"""
+    return contact_count_query(list_id).scalar()
+
+def count_contacts_by_list(list_ids):
+    """{list_id: contactos} para varias listas en una sola consulta"""
+    if not list_ids:
+        return {}
+    return dict(contact_counts_query(list_ids).all())
+
+def iter_contact_rows(list_id, columns, after_id=0, chunk_size=None):
+    """Tuplas (id, *columnas) de una lista en orden de id, leídas por páginas keyset (id > último).
+    
+    Cada página es una consulta corta con LIMIT, así que la memoria no depende del tamaño de la lista.
+    """
+    chunk_size = chunk_size or Config.CONTACT_CHUNK_SIZE
+    while True:
+        rows = contact_rows_query(list_id, columns, after_id, chunk_size).all()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after_id = rows[-1][0]
+
+def iter_campaign_contacts(list_id, fields, after_id=0, defaults=None):
+    """(id, datos) de cada contacto de la lista con id > after_id, cargando solo los campos indicados.
+    
+    Un campo vacío ('' o NULL) toma su valor por defecto: {{name}} es 'Usuario'.
+    """
+    defaults = defaults or {'name': 'Usuario'}
+    rows = iter_contact_rows(list_id, [getattr(EmailContact, field) for field in fields], after_id)
+    for contact_id, *values in rows:
+        yield contact_id, {field: value or defaults.get(field, '')
+                           for field, value in zip(fields, values)}
+
+def save_campaign_progress(engine, campaign_id, sent_count):
+    """Escribir sent_count directamente (se llama desde los hilos de envío, sin sesión ORM)"""
+    table = EmailCampaign.__table__
+    with engine.begin() as conn:
+        conn.execute(table.update().where(table.c.id == campaign_id).values(sent_count=sent_count))
+
+def campaign_claim_size(sender):
+    """Destinatarios por reclamación de la cola: lo que un worker envía de una vez.
+    
+    En modo batch es una petición completa (max_personalizations destinatarios);
+    si no, un lote de OUTBOUND_CLAIM_BATCH que el worker envía uno a uno.
+    """
+    if Config.SENDGRID_BATCH_MODE:
+        return getattr(sender, 'max_personalizations', Config.OUTBOUND_CLAIM_BATCH)
+    return Config.OUTBOUND_CLAIM_BATCH
+
+def send_claimed(queue, items, sender, template, progress=None):
+    """Enviar un lote reclamado, confirmando cada destinatario en la cola en cuanto tiene resultado"""
+    # La clave de idempotencia viaja con cada destinatario (cabecera X-Idempotency-Key)
+    emails_data = [dict(item.data, idempotency_key=item.idempotency_key) for item in items]
+    claimed = {id(email_data): item for email_data, item in zip(emails_data, items)}
+    reported = set()
+    
+    def on_result(email_data, error):
+        item = claimed[id(email_data)]
+        reported.add(item.id)
+        if error is None:
+            queue.mark_sent([item.id])
+            if progress is not None:
+                progress.record(sent=1)
+        # Un fallo solo cuenta como error cuando ya no quedan reintentos (mark_failed)
+        elif queue.mark_failed([(item, str(error))]) and progress is not None:
+            progress.record(errors=1)
+    
+    try:
+        sender.send_bulk_emails(
+            emails_data,
+            template.subject,
+            template.content,
+            "El Chicher",
+            "el_chicher@hotmail.com",
+            batch_mode=Config.SENDGRID_BATCH_MODE,
+            on_result=on_result,
+            check_connection=False
+        )
+    finally:
+        # Sin resultado (p. ej. excepción en el envío): reintentar como cualquier fallo
+        final = queue.mark_failed([(item, 'Sin resultado del envío') for item in items
+                                   if item.id not in reported])
+        if progress is not None and final:
+            progress.record(errors=len(final))
+
+def drain_campaign_queue(queue, campaign_id, sender, template, progress=None):
+    """Enviar los destinatarios pendientes de la cola con SEND_WORKERS workers.
+    
+    Cada worker reclama su lote (campaign_claim_size) solo cuando queda libre, así
+    que en in_flight no hay más filas que los lotes que se están enviando; cada
+    destinatario se confirma al recibir su resultado. Tras una caída solo pueden
+    repetirse los envíos que estaban en vuelo.
+    """
+    claim_size = campaign_claim_size(sender)
+    
+    def worker(_):
+        while True:
+            items = queue.claim(campaign_id, claim_size)
+            if not items:
+                return
+            try:
+                send_claimed(queue, items, sender, template, progress)
+            except Exception as e:
+                # send_claimed ya devolvió el lote a la cola como fallo; el worker sigue
+                print(f"❌ Error enviando un lote de la campaña {campaign_id}: {e}")
+    
+    while True:
+        run_pool(range(max(1, Config.SEND_WORKERS)), worker, Config.SEND_WORKERS)
+        # Los fallos reintentables vuelven a la cola cuando vence su retry_at
+        wait = queue.next_retry_in(campaign_id)
+        if wait is None:
+            return
+        time.sleep(wait)
+
 def send_campaign_emails(campaign_id):
-    """Función para enviar emails en background usando SendGrid"""
+    """Función para enviar emails en background usando SendGrid (drenando la cola de salida)"""
     campaign = None
+    acquired = False
     try:
         # Crear contexto de aplicación para el hilo
         with app.app_context():
@@ -597,10 +1028,31 @@ def send_campaign_emails(campaign_id):
             
             print(f"🚀 Iniciando envío de campaña: {campaign.name} (ID: {campaign_id})")
             
-            # Obtener contactos PRIMERO
-            contacts = EmailContact.query.filter_by(list_id=campaign.list_id).all()
-            total_contacts = len(contacts)
-            print(f"📋 Total de contactos encontrados: {total_contacts}")
+            # Obtener template
+            template = db.session.get(EmailTemplate, campaign.template_id)
+            if not template:
+                print(f"❌ Template {campaign.template_id} no encontrado")
+                campaign.status = 'failed'
+                db.session.commit()
+                return
+            
+            # Encolar los contactos posteriores al último checkpoint: solo las columnas
+            # que el template usa (y el email); los ya encolados o enviados se saltan
+            queue = get_outbound_queue()
+            # Un solo proceso vivo envía cada campaña
+            acquired = queue.acquire_campaign(campaign_id)
+            if not acquired:
+                print(f"⏭️ La campaña {campaign_id} ya se está enviando en otro proceso")
+                return
+            checkpoint = queue.checkpoint(campaign_id)
+            queued = queue.enqueue(campaign_id, iter_campaign_contacts(campaign.list_id,
+                                                                       campaign_fields(template),
+                                                                       after_id=checkpoint))
+            print(f"📥 {queued} destinatarios encolados (desde el contacto {checkpoint})")
+            
+            counts = queue.counts(campaign_id)
+            total_contacts = sum(counts.values())
+            print(f"📋 Total de contactos encontrados: {total_contacts} ({counts[SENT]} ya enviados)")
             
             # Actualizar el total_count de la campaña
             campaign.total_count = total_contacts
@@ -612,19 +1064,11 @@ def send_campaign_emails(campaign_id):
                 db.session.commit()
                 return
             
-            # Obtener template
-            template = db.session.get(EmailTemplate, campaign.template_id)
-            if not template:
-                print(f"❌ Template {campaign.template_id} no encontrado")
-                campaign.status = 'failed'
-                db.session.commit()
-                return
-            
             # USAR SENDGRID PARA ENVÍO REAL
             print(f"📧 Usando SendGrid para envío REAL de emails")
             
-            # Crear sender de SendGrid
-            sender = SendGridSender()
+            # Crear sender de SendGrid (una conexión del pool por worker)
+            sender = SendGridSender(pool_size=max(10, Config.SEND_WORKERS))
             
             # Probar conexión con SendGrid
             if not sender.test_connection():
@@ -635,32 +1079,33 @@ def send_campaign_emails(campaign_id):
             
             print(f"✅ Conexión SendGrid exitosa - Iniciando envío real")
             
-            # Preparar datos para envío en lote
-            emails_data = []
-            for contact in contacts:
-                emails_data.append({
-                    'email': contact.email,
-                    'name': contact.name or 'Usuario'
-                })
-            
-            # Enviar emails usando SendGrid
-            results = sender.send_bulk_emails(
-                emails_data,
-                template.subject,
-                template.content,
-                "El Chicher",
-                "el_chicher@hotmail.com"
+            # Progreso en memoria para /api/campaign-status, guardado en la campaña
+            # cada PROGRESS_FLUSH_EVERY envíos o PROGRESS_FLUSH_INTERVAL segundos
+            progress = CampaignProgress(
+                campaign_id, total_contacts, sent=counts[SENT], errors=counts[FAILED], user_id=campaign.user_id,
+                flush=functools.partial(save_campaign_progress, db.engine),
+                flush_every=Config.PROGRESS_FLUSH_EVERY,
+                flush_interval=Config.PROGRESS_FLUSH_INTERVAL
             )
+            sending_status[campaign_id] = progress
+            
+            # Enviar emails usando SendGrid, lote a lote desde la cola
+            drain_campaign_queue(queue, campaign_id, sender, template, progress)
+            progress.flush()
+            print(f"🔌 Conexiones SendGrid: {sender.get_connection_stats()}")
+            sender.close()
             
             # Actualizar estadísticas de la campaña
-            campaign.sent_count = results['sent']
+            counts = queue.counts(campaign_id)
+            campaign.sent_count = counts[SENT]
             campaign.status = 'completed'
             campaign.completed_at = datetime.now(timezone.utc)
             db.session.commit()
+            progress.finish('completed')
             
-            print(f"✅ Campaña completada con SendGrid: {results['sent']}/{total_contacts} emails enviados")
-            if results['failed'] > 0:
-                print(f"⚠️ {results['failed']} emails fallaron")
+            print(f"✅ Campaña completada con SendGrid: {counts[SENT]}/{total_contacts} emails enviados")
+            if counts[FAILED] > 0:
+                print(f"⚠️ {counts[FAILED]} emails fallaron")
             
             return
             
@@ -674,6 +1119,66 @@ def send_campaign_emails(campaign_id):
                     print(f"❌ Campaña marcada como fallida debido a error: {e}")
             except Exception as commit_error:
                 print(f"❌ Error al marcar campaña como fallida: {commit_error}")
+    finally:
+        # Los streams que siguen la campaña reciben el estado final
+        progress = sending_status.pop(campaign_id, None)
+        if progress is not None and progress.status == 'running':
+            progress.finish('failed')
+        if acquired:
+            get_outbound_queue().release_campaign(campaign_id)
+
+def campaign_in_progress(campaign_id):
+    """La campaña se está enviando ahora, en este proceso o en otro"""
+    thread = current_campaigns.get(campaign_id)
+    if thread is not None and thread.is_alive():
+        return True
+    return get_outbound_queue().campaign_owner(campaign_id) is not None
+
+def launch_campaign(campaign_id):
+    """Lanzar el envío en background, salvo que la campaña ya se esté enviando en este proceso"""
+    with campaigns_lock:
+        thread = current_campaigns.get(campaign_id)
+        if thread is not None and thread.is_alive():
+            return False
+        thread = threading.Thread(target=send_campaign_emails, args=(campaign_id,))
+        thread.daemon = True
+        current_campaigns[campaign_id] = thread
+        thread.start()
+        return True
+
+def resume_interrupted_campaigns():
+    """Reanudar las campañas que quedaron 'running' al parar el proceso, desde la cola.
+    
+    Solo vuelven a la cola las filas de procesos que ya no existen (o con el lease
+    vencido), y las campañas que otro proceso vivo está enviando no se relanzan.
+    """
+    queue = get_outbound_queue()
+    queue.recover()
+    with app.app_context():
+        for campaign in EmailCampaign.query.filter_by(status='running'):
+            if queue.has_campaign(campaign.id) and queue.campaign_owner(campaign.id) is None:
+                print(f"🔁 Reanudando campaña {campaign.name} (ID: {campaign.id})")
+                launch_campaign(campaign.id)
+
+_resume_lock = threading.Lock()
+_campaigns_resumed = False
+
+def ensure_campaigns_resumed():
+    """resume_interrupted_campaigns() una sola vez por proceso.
+    
+    Se llama al arrancar (python app.py). Con un servidor WSGI, llamarla desde el
+    arranque de un solo proceso (p. ej. el hook post_worker_init de gunicorn con
+    un worker): las peticiones no la disparan.
+    """
+    global _campaigns_resumed
+    with _resume_lock:
+        if _campaigns_resumed:
+            return
+        _campaigns_resumed = True
+        try:
+            resume_interrupted_campaigns()
+        except Exception as e:
+            print(f"❌ Error reanudando campañas interrumpidas: {e}")
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
@@ -702,17 +1207,97 @@ def campaign_status(campaign_id):
     
     session['user_id'] = default_user.id
     
+    # Campaña en envío: contadores en memoria, sin consultar la campaña
+    progress = sending_status.get(campaign_id)
+    if progress is not None:
+        if progress.user_id != default_user.id:
+            return jsonify({'error': 'Acceso denegado'}), 403
+        return jsonify(progress.snapshot())
+    
     campaign = EmailCampaign.query.get_or_404(campaign_id)
     if campaign.user_id != default_user.id:
         return jsonify({'error': 'Acceso denegado'}), 403
     
-    return jsonify({
+    return jsonify(campaign_snapshot(campaign))
+
+def campaign_snapshot(campaign):
+    """Estado de una campaña según la base de datos"""
+    return {
         'id': campaign.id,
         'status': campaign.status,
         'sent_count': campaign.sent_count,
         'total_count': campaign.total_count,
         'progress': (campaign.sent_count / campaign.total_count * 100) if campaign.total_count > 0 else 0
-    })
+    }
+
+def sse_event(data, event=None):
+    """Un mensaje Server-Sent Events con datos JSON"""
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/api/campaign-status/<int:campaign_id>/stream')
+def campaign_status_stream(campaign_id):
+    """Progreso en vivo (SSE): envía solo los campos que cambian, leyendo el contador en memoria"""
+    # Usar usuario por defecto automáticamente
+    default_user = User.query.filter_by(username='admin').first()
+    if not default_user:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    session['user_id'] = default_user.id
+    
+    # Las consultas se hacen una vez al abrir el stream, nunca mientras dura
+    progress = sending_status.get(campaign_id)
+    initial = None
+    if progress is None:
+        campaign = EmailCampaign.query.get_or_404(campaign_id)
+        if campaign.user_id != default_user.id:
+            return jsonify({'error': 'Acceso denegado'}), 403
+        initial = campaign_snapshot(campaign)
+    elif progress.user_id != default_user.id:
+        return jsonify({'error': 'Acceso denegado'}), 403
+    
+    def generate():
+        interval = Config.PROGRESS_STREAM_INTERVAL
+        deadline = time.monotonic() + Config.PROGRESS_STREAM_TIMEOUT
+        tracker = progress
+        last = initial
+        version = -1
+        if initial is not None:
+            yield sse_event(initial, 'progress')
+            if initial['status'] in ('completed', 'failed'):
+                yield sse_event(initial, 'done')
+                return
+        
+        while time.monotonic() < deadline:
+            if tracker is None:
+                # Campaña aún no lanzada en este proceso: esperar a que aparezca su contador
+                tracker = sending_status.get(campaign_id)
+                if tracker is None:
+                    time.sleep(interval)
+                    yield ': keepalive\n\n'
+                    continue
+            
+            version = tracker.wait(version, timeout=15)
+            snapshot = tracker.snapshot()
+            delta = {key: value for key, value in snapshot.items() if last is None or last.get(key) != value}
+            delta['id'] = campaign_id
+            yield sse_event(delta, 'progress')
+            last = snapshot
+            
+            if snapshot['status'] != 'running':
+                yield sse_event(snapshot, 'done')
+                return
+            # Agrupar los envíos de cada intervalo en un solo evento
+            time.sleep(interval)
+        # EventSource se reconecta solo al cerrar el stream
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    debug = os.environ.get('FLASK_DEBUG', '1').lower() not in ('0', 'false')
+    # Con el reloader de debug el proceso padre solo vigila ficheros: reanuda el hijo que sirve
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        ensure_campaigns_resumed()
+    app.run(debug=debug, host='0.0.0.0', port=5000)
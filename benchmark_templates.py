@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+BENCHMARK DE PERSONALIZACIÓN DE TEMPLATES
+=========================================
+
+Compara la personalización clásica (un str.replace por variable sobre
+todo el HTML) con template_engine (compilar una vez, un join por contacto)
+usando los templates de ejemplo que app.py crea en la base de datos.
+También mide la construcción del mensaje MIME completo: email.mime
+(codifica todo el cuerpo por contacto) frente a mime_template (partes
+fijas codificadas una vez).
+
+Uso: python benchmark_templates.py [--recipients 20000]
+"""
+
+import argparse
+import ast
+import os
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, List
+
+from mime_template import EncodedTemplate, format_from
+from template_engine import compile_template
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+def load_seeded_templates(path: str = APP_FILE) -> List[Dict]:
+    """Leer los EmailTemplate(...) literales de app.py sin importar Flask ni la base de datos"""
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+
+    templates = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'EmailTemplate':
+            fields = {kw.arg: kw.value.value for kw in node.keywords
+                      if isinstance(kw.value, ast.Constant) and isinstance(kw.value.value, str)}
+            if 'content' in fields:
+                templates.append(fields)
+    return templates
+
+
+def legacy_personalize(template: str, data: Dict) -> str:
+    """La implementación anterior: un reemplazo completo por cada clave"""
+    content = template
+    for key, value in data.items():
+        placeholder = f"{{{{{key}}}}}"
+        content = content.replace(placeholder, str(value))
+    return content
+
+
+def legacy_mime(template: str, data: Dict) -> str:
+    """Mensaje completo como lo construye EmailSenderSMTP.build_message"""
+    msg = MIMEMultipart()
+    msg['From'] = "Heliopsis <heliopsis@outlook.be>"
+    msg['To'] = data['email']
+    msg['Subject'] = 'Prueba'
+    msg.attach(MIMEText(compile_template(template).render(data), 'html'))
+    return msg.as_string()
+
+
+def make_contacts(count: int) -> List[Dict]:
+    return [{
+        'name': f"Contacto {i}",
+        'email': f"contacto{i}@example.com",
+        'company': f"Empresa {i % 97}",
+        'city': 'Bruselas',
+        'phone': f"+32 470 {i:06d}",
+        'plan': 'premium' if i % 3 else 'basic'
+    } for i in range(count)]
+
+
+def bench(label: str, func, template: str, contacts: List[Dict]) -> float:
+    start = time.perf_counter()
+    for data in contacts:
+        func(template, data)
+    elapsed = time.perf_counter() - start
+    print(f"   {label:<22} {elapsed:7.3f}s  ({1e6 * elapsed / len(contacts):6.2f} µs/email)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de personalización de templates')
+    parser.add_argument('--recipients', type=int, default=20000)
+    args = parser.parse_args()
+
+    templates = load_seeded_templates()
+    contacts = make_contacts(args.recipients)
+    print(f"🧪 {len(templates)} templates de app.py, {len(contacts)} contactos")
+
+    for template in templates:
+        content = template['content']
+        compiled = compile_template(content)
+        print(f"\n📧 {template.get('name', '?')} ({len(content)} chars, "
+              f"variables: {', '.join(compiled.placeholders) or 'ninguna'})")
+
+        for data in contacts[:100]:
+            assert legacy_personalize(content, data) == compiled.render(data), "resultados distintos"
+
+        legacy = bench('str.replace por clave', legacy_personalize, content, contacts)
+        engine = bench('template_engine', lambda source, data: compile_template(source).render(data),
+                       content, contacts)
+        print(f"   ⚡ {legacy / engine:.1f}x más rápido")
+
+        mime = EncodedTemplate(compiled)
+        from_header = format_from('heliopsis@outlook.be', 'Heliopsis')
+        legacy = bench('MIME email.mime', legacy_mime, content, contacts)
+        encoded = bench('MIME pre-codificado', lambda source, data: mime.build_message(
+            from_header, data['email'], 'Prueba', data), content, contacts)
+        print(f"   ⚡ {legacy / encoded:.1f}x más rápido")
+
+
+if __name__ == "__main__":
+    main()
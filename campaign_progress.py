@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CAMPAIGN PROGRESS - LIVE COUNTERS WITH BATCHED COMMITS
+======================================================
+
+Progress channel from the send loop back to the campaign row:
+- Counters live in memory and are updated once per recipient (thread-safe),
+  so a status endpoint can read them without touching the database
+- Only final outcomes are counted: a send that will be retried is not an
+  error yet, so sent + errors never exceeds the total
+- The campaign row is written every `flush_every` sends or every
+  `flush_interval` seconds, whichever comes first, instead of only at the end
+- Only one flush runs at a time; sends that arrive meanwhile go in the next one
+- Watchers (e.g. an SSE stream) block on wait() until the counters change,
+  and get rate and ETA computed from the counters, not from the database
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+class CampaignProgress:
+    """In-memory progress of one running campaign"""
+
+    def __init__(self, campaign_id: int, total: int, sent: int = 0, user_id: int = None,
+                 flush: Callable[[int, int], None] = None, flush_every: int = 50,
+                 flush_interval: float = 2.0, errors: int = 0):
+        self.campaign_id = campaign_id
+        self.user_id = user_id
+        self.total = total
+        self.sent = sent
+        self.errors = errors
+        self.status = 'running'
+        self.started = time.monotonic()
+        self._initial_sent = sent
+        self.version = 0
+        self._flush = flush
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self._changed = threading.Condition(self.lock)
+        self._flush_lock = threading.Lock()
+        self._flushed_sent = sent
+        self._flushed_at = time.monotonic()
+
+    def record(self, sent: int = 0, errors: int = 0):
+        """Count final results (sent, or failed with no retry left) and write them
+        to the campaign row if a flush is due"""
+        with self.lock:
+            self.sent += sent
+            self.errors += errors
+            self.version += 1
+            self._changed.notify_all()
+            due = (self.sent - self._flushed_sent >= self.flush_every or
+                   time.monotonic() - self._flushed_at >= self.flush_interval)
+        if due:
+            self.flush(force=False)
+
+    def flush(self, force: bool = True):
+        """Write the sent counter through the flush callback"""
+        if self._flush is None:
+            return
+        # si otro hilo ya está escribiendo, sus números se recogen en el siguiente flush
+        if not self._flush_lock.acquire(blocking=force):
+            return
+        try:
+            with self.lock:
+                sent = self.sent
+                if not force and sent == self._flushed_sent:
+                    return
+            try:
+                self._flush(self.campaign_id, sent)
+            except Exception as e:
+                logging.warning(f"No se pudo guardar el progreso de la campaña {self.campaign_id}: {str(e)}")
+                return
+            with self.lock:
+                self._flushed_sent = sent
+                self._flushed_at = time.monotonic()
+        finally:
+            self._flush_lock.release()
+
+    def set_total(self, total: int):
+        with self.lock:
+            self.total = total
+            self.version += 1
+            self._changed.notify_all()
+
+    def finish(self, status: str):
+        """Final state; wakes every watcher"""
+        with self.lock:
+            self.status = status
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, version: int, timeout: float = None) -> int:
+        """Block until the counters move past `version` (or timeout); returns the current version"""
+        with self.lock:
+            if self.version == version and self.status == 'running':
+                self._changed.wait(timeout)
+            return self.version
+
+    def snapshot(self) -> Dict:
+        """Same shape as the campaign status API, plus rate (emails/s) and ETA (s)"""
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            rate = (self.sent - self._initial_sent) / elapsed if elapsed > 0 else 0.0
+            remaining = max(0, self.total - self.sent)
+            eta: Optional[float] = round(remaining / rate, 1) if rate > 0 else None
+            return {
+                'id': self.campaign_id,
+                'status': self.status,
+                'sent_count': self.sent,
+                'total_count': self.total,
+                'error_count': self.errors,
+                'progress': (self.sent / self.total * 100) if self.total > 0 else 0,
+                'elapsed': round(elapsed, 1),
+                'rate': round(rate, 2),
+                'eta': eta
+            }
+
+    def __repr__(self):
+        return f"<CampaignProgress {self.campaign_id}: {self.sent}/{self.total}>"
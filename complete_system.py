@@ -87,6 +87,7 @@ class CompleteEmailSystem:
             ['name', 'company', 'phone'],
             demo_template
         )
+        self.template_manager.flush()
         print("   ✅ Demo template created")
         
         print("\n✅ Demo data created successfully!")
@@ -332,7 +333,8 @@ class CompleteEmailSystem:
                 )
                 
                 template_id = title.lower().replace(' ', '_')
-                if self.template_manager.add_template(template_id, title, f"Template: {title}", "Custom", [], template_content):
+                if (self.template_manager.add_template(template_id, title, f"Template: {title}", "Custom", [], template_content)
+                        and self.template_manager.flush()):
                     print("✅ Template created successfully!")
                 else:
                     print("❌ Error creating template")
@@ -359,7 +361,7 @@ class CompleteEmailSystem:
             
             elif choice == '5':
                 file_path = input("Import file path: ").strip()
-                if self.template_manager.import_template(file_path):
+                if self.template_manager.import_template(file_path) and self.template_manager.flush():
                     print("✅ Template imported successfully!")
                 else:
                     print("❌ Import failed")
@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
@@ -14,6 +15,86 @@ class Config:
     DELAY_BETWEEN_EMAILS = int(os.getenv('DELAY_BETWEEN_EMAILS', 30))  # segundos
     BATCH_SIZE = int(os.getenv('BATCH_SIZE', 10))
     
+    # Límites de envío por proveedor (token buckets, 0 = sin límite)
+    # SendGrid cuenta peticiones a la API; SMTP y EWS cuentan mensajes
+    RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 5))
+    PROVIDER_RATE_LIMITS = {
+        'sendgrid': {
+            'per_second': int(os.getenv('SENDGRID_MAX_PER_SECOND', 10)) or None,
+            'per_minute': int(os.getenv('SENDGRID_MAX_PER_MINUTE', 600)) or None,
+            'per_hour': int(os.getenv('SENDGRID_MAX_PER_HOUR', 0)) or None,
+            'burst': RATE_LIMIT_BURST,
+        },
+        'smtp': {
+            'per_second': 1,
+            'per_minute': int(os.getenv('SMTP_MAX_PER_MINUTE', 30)) or None,
+            'per_hour': MAX_EMAILS_PER_HOUR or None,
+        },
+        'gmail': {
+            'per_second': 1,
+            'per_minute': int(os.getenv('GMAIL_MAX_PER_MINUTE', 20)) or None,
+            'per_hour': MAX_EMAILS_PER_HOUR or None,
+        },
+        'ews': {
+            'per_second': 1,
+            'per_minute': int(os.getenv('EWS_MAX_PER_MINUTE', 30)) or None,
+            'per_hour': MAX_EMAILS_PER_HOUR or None,
+        },
+    }
+    # Límites por cuenta, p. ej. {"cuenta@hotmail.com": {"per_hour": 100}}
+    ACCOUNT_RATE_LIMITS = json.loads(os.getenv('ACCOUNT_RATE_LIMITS', '{}'))
+    
+    # Control adaptativo (AIMD): envíos simultáneos máximos y reintentos ante 429/421/451
+    SEND_CONCURRENCY = int(os.getenv('SEND_CONCURRENCY', 8))
+    THROTTLE_MAX_RETRIES = int(os.getenv('THROTTLE_MAX_RETRIES', 3))
+    
+    # Workers de envío por campaña (peticiones en vuelo contra SendGrid/SMTP)
+    SEND_WORKERS = int(os.getenv('SEND_WORKERS', 4))
+    
+    # Pool SMTP: conexiones autenticadas simultáneas por cuenta y cierre por inactividad
+    SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 3))
+    SMTP_POOL_MAX_IDLE = int(os.getenv('SMTP_POOL_MAX_IDLE', 60))  # segundos
+    
+    # Agrupar destinatarios en una sola petición a SendGrid (personalizations)
+    SENDGRID_BATCH_MODE = os.getenv('SENDGRID_BATCH_MODE', 'true').lower() == 'true'
+    
+    # EWS: enviar varios mensajes por petición CreateItem (mensajes por petición)
+    EWS_BULK_MODE = os.getenv('EWS_BULK_MODE', 'true').lower() == 'true'
+    EWS_BULK_CHUNK_SIZE = int(os.getenv('EWS_BULK_CHUNK_SIZE', 50))
+    
+    # SMTP/EWS: codificar una vez (quoted-printable) las partes fijas del template
+    PREENCODED_BODIES = os.getenv('PREENCODED_BODIES', 'true').lower() == 'true'
+    
+    # Caché de cuentas EWS conectadas (segundos) y resultados de autodiscover en disco
+    EWS_ACCOUNT_TTL = int(os.getenv('EWS_ACCOUNT_TTL', 3600))
+    EWS_ACCOUNT_PROBE_AFTER = int(os.getenv('EWS_ACCOUNT_PROBE_AFTER', 300))
+    EWS_DISCOVERY_CACHE_FILE = os.getenv('EWS_DISCOVERY_CACHE_FILE', 'ews_discovery_cache.json')
+    
+    # Cola de salida persistente (SQLite): cada worker reclama un lote y reintentos
+    # (en modo batch de SendGrid el lote es una petición: max_personalizations)
+    OUTBOUND_QUEUE_DB = os.getenv('OUTBOUND_QUEUE_DB', 'outbound_queue.db')
+    OUTBOUND_CLAIM_BATCH = int(os.getenv('OUTBOUND_CLAIM_BATCH', 100))
+    OUTBOUND_MAX_ATTEMPTS = int(os.getenv('OUTBOUND_MAX_ATTEMPTS', 3))
+    OUTBOUND_RETRY_BACKOFF = int(os.getenv('OUTBOUND_RETRY_BACKOFF', 60))  # segundos
+    # Filas en in_flight de un proceso vivo que se dan por perdidas (envío colgado)
+    OUTBOUND_LEASE_TIMEOUT = int(os.getenv('OUTBOUND_LEASE_TIMEOUT', 1800))  # segundos
+    
+    # Progreso de campañas: guardar sent_count cada N envíos o cada T segundos
+    PROGRESS_FLUSH_EVERY = int(os.getenv('PROGRESS_FLUSH_EVERY', 50))
+    PROGRESS_FLUSH_INTERVAL = float(os.getenv('PROGRESS_FLUSH_INTERVAL', 2.0))
+    # Stream SSE de progreso: un evento como mucho por intervalo, reconexión tras el timeout
+    PROGRESS_STREAM_INTERVAL = float(os.getenv('PROGRESS_STREAM_INTERVAL', 1.0))
+    PROGRESS_STREAM_TIMEOUT = int(os.getenv('PROGRESS_STREAM_TIMEOUT', 300))
+    
+    # Lectura de contactos por páginas (keyset sobre id) y muestra en la vista de campaña
+    CONTACT_CHUNK_SIZE = int(os.getenv('CONTACT_CHUNK_SIZE', 1000))
+    CONTACT_PREVIEW_LIMIT = int(os.getenv('CONTACT_PREVIEW_LIMIT', 100))
+    
+    # Vista de listas: contactos por página (y máximo pedido por la API) y límite del textarea de edición
+    CONTACT_PAGE_SIZE = int(os.getenv('CONTACT_PAGE_SIZE', 50))
+    CONTACT_PAGE_MAX = int(os.getenv('CONTACT_PAGE_MAX', 500))
+    EDIT_TEXTAREA_LIMIT = int(os.getenv('EDIT_TEXTAREA_LIMIT', 5000))
+    
     # Configuración de contenido
     DEFAULT_SUBJECT = os.getenv('DEFAULT_SUBJECT', 'Mensaje importante')
     DEFAULT_SENDER_NAME = os.getenv('DEFAULT_SENDER_NAME', 'Tu Nombre')
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Configuración de pytest: la app y la cola de salida usan ficheros temporales,
+nunca la base de datos ni la cola de trabajo del directorio del proyecto.
+"""
+
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix='emails-tests-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_tmp, 'emails.db')}")
+os.environ.setdefault('OUTBOUND_QUEUE_DB', os.path.join(_tmp, 'outbound_queue.db'))
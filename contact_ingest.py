@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CONTACT INGEST - BULK INSERTS AND DIFF-BASED LIST UPDATES
+=========================================================
+
+Writes contact lists with SQLAlchemy Core instead of one ORM object per line:
+- Pasted "email, nombre, empresa, teléfono" lines are parsed lazily
+- New contacts go in with executemany-style INSERTs in fixed-size chunks
+- Editing a list compares the new lines with the stored contacts (matched
+  by email) and only inserts, updates or deletes the rows that changed
+- Uploaded CSV/TSV files are read incrementally from a byte stream,
+  validated and deduplicated on the fly, never held in memory as a whole;
+  a multipart/form-data upload is decoded part by part as it arrives
+- An address appears at most once per list (unique (list_id, lower(email))
+  index), so every write path drops repeated addresses before inserting
+"""
+
+import csv
+import io
+import itertools
+import re
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set
+
+from sqlalchemy import Table, bindparam
+from werkzeug.sansio.multipart import NEED_DATA, Data, Epilogue, Field, File, MultipartDecoder
+
+CONTACT_COLUMNS = ('email', 'name', 'company', 'phone')
+
+EMAIL_RE = re.compile(r'^[^@\s,;<>]+@[^@\s,;<>]+\.[^@\s,;<>]+$')
+
+# Cabeceras reconocidas en los ficheros importados
+HEADER_ALIASES = {
+    'email': 'email', 'e-mail': 'email', 'correo': 'email', 'mail': 'email',
+    'name': 'name', 'nombre': 'name',
+    'company': 'company', 'empresa': 'company',
+    'phone': 'phone', 'telefono': 'phone', 'teléfono': 'phone'
+}
+
+
+class ContactRow(NamedTuple):
+    email: str
+    name: str = ''
+    company: str = ''
+    phone: str = ''
+
+    @property
+    def key(self) -> str:
+        """Address used to match a row with a stored contact"""
+        return self.email.lower()
+
+
+def parse_contact_line(line: str) -> Optional[ContactRow]:
+    """One "email, nombre, empresa, teléfono" line (missing fields are ''); None for blank lines"""
+    if not line.strip():
+        return None
+    parts = [part.strip() for part in line.split(',')]
+    return ContactRow(*(parts[:4] + [''] * (4 - len(parts[:4]))))
+
+
+def parse_contact_lines(text: str) -> Iterator[ContactRow]:
+    """Rows of a pasted textarea, without building the list of lines"""
+    start = 0
+    length = len(text)
+    while start < length:
+        end = text.find('\n', start)
+        if end == -1:
+            end = length
+        row = parse_contact_line(text[start:end])
+        if row is not None:
+            yield row
+        start = end + 1
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[List]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_insert_contacts(session, table: Table, list_id: int, rows: Iterable[ContactRow],
+                         chunk_size: int = 1000, on_chunk: Callable[[int], None] = None) -> int:
+    """INSERT rows in chunks (one executemany per chunk); returns the number inserted.
+
+    on_chunk(count) runs after each chunk, e.g. to commit and report progress.
+    """
+    inserted = 0
+    statement = table.insert()
+    for chunk in _chunks(rows, chunk_size):
+        session.execute(statement, [dict(row._asdict(), list_id=list_id) for row in chunk])
+        inserted += len(chunk)
+        if on_chunk is not None:
+            on_chunk(len(chunk))
+    return inserted
+
+
+class CountingReader(io.RawIOBase):
+    """Binary stream wrapper that counts the bytes read (upload progress)"""
+
+    def __init__(self, stream, on_read: Callable[[int], None] = None):
+        self.stream = stream
+        self.bytes_read = 0
+        self.on_read = on_read
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.stream.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        self.bytes_read += n
+        if n and self.on_read is not None:
+            self.on_read(n)
+        return n
+
+
+class MultipartFileReader(io.RawIOBase):
+    """Bytes of one file field of a multipart/form-data body, decoded while the body is read.
+
+    Unlike request.files, nothing is spooled: the body is fed to the decoder
+    in blocks and the other fields are skipped. Use open_multipart_file().
+    """
+
+    def __init__(self, stream, boundary: bytes, field: str = 'file', block_size: int = 64 * 1024):
+        self.stream = stream
+        self.field = field
+        self.block_size = block_size
+        self.decoder = MultipartDecoder(boundary)
+        self.filename = None
+        self._pending = b''
+        self._in_field = False
+        self._finished = False
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _next_event(self):
+        """Next decoder event, feeding it the body as needed (None when the body ends)"""
+        while True:
+            event = self.decoder.next_event()
+            if event is not NEED_DATA:
+                return event
+            if self._eof:
+                return None
+            data = self.stream.read(self.block_size)
+            if not data:
+                self._eof = True
+            self.decoder.receive_data(data or None)
+
+    def start(self) -> bool:
+        """Advance to the start of the file field; False if the body has none"""
+        while True:
+            event = self._next_event()
+            if event is None or isinstance(event, Epilogue):
+                self._finished = True
+                return False
+            if isinstance(event, File) and event.name == self.field:
+                self.filename = event.filename
+                self._in_field = True
+                return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending and self._in_field and not self._finished:
+            event = self._next_event()
+            if event is None or isinstance(event, Epilogue):
+                self._finished = True
+            elif isinstance(event, Data):
+                self._pending = event.data
+                if not event.more_data:
+                    self._in_field = False
+            elif isinstance(event, (Field, File)):
+                self._in_field = False
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def open_multipart_file(stream, boundary: bytes, field: str = 'file') -> MultipartFileReader:
+    """MultipartFileReader positioned at the `field` file part (ValueError if it is missing)"""
+    reader = MultipartFileReader(stream, boundary, field)
+    if not reader.start():
+        raise ValueError(f"El formulario no incluye el fichero '{field}'")
+    return reader
+
+
+def open_text_stream(stream, on_read: Callable[[int], None] = None, buffer_size: int = 64 * 1024):
+    """Decode an uploaded byte stream (UTF-8, optional BOM) as text, reading it in blocks"""
+    reader = io.BufferedReader(CountingReader(stream, on_read), buffer_size=buffer_size)
+    return io.TextIOWrapper(reader, encoding='utf-8-sig', errors='replace', newline='')
+
+
+def iter_csv_contacts(lines: Iterable[str], delimiter: str = None) -> Iterator[ContactRow]:
+    """Rows of a CSV/TSV stream. A header row (email, nombre, empresa, teléfono...) maps the
+    columns; without one, columns are positional like the textarea format."""
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return
+    if delimiter is None:
+        delimiter = '\t' if '\t' in first else (';' if first.count(';') > first.count(',') else ',')
+    reader = csv.reader(itertools.chain([first], lines), delimiter=delimiter)
+
+    header = next(reader, [])
+    names = [HEADER_ALIASES.get(name.strip().lower()) for name in header]
+    if 'email' in names:
+        positions = [names.index(column) if column in names else None for column in CONTACT_COLUMNS]
+    else:
+        positions = list(range(len(CONTACT_COLUMNS)))
+        reader = itertools.chain([header], reader)
+
+    for record in reader:
+        if not record:
+            continue
+        yield ContactRow(*(record[i].strip() if i is not None and i < len(record) else ''
+                           for i in positions))
+
+
+def clean_contacts(rows: Iterable[ContactRow], seen: Set[str], stats: Dict) -> Iterator[ContactRow]:
+    """Drop invalid addresses and addresses already in `seen` (updated as rows pass).
+
+    Counts go to stats['processed'], stats['invalid'] and stats['duplicates'].
+    """
+    for row in rows:
+        stats['processed'] += 1
+        if not EMAIL_RE.match(row.email):
+            stats['invalid'] += 1
+            continue
+        key = row.key
+        if key in seen:
+            stats['duplicates'] += 1
+            continue
+        seen.add(key)
+        yield row
+
+
+def unique_contacts(rows: Iterable[ContactRow], seen: Set[str] = None) -> Iterator[ContactRow]:
+    """First row of each address (case-insensitive); later repeats are dropped"""
+    seen = set() if seen is None else seen
+    for row in rows:
+        key = row.key
+        if key not in seen:
+            seen.add(key)
+            yield row
+
+
+def sync_contacts(session, table: Table, list_id: int, rows: Iterable[ContactRow],
+                  existing: Iterable[Sequence], chunk_size: int = 1000) -> Dict[str, int]:
+    """Make the stored list match `rows`, touching only what changed.
+
+    `existing` yields (id, email, name, company, phone) tuples of the stored
+    contacts. Rows are matched by email (case-insensitive, exact spelling
+    first); an address repeated in `rows` is kept once and stored copies
+    without a match are deleted.
+    """
+    stored = defaultdict(list)
+    for contact_id, *values in existing:
+        current = ContactRow(*(value or '' for value in values))
+        stored[current.key].append((contact_id, current))
+
+    to_insert: List[ContactRow] = []
+    to_update: List[Dict] = []
+    unchanged = 0
+    duplicates = 0
+    seen: Set[str] = set()
+    for row in rows:
+        if row.key in seen:
+            duplicates += 1
+            continue
+        seen.add(row.key)
+        matches = stored.get(row.key)
+        if not matches:
+            to_insert.append(row)
+            continue
+        exact = next((i for i, (_, current) in enumerate(matches) if current.email == row.email), 0)
+        contact_id, current = matches.pop(exact)
+        if current == row:
+            unchanged += 1
+        else:
+            to_update.append(dict(row._asdict(), contact_id=contact_id))
+    to_delete = [contact_id for matches in stored.values() for contact_id, _ in matches]
+
+    update = table.update().where(table.c.id == bindparam('contact_id')).values(
+        **{column: bindparam(column) for column in CONTACT_COLUMNS}
+    )
+    # primero los borrados: un UPDATE que cambia mayúsculas no choca con la copia que se va
+    for chunk in _chunks(to_delete, chunk_size):
+        session.execute(table.delete().where(table.c.id.in_(chunk)))
+    for chunk in _chunks(to_update, chunk_size):
+        session.execute(update, chunk)
+    bulk_insert_contacts(session, table, list_id, to_insert, chunk_size)
+
+    return {'inserted': len(to_insert), 'updated': len(to_update),
+            'deleted': len(to_delete), 'unchanged': unchanged, 'duplicates': duplicates}
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+DB MIGRATIONS - INDEXES AND CONSTRAINTS FOR THE WEB APP MODELS
+==============================================================
+
+Small, ordered migration layer for the database of app.py:
+- db.create_all() only creates missing tables; indexes added to the models
+  later never reach a database created before them. Each migration here
+  brings an existing database to the schema the models declare
+- Applied migrations are recorded in a schema_migrations table, so each one
+  runs once, in order, inside its own transaction
+- Statements use IF NOT EXISTS and the same index names as the models, so
+  a fresh database (where create_all already made them) is a no-op
+- A migration never deletes user data: if contacts repeat an address in a
+  list, the unique index is not created and DuplicateContactsError lists
+  them. `python db_migrations.py --dedupe-contacts` removes them on purpose
+- explain_query_plan() / plan_problems() let a check script assert that the
+  hot queries keep using those indexes, with no full scan and no sort of
+  their own (see verificar_indices.py)
+"""
+
+import argparse
+import logging
+import sys
+from typing import Callable, List, NamedTuple, Sequence, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(50) PRIMARY KEY,
+    description VARCHAR(200),
+    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Un paso es una sentencia SQL o una función que recibe la conexión
+Step = Union[str, Callable[[Connection], None]]
+
+
+class Migration(NamedTuple):
+    version: str
+    description: str
+    steps: Sequence[Step]
+
+
+# Contactos que repiten un email (sin distinguir mayúsculas) dentro de una lista
+DUPLICATE_CONTACTS = """
+SELECT list_id, lower(email), COUNT(*), group_concat(id) FROM email_contact
+GROUP BY list_id, lower(email) HAVING COUNT(*) > 1 ORDER BY list_id, lower(email)
+"""
+
+
+class DuplicateContactsError(RuntimeError):
+    """Contacts that would break the unique (list_id, lower(email)) index"""
+
+    def __init__(self, duplicates: Sequence[Tuple[int, str, int, str]], shown: int = 20):
+        self.duplicates = list(duplicates)
+        lines = [f"  lista {list_id}: {email} x{count} (ids {ids})"
+                 for list_id, email, count, ids in self.duplicates[:shown]]
+        if len(self.duplicates) > shown:
+            lines.append(f"  ... y {len(self.duplicates) - shown} direcciones más")
+        super().__init__(
+            f"{len(self.duplicates)} direcciones repetidas en la misma lista; corrígelas o ejecuta "
+            f"'python db_migrations.py --dedupe-contacts' (conserva el contacto más antiguo):\n"
+            + "\n".join(lines)
+        )
+
+
+def find_duplicate_contacts(conn: Connection) -> List[Tuple[int, str, int, str]]:
+    """(list_id, lower(email), count, ids) of every address repeated within a list"""
+    return [tuple(row) for row in conn.execute(text(DUPLICATE_CONTACTS))]
+
+
+def _check_duplicate_contacts(conn: Connection):
+    """Stop the migration (nothing is deleted) if the unique index cannot be created"""
+    duplicates = find_duplicate_contacts(conn)
+    if duplicates:
+        raise DuplicateContactsError(duplicates)
+
+
+def dedupe_contacts(engine: Engine) -> int:
+    """Keep the oldest row of each (list_id, lower(email)); returns the rows deleted.
+
+    Only run on purpose (--dedupe-contacts): it deletes user contacts.
+    """
+    with engine.begin() as conn:
+        result = conn.execute(text(
+            "DELETE FROM email_contact WHERE id NOT IN "
+            "(SELECT MIN(id) FROM email_contact GROUP BY list_id, lower(email))"
+        ))
+    if result.rowcount:
+        logging.warning(f"🧹 {result.rowcount} contactos duplicados eliminados (mismo email en la misma lista)")
+    return result.rowcount
+
+
+MIGRATIONS: List[Migration] = [
+    Migration('0001_contact_indexes', 'Contactos por lista (keyset) y email único por lista', [
+        "CREATE INDEX IF NOT EXISTS ix_email_contact_list_id_id ON email_contact (list_id, id)",
+        # Único sin distinguir mayúsculas, como la importación
+        _check_duplicate_contacts,
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_email_contact_list_lower_email "
+        "ON email_contact (list_id, lower(email))",
+        # El orden por email de view_list no puede usar el índice único
+        "CREATE INDEX IF NOT EXISTS ix_email_contact_list_id_email_id ON email_contact (list_id, email, id)",
+    ]),
+    Migration('0002_owner_indexes', 'Listas, templates y campañas por usuario y fecha', [
+        "CREATE INDEX IF NOT EXISTS ix_email_list_user_id_created_at ON email_list (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_email_template_user_id_created_at "
+        "ON email_template (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_email_campaign_user_id_created_at "
+        "ON email_campaign (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_email_campaign_list_id ON email_campaign (list_id)",
+    ]),
+    Migration('0003_contact_sort_indexes', 'Órdenes de view_list por nombre, empresa y fecha', [
+        # El keyset compara (columna, id): name y company vacíos pasan de NULL a ''
+        "UPDATE email_contact SET name = '' WHERE name IS NULL",
+        "UPDATE email_contact SET company = '' WHERE company IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_email_contact_list_id_name_id ON email_contact (list_id, name, id)",
+        "CREATE INDEX IF NOT EXISTS ix_email_contact_list_id_company_id ON email_contact (list_id, company, id)",
+        "CREATE INDEX IF NOT EXISTS ix_email_contact_list_id_created_at_id "
+        "ON email_contact (list_id, created_at, id)",
+    ]),
+]
+
+
+def applied_migrations(engine: Engine) -> List[str]:
+    with engine.begin() as conn:
+        conn.execute(text(MIGRATIONS_TABLE))
+        return [row[0] for row in conn.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+
+
+def run_migrations(engine: Engine, migrations: Sequence[Migration] = None) -> List[str]:
+    """Apply the pending migrations in order; returns the versions applied"""
+    migrations = MIGRATIONS if migrations is None else migrations
+    done = set(applied_migrations(engine))
+    applied = []
+    for migration in migrations:
+        if migration.version in done:
+            continue
+        with engine.begin() as conn:
+            for step in migration.steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                         {'version': migration.version, 'description': migration.description})
+        logging.info(f"🗄️  Migración aplicada: {migration.version} - {migration.description}")
+        applied.append(migration.version)
+    return applied
+
+
+def explain_query_plan(conn: Connection, statement) -> List[str]:
+    """SQLite EXPLAIN QUERY PLAN of a SQLAlchemy statement (or ORM Query), one detail line per step"""
+    statement = getattr(statement, 'statement', statement)
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+
+def plan_problems(plan: Sequence[str], tables: Sequence[str]) -> List[str]:
+    """Plan lines that read a whole table (or a whole index) of `tables`, or sort rows.
+
+    SQLite writes "SCAN <table>" ("SCAN TABLE <table>" before 3.36) for a
+    full pass, "SEARCH <table> USING INDEX ..." for an index lookup, and
+    "USE TEMP B-TREE FOR ORDER BY / GROUP BY / DISTINCT" when no index
+    gives the rows in the order the query needs.
+    """
+    problems = []
+    for detail in plan:
+        words = detail.split()
+        if detail.startswith('USE TEMP B-TREE'):
+            problems.append(detail)
+        elif len(words) >= 2 and words[0] == 'SCAN':
+            table = words[2] if words[1] == 'TABLE' and len(words) > 2 else words[1]
+            if table in tables:
+                problems.append(detail)
+    return problems
+
+
+def check_query_plans(conn: Connection, queries: Sequence[Tuple[str, object]],
+                      tables: Sequence[str]) -> List[Tuple[str, List[str]]]:
+    """(name, plan) of every query whose plan scans one of `tables` or sorts in a temp b-tree"""
+    failures = []
+    for name, statement in queries:
+        plan = explain_query_plan(conn, statement)
+        if plan_problems(plan, tables):
+            failures.append((name, plan))
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Migraciones de la base de datos de la web')
+    parser.add_argument('--database', default='sqlite:///instance/emails.db', help='URL de SQLAlchemy')
+    parser.add_argument('--dedupe-contacts', action='store_true',
+                        help='borrar los contactos repetidos en una lista (conserva el más antiguo)')
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+    engine = create_engine(args.database)
+    if args.dedupe_contacts:
+        print(f"🧹 {dedupe_contacts(engine)} contactos duplicados eliminados")
+    try:
+        applied = run_migrations(engine)
+    except DuplicateContactsError as e:
+        print(f"❌ {e}")
+        return 1
+    print(f"🗄️  Migraciones aplicadas: {', '.join(applied) or 'ninguna'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
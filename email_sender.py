@@ -1,13 +1,21 @@
 import time
-import random
 import logging
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional, Union
 from exchangelib import Credentials, Account, DELEGATE, Configuration, Message, Mailbox
+from exchangelib.items import SEND_AND_SAVE_COPY
 from exchangelib.protocol import BaseProtocol, NoVerifyHTTPAdapter
+from exchangelib.errors import ErrorServerBusy
 from tqdm import tqdm
 import pandas as pd
 from config import Config
+from rate_limiter import get_rate_limiter
+from adaptive_throttle import get_throttle
+from ews_account_cache import get_account_cache
+from template_engine import compile_template, compile_message
+from mime_template import EncodedTemplate, format_from
+
+OFFICE365_EWS_ENDPOINT = 'https://outlook.office365.com/EWS/Exchange.asmx'
 
 # Configurar logging
 logging.basicConfig(
@@ -29,91 +37,87 @@ class EmailSender:
         self.last_sent_time = None
         self.email = email or Config.OUTLOOK_EMAIL
         self.password = password or Config.OUTLOOK_PASSWORD
+        # Límite de envío compartido por cuenta (Config.PROVIDER_RATE_LIMITS['ews'])
+        self.rate_limiter = get_rate_limiter('ews', self.email)
+        # Control adaptativo ante ErrorServerBusy (throttling de EWS)
+        self.throttle = get_throttle('ews', self.email)
+        self.max_retries = Config.THROTTLE_MAX_RETRIES
+        
+    def _verified_account(self, config: Configuration = None) -> Account:
+        """Crear la cuenta (con config o por autodiscover) y verificarla"""
+        if config is not None:
+            account = Account(
+                primary_smtp_address=self.email,
+                config=config,
+                autodiscover=False,
+                access_type=DELEGATE
+            )
+        else:
+            account = Account(
+                primary_smtp_address=self.email,
+                credentials=self.credentials,
+                autodiscover=True,
+                access_type=DELEGATE
+            )
         
+        # Verificar conexión
+        account.inbox
+        return account
+    
     def connect(self):
-        """Conectar a la cuenta de Outlook"""
+        """Conectar a la cuenta de Outlook
+        
+        Reutiliza cuentas ya verificadas en este proceso (ews_account_cache) y
+        el endpoint que autodiscover encontró en ejecuciones anteriores.
+        """
+        cache = get_account_cache()
         try:
             # Configurar credenciales
             self.credentials = Credentials(self.email, self.password)
             
-            # Configuración específica para Hotmail/Outlook
+            # Endpoints conocidos: el último descubierto y, para Hotmail/Outlook, el de Office 365
+            candidates = []
+            discovered = cache.get_discovery(self.email)
+            if discovered:
+                candidates.append((discovered['service_endpoint'], discovered.get('auth_type'), 'autodiscover en caché'))
             if 'hotmail.com' in self.email or 'outlook.com' in self.email:
-                # Usar configuración específica para Hotmail
+                candidates.append((OFFICE365_EWS_ENDPOINT, 'basic', 'configuración específica'))
+            
+            for endpoint, auth_type, label in candidates:
+                account = cache.get(self.email, self.password, endpoint)
+                if account is not None:
+                    self.account = account
+                    logging.info(f"Conectado a {self.email} reutilizando la sesión EWS ({label})")
+                    return True
+            
+            for endpoint, auth_type, label in candidates:
                 try:
-                    # Configuración específica para Hotmail usando EWS
                     config = Configuration(
-                        service_endpoint='https://outlook.office365.com/EWS/Exchange.asmx',
+                        service_endpoint=endpoint,
                         credentials=self.credentials,
-                        auth_type='basic'
+                        auth_type=auth_type
                     )
-                    
-                    self.account = Account(
-                        primary_smtp_address=self.email,
-                        config=config,
-                        autodiscover=False,
-                        access_type=DELEGATE
-                    )
-                    
-                    # Verificar conexión
-                    self.account.inbox
-                    logging.info(f"Conectado exitosamente a {self.email} usando configuración específica")
+                    self.account = self._verified_account(config)
+                    cache.put(self.email, self.password, endpoint, self.account)
+                    logging.info(f"Conectado exitosamente a {self.email} usando {label}")
                     return True
-                    
                 except Exception as e:
-                    logging.warning(f"Configuración específica falló: {str(e)}")
-                    
-                    # Intentar con configuración alternativa para Hotmail
-                    try:
-                        config = Configuration(
-                            service_endpoint='https://outlook.office365.com/EWS/Exchange.asmx',
-                            credentials=self.credentials,
-                            auth_type='basic'
-                        )
-                        
-                        self.account = Account(
-                            primary_smtp_address=self.email,
-                            config=config,
-                            autodiscover=False,
-                            access_type=DELEGATE
-                        )
-                        
-                        # Verificar conexión
-                        self.account.inbox
-                        logging.info(f"Conectado exitosamente a {self.email} usando configuración alternativa")
-                        return True
-                        
-                    except Exception as e2:
-                        logging.warning(f"Configuración alternativa falló: {str(e2)}")
-                        
-                        # Intentar con autodiscover como último recurso
-                        try:
-                            self.account = Account(
-                                primary_smtp_address=self.email,
-                                credentials=self.credentials,
-                                autodiscover=True,
-                                access_type=DELEGATE
-                            )
-                            
-                            # Verificar conexión
-                            self.account.inbox
-                            logging.info(f"Conectado exitosamente a {self.email} usando autodiscover")
-                            return True
-                            
-                        except Exception as e3:
-                            logging.error(f"Error con autodiscover: {str(e3)}")
-                            return False
-                        
-            else:
-                # Configuración general para otros dominios
-                self.account = Account(
-                    primary_smtp_address=self.email,
-                    credentials=self.credentials,
-                    autodiscover=True,
-                    access_type=DELEGATE
-                )
-                
-                logging.info(f"Conectado exitosamente a {self.email}")
-                return True
+                    logging.warning(f"Conexión con {label} falló: {str(e)}")
+                    if discovered and endpoint == discovered['service_endpoint']:
+                        cache.forget_discovery(self.email)
+            
+            # Intentar con autodiscover como último recurso
+            try:
+                self.account = self._verified_account()
+            except Exception as e:
+                logging.error(f"Error con autodiscover: {str(e)}")
+                return False
+            
+            endpoint = self.account.protocol.service_endpoint
+            cache.put(self.email, self.password, endpoint, self.account)
+            cache.save_discovery(self.email, endpoint, self.account.protocol.auth_type)
+            logging.info(f"Conectado exitosamente a {self.email} usando autodiscover")
+            return True
             
         except Exception as e:
             logging.error(f"Error al conectar: {str(e)}")
@@ -165,22 +169,58 @@ class EmailSender:
         
         return message
     
+    def build_messages(self, emails: List[Dict], subject: str, template: str,
+                       sender_name: str = None) -> Iterator[Union[Message, Exception]]:
+        """Mensajes personalizados, generados bajo demanda en el orden de emails
+        
+        Con Config.PREENCODED_BODIES se envía el MIME ya construido (mime_content):
+        las partes fijas del template se codifican una sola vez. Si el mensaje de
+        un contacto no se puede construir (p. ej. un salto de línea en una
+        cabecera) se genera la excepción en su lugar, sin cortar el lote.
+        """
+        message = compile_message(subject, template)
+        if Config.PREENCODED_BODIES:
+            mime = EncodedTemplate(message.body, eol='\r\n')
+            from_header = format_from(self.email, sender_name or Config.DEFAULT_SENDER_NAME)
+            for email_data in emails:
+                values = email_data.get('custom_data', {})
+                try:
+                    raw = mime.build_message(from_header, email_data['email'],
+                                             message.render_subject(values), values)
+                except Exception as e:
+                    yield e
+                    continue
+                yield Message(
+                    account=self.account,
+                    mime_content=raw.encode('utf-8'),
+                    to_recipients=[Mailbox(email_address=email_data['email'])]
+                )
+        else:
+            rendered = message.render_records([email_data.get('custom_data', {}) for email_data in emails])
+            for email_data, (personalized_subject, body) in zip(emails, rendered):
+                yield self.create_message(email_data['email'], personalized_subject, body, sender_name)
+    
     def personalize_content(self, template: str, custom_data: Dict) -> str:
         """Personalizar el contenido del email con datos específicos"""
-        personalized = template
-        
-        for key, value in custom_data.items():
-            placeholder = f"{{{{{key}}}}}"
-            personalized = personalized.replace(placeholder, str(value))
-        
-        return personalized
+        return compile_template(template).render(custom_data)
     
     def send_email(self, to_email: str, subject: str, body: str, 
                    sender_name: str = None) -> bool:
         """Enviar un email individual"""
         try:
             message = self.create_message(to_email, subject, body, sender_name)
-            message.send()
+            for attempt in range(self.max_retries + 1):
+                try:
+                    with self.throttle.slot():
+                        self.rate_limiter.acquire()
+                        message.send()
+                    break
+                except ErrorServerBusy as e:
+                    if attempt == self.max_retries:
+                        raise
+                    pause = self.throttle.on_throttle(getattr(e, 'back_off', None))
+                    logging.warning(f"EWS limitando envíos, esperando {pause:.1f}s")
+            self.throttle.on_success()
             
             self.emails_sent += 1
             self.last_sent_time = datetime.now()
@@ -192,22 +232,84 @@ class EmailSender:
             logging.error(f"Error al enviar email a {to_email}: {str(e)}")
             return False
     
-    def calculate_delay(self) -> int:
-        """Calcular el delay necesario para evitar límites de rate"""
-        if not self.last_sent_time:
-            return 0
+    def send_messages(self, messages: List[Message]) -> List[Optional[Exception]]:
+        """Enviar varios mensajes en una sola petición CreateItem.
         
-        time_since_last = (datetime.now() - self.last_sent_time).total_seconds()
-        min_delay = Config.DELAY_BETWEEN_EMAILS
+        Devuelve, en el mismo orden, None para cada mensaje enviado o la
+        excepción con la que EWS lo rechazó.
+        """
+        outcomes: List[Optional[Exception]] = [None] * len(messages)
+        pending = list(range(len(messages)))
         
-        # Añadir variabilidad aleatoria para parecer más humano
-        random_delay = random.randint(0, 10)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.throttle.slot():
+                    self.rate_limiter.acquire(len(pending))
+                    results = self.account.bulk_create(
+                        folder=self.account.sent,
+                        items=[messages[i] for i in pending],
+                        message_disposition=SEND_AND_SAVE_COPY,
+                        chunk_size=len(pending)
+                    )
+            except ErrorServerBusy as e:
+                # Toda la petición rechazada: reintentar el lote completo
+                results = [e] * len(pending)
+            except Exception as e:
+                for i in pending:
+                    outcomes[i] = e
+                return outcomes
+            
+            busy = None
+            retry = []
+            for i, result in zip(pending, results):
+                if isinstance(result, ErrorServerBusy):
+                    busy = result
+                    retry.append(i)
+                outcomes[i] = result if isinstance(result, Exception) else None
+            
+            if busy is None or attempt == self.max_retries:
+                break
+            pause = self.throttle.on_throttle(getattr(busy, 'back_off', None))
+            logging.warning(f"EWS limitando envíos, reintentando {len(retry)} mensajes en {pause:.1f}s")
+            pending = retry
         
-        return max(0, min_delay - time_since_last + random_delay)
+        sent = sum(1 for outcome in outcomes if outcome is None)
+        if sent:
+            self.throttle.on_success()
+            self.emails_sent += sent
+            self.last_sent_time = datetime.now()
+        return outcomes
+    
+    def _send_bulk_chunked(self, emails: List[Dict], subject: str, template: str,
+                           sender_name: str, chunk_size: int, results: Dict):
+        """Enviar en lotes de chunk_size mensajes por petición EWS"""
+        all_messages = self.build_messages(emails, subject, template, sender_name)
+        with tqdm(total=len(emails), desc="Enviando emails") as pbar:
+            for start in range(0, len(emails), chunk_size):
+                chunk = emails[start:start + chunk_size]
+                built = [message for _, message in zip(chunk, all_messages)]
+                messages = [message for message in built if not isinstance(message, Exception)]
+                
+                # Cada resultado corresponde al contacto en la misma posición
+                outcomes = iter(self.send_messages(messages) if messages else [])
+                errors = [message if isinstance(message, Exception) else next(outcomes) for message in built]
+                for email_data, error in zip(chunk, errors):
+                    if error is None:
+                        results['sent'] += 1
+                    else:
+                        results['failed'] += 1
+                        results['errors'].append(f"Error en {email_data['email']}: {str(error)}")
+                        logging.error(f"Error al enviar email a {email_data['email']}: {str(error)}")
+                pbar.update(len(chunk))
     
     def send_bulk_emails(self, emails: List[Dict], subject: str, 
-                        template: str, sender_name: str = None) -> Dict:
-        """Enviar emails masivos con control de rate"""
+                        template: str, sender_name: str = None,
+                        bulk: bool = None, chunk_size: int = None) -> Dict:
+        """Enviar emails masivos con control de rate
+        
+        En modo bulk (Config.EWS_BULK_MODE) se envían chunk_size mensajes
+        personalizados por petición EWS en vez de uno por petición.
+        """
         if not self.account:
             if not self.connect():
                 return {'success': False, 'error': 'No se pudo conectar a Outlook'}
@@ -222,15 +324,24 @@ class EmailSender:
         
         logging.info(f"Iniciando envío de {len(emails)} emails")
         
+        if bulk is None:
+            bulk = Config.EWS_BULK_MODE
+        if bulk:
+            self._send_bulk_chunked(emails, subject, template, sender_name,
+                                    chunk_size or Config.EWS_BULK_CHUNK_SIZE, results)
+            logging.info(f"Envio completado: {results['sent']} enviados, {results['failed']} fallidos")
+            return results
+        
+        message = compile_message(subject, template)
         for i, email_data in enumerate(tqdm(emails, desc="Enviando emails")):
             try:
-                # Personalizar contenido
-                personalized_body = self.personalize_content(template, email_data.get('custom_data', {}))
+                # Personalizar asunto y contenido
+                personalized_subject, personalized_body = message.render(email_data.get('custom_data', {}))
                 
                 # Enviar email
                 success = self.send_email(
                     email_data['email'],
-                    subject,
+                    personalized_subject,
                     personalized_body,
                     sender_name
                 )
@@ -241,17 +352,6 @@ class EmailSender:
                     results['failed'] += 1
                     results['errors'].append(f"Error en {email_data['email']}")
                 
-                # Control de rate
-                if i < len(emails) - 1:  # No esperar después del último email
-                    delay = self.calculate_delay()
-                    if delay > 0:
-                        time.sleep(delay)
-                
-                # Pausa cada batch para evitar detección
-                if (i + 1) % Config.BATCH_SIZE == 0:
-                    logging.info(f"Pausa de 2 minutos después del batch {i + 1}")
-                    time.sleep(120)
-                
             except Exception as e:
                 results['failed'] += 1
                 results['errors'].append(f"Error en {email_data['email']}: {str(e)}")
@@ -273,5 +373,7 @@ class EmailSender:
             'duration': str(duration),
             'rate_per_hour': round(rate, 2),
             'start_time': self.start_time.isoformat(),
-            'last_sent': self.last_sent_time.isoformat() if self.last_sent_time else None
+            'last_sent': self.last_sent_time.isoformat() if self.last_sent_time else None,
+            'rate_limit': self.rate_limiter.get_stats(),
+            'throttle': self.throttle.get_stats()
         } 
\ No newline at end of file
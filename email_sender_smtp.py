@@ -10,10 +10,18 @@ from email import encoders
 import pandas as pd
 import time
 import logging
-from typing import List, Dict
+from typing import List, Dict, Iterator, Union
 import schedule
 from tqdm import tqdm
 import os
+import threading
+from rate_limiter import get_rate_limiter
+from adaptive_throttle import get_throttle, smtp_throttle_code
+from config import Config
+from send_pool import run_pool
+from smtp_pool import SMTPConnectionPool
+from template_engine import compile_template, compile_message
+from mime_template import EncodedTemplate, format_from
 
 # Configurar logging
 logging.basicConfig(
@@ -28,7 +36,9 @@ logging.basicConfig(
 class EmailSenderSMTP:
     """Clase para enviar emails usando SMTP (especialmente para Hotmail)"""
     
-    def __init__(self, email=None, password=None):
+    def __init__(self, email=None, password=None, reuse_session: bool = True,
+                 max_messages_per_session: int = 100, timeout: float = 30,
+                 pool_size: int = None, max_idle: float = None):
         """Inicializar con credenciales de Hotmail"""
         self.email = email or "el_chicher@hotmail.com"
         self.password = password or "tszrmkdaqkjtllvd"
@@ -36,7 +46,47 @@ class EmailSenderSMTP:
         self.smtp_port = 587
         self.sent_count = 0
         self.failed_count = 0
+        self._stats_lock = threading.Lock()
+        # Ritmo de envío compartido por todos los senders de esta cuenta
+        self.rate_limiter = get_rate_limiter('smtp', self.email)
+        # Control adaptativo ante respuestas 421/45x del servidor
+        self.throttle = get_throttle('smtp', self.email)
+        self.max_retries = Config.THROTTLE_MAX_RETRIES
         
+        # Sesiones SMTP reutilizables: un STARTTLS + LOGIN para muchos mensajes,
+        # con hasta pool_size conexiones en paralelo (límite de concurrencia de la cuenta)
+        self.reuse_session = reuse_session
+        self.timeout = timeout
+        self.pool = SMTPConnectionPool(
+            self._connect,
+            size=pool_size or Config.SMTP_POOL_SIZE,
+            max_messages_per_connection=max_messages_per_session,
+            max_idle=max_idle if max_idle is not None else Config.SMTP_POOL_MAX_IDLE,
+            name=f"smtp:{self.email}"
+        )
+        
+    def _connect(self) -> smtplib.SMTP:
+        """Abrir una conexión SMTP autenticada"""
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
+        try:
+            server.starttls(context=ssl.create_default_context())
+            server.login(self.email, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+    
+    def open_session(self) -> bool:
+        """Abrir una conexión del pool; sirve también como prueba de conexión"""
+        if self.pool.warm():
+            logging.info(f"✅ Sesión SMTP abierta con {self.email}")
+            return True
+        return False
+    
+    def close_session(self):
+        """Cerrar las conexiones del pool (los contadores se conservan)"""
+        self.pool.close()
+    
     def test_connection(self):
         """Probar conexión SMTP con Hotmail"""
         try:
@@ -54,53 +104,104 @@ class EmailSenderSMTP:
             logging.error(f"❌ Error de conexión SMTP: {str(e)}")
             return False
     
+    def build_message(self, to_email: str, subject: str, body: str,
+                      sender_name: str = None) -> str:
+        """Construir el mensaje MIME listo para enviar"""
+        msg = MIMEMultipart()
+        msg['From'] = f"{sender_name or 'Tu Nombre'} <{self.email}>"
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        
+        # Agregar cuerpo del mensaje
+        msg.attach(MIMEText(body, 'html'))
+        return msg.as_string()
+    
+    def build_messages(self, emails: List[Dict], subject: str, template: str,
+                       sender_name: str = None) -> Iterator[Union[str, Exception]]:
+        """Mensajes MIME personalizados, generados bajo demanda en el orden de emails
+        
+        Con Config.PREENCODED_BODIES las partes fijas del template se codifican
+        una sola vez y solo se codifican los valores de cada contacto. Si el
+        mensaje de un contacto no se puede construir (p. ej. un salto de línea
+        en una cabecera) se genera la excepción en su lugar, sin cortar el lote.
+        """
+        message = compile_message(subject, template)
+        if Config.PREENCODED_BODIES:
+            mime = EncodedTemplate(message.body)
+            from_header = format_from(self.email, sender_name)
+            build = lambda email_data, values: mime.build_message(
+                from_header, email_data['email'], message.render_subject(values), values)
+            return (_build_or_error(build, email_data, email_data.get('custom_data', {}))
+                    for email_data in emails)
+        
+        rendered = message.render_records([email_data.get('custom_data', {}) for email_data in emails])
+        build = lambda email_data, subject_body: self.build_message(
+            email_data['email'], subject_body[0], subject_body[1], sender_name)
+        return (_build_or_error(build, email_data, subject_body)
+                for email_data, subject_body in zip(emails, rendered))
+    
     def send_email(self, to_email: str, subject: str, body: str, 
                    sender_name: str = None) -> bool:
         """Enviar un email usando SMTP"""
         try:
-            # Crear mensaje
-            msg = MIMEMultipart()
-            msg['From'] = f"{sender_name or 'Tu Nombre'} <{self.email}>"
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            
-            # Agregar cuerpo del mensaje
-            msg.attach(MIMEText(body, 'html'))
-            
+            text = self.build_message(to_email, subject, body, sender_name)
+        except Exception as e:
+            with self._stats_lock:
+                self.failed_count += 1
+            logging.error(f"❌ Error enviando email a {to_email}: {str(e)}")
+            return False
+        return self.send_message(to_email, text)
+    
+    def send_message(self, to_email: str, text: str) -> bool:
+        """Enviar un mensaje MIME ya construido"""
+        try:
             # Crear contexto SSL
             context = ssl.create_default_context()
             
-            # Conectar y enviar
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.email, self.password)
-                text = msg.as_string()
-                server.sendmail(self.email, to_email, text)
-                
-            self.sent_count += 1
+            # Conectar y enviar, reintentando si el servidor pide esperar (421/45x)
+            for attempt in range(self.max_retries + 1):
+                try:
+                    with self.throttle.slot():
+                        # Esperar turno según el límite de la cuenta
+                        self.rate_limiter.acquire()
+                        if self.reuse_session:
+                            self.pool.sendmail(self.email, to_email, text)
+                        else:
+                            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
+                                server.starttls(context=context)
+                                server.login(self.email, self.password)
+                                server.sendmail(self.email, to_email, text)
+                    break
+                except smtplib.SMTPException as e:
+                    code = smtp_throttle_code(e)
+                    if code is None or attempt == self.max_retries:
+                        raise
+                    pause = self.throttle.on_throttle()
+                    logging.warning(f"⏳ Servidor SMTP limitando envíos ({code}), esperando {pause:.1f}s")
+            
+            self.throttle.on_success()
+            with self._stats_lock:
+                self.sent_count += 1
             logging.info(f"✅ Email enviado a {to_email}")
             return True
             
         except Exception as e:
-            self.failed_count += 1
+            with self._stats_lock:
+                self.failed_count += 1
             logging.error(f"❌ Error enviando email a {to_email}: {str(e)}")
             return False
     
     def personalize_content(self, template: str, custom_data: Dict) -> str:
         """Personalizar contenido del template"""
         try:
-            content = template
-            for key, value in custom_data.items():
-                placeholder = f"{{{{{key}}}}}"
-                content = content.replace(placeholder, str(value))
-            return content
+            return compile_template(template).render(custom_data)
         except Exception as e:
             logging.error(f"Error personalizando contenido: {str(e)}")
             return template
     
     def send_bulk_emails(self, emails: List[Dict], subject: str, 
-                         template: str, sender_name: str = None) -> Dict:
-        """Enviar emails en lote"""
+                         template: str, sender_name: str = None, workers: int = 1) -> Dict:
+        """Enviar emails en lote (con workers > 1, varios envíos simultáneos)"""
         results = {
             'total': len(emails),
             'sent': 0,
@@ -110,38 +211,55 @@ class EmailSenderSMTP:
         
         logging.info(f"🚀 Iniciando envío de {len(emails)} emails...")
         
-        # Probar conexión primero
-        if not self.test_connection():
+        # Probar conexión primero (con sesión reutilizable, la misma conexión se usa para enviar)
+        connected = self.open_session() if self.reuse_session else self.test_connection()
+        if not connected:
             logging.error("❌ No se pudo establecer conexión SMTP")
             return results
         
+        # Personalizar por adelantado: los mensajes se generan a medida que los workers
+        # los piden, fuera del hilo que hace la E/S de red
+        messages = self.build_messages(emails, subject, template, sender_name)
+        
         # Enviar emails con barra de progreso
         with tqdm(total=len(emails), desc="Enviando emails") as pbar:
-            for email_data in emails:
+            def enviar(item):
+                email_data, text = item
+                if isinstance(text, Exception):
+                    with self._stats_lock:
+                        self.failed_count += 1
+                    logging.error(f"❌ Error construyendo el email para {email_data['email']}: {str(text)}")
+                    return f"Error con {email_data['email']}: {str(text)}"
                 try:
-                    # Personalizar contenido
-                    personalized_body = self.personalize_content(template, email_data.get('custom_data', {}))
-                    
                     # Enviar email
-                    if self.send_email(
-                        email_data['email'], 
-                        subject, 
-                        personalized_body, 
-                        sender_name
-                    ):
-                        results['sent'] += 1
-                    else:
-                        results['failed'] += 1
-                        results['errors'].append(f"Error enviando a {email_data['email']}")
-                    
-                    # Delay entre emails para evitar spam
-                    time.sleep(2)
-                    pbar.update(1)
+                    if self.send_message(email_data['email'], text):
+                        return None
+                    return f"Error enviando a {email_data['email']}"
                     
                 except Exception as e:
+                    return f"Error con {email_data['email']}: {str(e)}"
+            
+            def registrar(item, error):
+                if isinstance(error, Exception):
+                    # enviar() lanzó una excepción dentro del pool de workers
+                    error = f"Error con {item[0]['email']}: {str(error)}"
+                if error is None:
+                    results['sent'] += 1
+                else:
                     results['failed'] += 1
-                    results['errors'].append(f"Error con {email_data['email']}: {str(e)}")
-                    pbar.update(1)
+                    results['errors'].append(error)
+                pbar.update(1)
+            
+            try:
+                items = zip(emails, messages)
+                if workers > 1:
+                    run_pool(items, enviar, workers, on_result=registrar)
+                else:
+                    for item in items:
+                        registrar(item, enviar(item))
+            finally:
+                if self.reuse_session:
+                    self.close_session()
         
         logging.info(f"✅ Envío completado: {results['sent']} enviados, {results['failed']} fallidos")
         return results
@@ -151,9 +269,19 @@ class EmailSenderSMTP:
         return {
             'sent': self.sent_count,
             'failed': self.failed_count,
-            'total': self.sent_count + self.failed_count
+            'total': self.sent_count + self.failed_count,
+            'rate_limit': self.rate_limiter.get_stats(),
+            'throttle': self.throttle.get_stats(),
+            'session': self.pool.get_stats()
         }
 
+def _build_or_error(build, email_data: Dict, values):
+    """build(email_data, values), o la excepción si el mensaje no se puede construir"""
+    try:
+        return build(email_data, values)
+    except Exception as e:
+        return e
+
 def main():
     """Función principal para probar el sistema SMTP"""
     print("🧪 PRUEBA DEL SISTEMA SMTP PARA HOTMAIL")
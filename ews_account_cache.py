@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+EWS ACCOUNT CACHE - REUSE CONNECTED ACCOUNTS
+============================================
+
+Process-wide cache of verified exchangelib Accounts:
+- Keyed by mailbox address and EWS endpoint (plus a credentials fingerprint)
+- Entries expire after a TTL and are re-probed when idle for a while
+- Autodiscover results are persisted to disk so later runs skip discovery
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from config import Config
+
+
+def credentials_fingerprint(email: str, password: str) -> str:
+    """Stable hash of the credentials, so a password change never reuses an old session"""
+    return hashlib.sha256(f"{email.lower()}\0{password}".encode('utf-8')).hexdigest()[:16]
+
+
+class EWSAccountCache:
+    """Connected Account objects shared by every EmailSender in the process"""
+
+    def __init__(self, ttl: float = 3600, probe_after: float = 300,
+                 discovery_file: str = None, discovery_ttl: float = 7 * 24 * 3600):
+        self.ttl = ttl
+        self.probe_after = probe_after
+        self.discovery_file = discovery_file
+        self.discovery_ttl = discovery_ttl
+        self.lock = threading.Lock()
+        self._accounts: Dict[Tuple[str, str], Dict] = {}
+        self._discovery: Optional[Dict[str, Dict]] = None
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'probe_failures': 0}
+
+    @staticmethod
+    def _probe(account) -> bool:
+        """One GetFolder round trip to confirm the session still works"""
+        try:
+            account.inbox.refresh()
+            return True
+        except Exception as e:
+            logging.warning(f"Sonda EWS falló para {account.primary_smtp_address}: {str(e)}")
+            return False
+
+    @staticmethod
+    def _close(account):
+        try:
+            account.protocol.close()
+        except Exception:
+            pass
+
+    def get(self, email: str, password: str, endpoint: str):
+        """Cached account for this address/endpoint, or None if missing, expired or unhealthy"""
+        key = (email.lower(), endpoint)
+        now = time.monotonic()
+        with self.lock:
+            entry = self._accounts.get(key)
+            if entry is None or entry['fingerprint'] != credentials_fingerprint(email, password):
+                self.stats['misses'] += 1
+                return None
+            if now - entry['created'] > self.ttl:
+                del self._accounts[key]
+                self.stats['expired'] += 1
+                self._close(entry['account'])
+                return None
+            needs_probe = now - entry['verified'] > self.probe_after
+
+        if needs_probe:
+            if not self._probe(entry['account']):
+                with self.lock:
+                    if self._accounts.get(key) is entry:
+                        del self._accounts[key]
+                    self.stats['probe_failures'] += 1
+                return None
+            entry['verified'] = time.monotonic()
+
+        with self.lock:
+            self.stats['hits'] += 1
+        return entry['account']
+
+    def put(self, email: str, password: str, endpoint: str, account):
+        """Store an account that has just been verified"""
+        now = time.monotonic()
+        with self.lock:
+            self._accounts[(email.lower(), endpoint)] = {
+                'account': account,
+                'fingerprint': credentials_fingerprint(email, password),
+                'created': now,
+                'verified': now
+            }
+
+    def invalidate(self, email: str, endpoint: str = None):
+        """Drop cached accounts for an address (one endpoint or all)"""
+        with self.lock:
+            for key in list(self._accounts):
+                if key[0] == email.lower() and (endpoint is None or key[1] == endpoint):
+                    self._close(self._accounts.pop(key)['account'])
+
+    def _load_discovery(self) -> Dict[str, Dict]:
+        # caller holds the lock
+        if self._discovery is None:
+            self._discovery = {}
+            if self.discovery_file and os.path.exists(self.discovery_file):
+                try:
+                    with open(self.discovery_file, 'r', encoding='utf-8') as f:
+                        self._discovery = json.load(f)
+                except (OSError, ValueError) as e:
+                    logging.warning(f"No se pudo leer {self.discovery_file}: {str(e)}")
+        return self._discovery
+
+    def _save_discovery(self):
+        # caller holds the lock; write to a temp file and rename so readers never see half a file
+        if not self.discovery_file:
+            return
+        tmp_path = f"{self.discovery_file}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._discovery, f, indent=2)
+            os.replace(tmp_path, self.discovery_file)
+        except OSError as e:
+            logging.warning(f"No se pudo guardar {self.discovery_file}: {str(e)}")
+
+    def get_discovery(self, email: str) -> Optional[Dict]:
+        """Persisted autodiscover result ({'service_endpoint', 'auth_type'}) if still fresh"""
+        with self.lock:
+            entry = self._load_discovery().get(email.lower())
+            if entry and time.time() - entry.get('discovered_at', 0) <= self.discovery_ttl:
+                return entry
+            return None
+
+    def save_discovery(self, email: str, service_endpoint: str, auth_type: str = None):
+        """Remember where autodiscover found the mailbox"""
+        with self.lock:
+            self._load_discovery()[email.lower()] = {
+                'service_endpoint': service_endpoint,
+                'auth_type': auth_type,
+                'discovered_at': time.time(),
+                'discovered': datetime.now().isoformat(timespec='seconds')
+            }
+            self._save_discovery()
+
+    def forget_discovery(self, email: str):
+        """Drop a persisted autodiscover result that no longer works"""
+        with self.lock:
+            if self._load_discovery().pop(email.lower(), None) is not None:
+                self._save_discovery()
+
+    def get_stats(self) -> Dict:
+        """Cache counters"""
+        with self.lock:
+            return dict(self.stats, cached=len(self._accounts))
+
+
+_cache: Optional[EWSAccountCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_account_cache() -> EWSAccountCache:
+    """Process-wide cache configured from Config"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EWSAccountCache(
+                ttl=Config.EWS_ACCOUNT_TTL,
+                probe_after=Config.EWS_ACCOUNT_PROBE_AFTER,
+                discovery_file=Config.EWS_DISCOVERY_CACHE_FILE
+            )
+        return _cache
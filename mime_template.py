@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+MIME TEMPLATES - ENCODE ONCE, SPLICE PER RECIPIENT
+==================================================
+
+Builds ready-to-send MIME messages for SMTP and EWS without re-encoding
+the whole HTML body for every recipient:
+- Static segments of a compiled template are quoted-printable encoded once
+- Only the personalized values are encoded per recipient (small LRU cache)
+- Pieces are spliced with QP soft line breaks ("=" + EOL), which decode to
+  nothing, so the result is a valid quoted-printable body
+- The multipart envelope and part headers are pre-built per template
+- Header values (From, To, Subject) with CR or LF are rejected, so
+  contact data can never start a header of its own
+
+Quoted-printable is used because, unlike base64, independently encoded
+pieces can be concatenated.
+"""
+
+import random
+from email import quoprimime
+from email.errors import HeaderParseError
+from email.header import Header
+from email.utils import formataddr
+from functools import lru_cache
+from typing import List, Mapping
+
+from template_engine import CompiledTemplate, MISSING
+
+
+@lru_cache(maxsize=4096)
+def qp_encode(text: str, eol: str = '\n') -> str:
+    """Quoted-printable encoding of the UTF-8 bytes of text"""
+    return quoprimime.body_encode(text.encode('utf-8').decode('latin-1'), eol=eol)
+
+
+def check_header(value: str, name: str = None) -> str:
+    """Header value unchanged; HeaderParseError if it contains CR or LF"""
+    if '\r' in value or '\n' in value:
+        raise HeaderParseError(f"Salto de línea no permitido en la cabecera {name or ''}: {value!r}")
+    return value
+
+
+def encode_header(value: str, name: str = None, eol: str = '\n') -> str:
+    """Header value folded with email.header, RFC 2047 encoded if not ASCII"""
+    check_header(value, name)
+    try:
+        value.encode('ascii')
+        charset = 'us-ascii'
+    except UnicodeEncodeError:
+        charset = 'utf-8'
+    return Header(value, charset, header_name=name).encode(linesep=eol)
+
+
+def format_from(email: str, sender_name: str = None) -> str:
+    """From header value with an encoded display name"""
+    return formataddr((check_header(sender_name or 'Tu Nombre', 'From'), check_header(email, 'From')),
+                      charset='utf-8')
+
+
+def format_to(email: str) -> str:
+    """To header value for a single address"""
+    return formataddr(('', check_header(email.strip(), 'To')), charset='utf-8')
+
+
+class EncodedTemplate:
+    """HTML template whose static parts are already quoted-printable encoded"""
+
+    def __init__(self, template: CompiledTemplate, eol: str = '\n'):
+        self.template = template
+        self.eol = eol
+        self.soft_break = '=' + eol
+        self.static = [qp_encode(segment, eol) if segment else '' for segment in template.static_segments]
+        self.placeholders = [f"{{{{{key}}}}}" for _, key in template.slots]
+        # QP nunca deja un "=" literal en el cuerpo, así que el boundary no puede aparecer en él
+        self.boundary = '=' * 15 + str(random.randrange(10 ** 18, 10 ** 19)) + '=='
+        self.part_header = eol.join([
+            '',
+            f'--{self.boundary}',
+            'Content-Type: text/html; charset="utf-8"',
+            'MIME-Version: 1.0',
+            'Content-Transfer-Encoding: quoted-printable',
+            '',
+            ''
+        ])
+        self.closing = f'{eol}--{self.boundary}--{eol}'
+
+    def encode_body(self, values: Mapping) -> str:
+        """Quoted-printable body for one recipient"""
+        pieces: List[str] = [self.static[0]]
+        for (_, key), placeholder, static in zip(self.template.slots, self.placeholders, self.static[1:]):
+            value = values.get(key, MISSING)
+            if value is MISSING:
+                value = placeholder
+            elif not isinstance(value, str):
+                value = str(value)
+            pieces.append(qp_encode(value, self.eol))
+            pieces.append(static)
+        return self.soft_break.join(piece for piece in pieces if piece)
+
+    def build_message(self, from_header: str, to_email: str, subject: str, values: Mapping) -> str:
+        """Complete multipart/mixed message with one text/html QP part.
+
+        Raises HeaderParseError if a header value contains CR or LF.
+        """
+        eol = self.eol
+        headers = eol.join([
+            f'Content-Type: multipart/mixed; boundary="{self.boundary}"',
+            'MIME-Version: 1.0',
+            f'From: {check_header(from_header, "From")}',
+            f'To: {format_to(to_email)}',
+            f'Subject: {encode_header(subject, "Subject", eol)}',
+            ''
+        ])
+        return headers + self.part_header + self.encode_body(values) + self.closing
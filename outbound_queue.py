@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+OUTBOUND QUEUE - DURABLE PER-RECIPIENT SEND QUEUE
+=================================================
+
+Crash-safe queue of campaign recipients stored in SQLite:
+- One row per recipient: queued -> in_flight -> sent / failed, or retry
+  (with a retry_at timestamp) after a transient error
+- Workers claim rows in batches inside an IMMEDIATE transaction, so two
+  workers never get the same recipient
+- Every state change is committed (WAL journal), so a restarted process
+  picks up exactly the rows that were not acknowledged as sent
+- Rows left in_flight by a dead process (or claimed longer ago than the
+  lease timeout) are put back in the queue by recover(); rows a live
+  process is sending are left alone. Senders acknowledge each recipient as
+  its result arrives, so only the sends that were in flight at the crash
+  can be sent twice
+- One live process drains a campaign at a time (acquire_campaign), so a
+  second process resuming the queue does not relaunch it
+- Each recipient has an idempotency key (campaign + address), so a contact
+  already queued or delivered is never queued again for the same campaign
+- Enqueueing is checkpointed by contact id: a resumed campaign only reads
+  the contacts after the last committed offset
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from config import Config
+
+QUEUED = 'queued'
+IN_FLIGHT = 'in_flight'
+SENT = 'sent'
+FAILED = 'failed'
+RETRY = 'retry'
+
+STATES = (QUEUED, IN_FLIGHT, SENT, FAILED, RETRY)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbound (
+    id INTEGER PRIMARY KEY,
+    campaign_id INTEGER NOT NULL,
+    contact_id INTEGER,
+    email TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    retry_at REAL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    sent_at REAL,
+    last_error TEXT,
+    UNIQUE (campaign_id, contact_id)
+);
+CREATE INDEX IF NOT EXISTS ix_outbound_claim ON outbound (campaign_id, state, id);
+CREATE TABLE IF NOT EXISTS campaign_checkpoint (
+    campaign_id INTEGER PRIMARY KEY,
+    last_contact_id INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+"""
+
+_process = (None, None)
+
+
+def process_id() -> str:
+    """'pid:token' of this process; the token tells it apart from an earlier process with the same pid"""
+    global _process
+    pid = os.getpid()
+    if _process[0] != pid:  # primera llamada, o proceso hijo de un fork
+        _process = (pid, uuid.uuid4().hex[:8])
+    return f"{_process[0]}:{_process[1]}"
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == 'nt':
+        # os.kill(pid, 0) terminaría el proceso en Windows: preguntar con OpenProcess
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x00100000, False, pid)  # SYNCHRONIZE
+        if not handle:
+            return False
+        try:
+            return kernel32.WaitForSingleObject(handle, 0) == 0x102  # WAIT_TIMEOUT: sigue vivo
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def process_alive(owner: Optional[str]) -> bool:
+    """Whether the process that wrote `owner` (process_id(), optionally followed by ':thread') still runs"""
+    if not owner:
+        return False
+    me = process_id()
+    if owner == me or owner.startswith(me + ':'):
+        return True
+    try:
+        pid = int(owner.split(':', 1)[0])
+    except ValueError:
+        return False
+    if pid == os.getpid():
+        return False  # un proceso anterior con nuestro pid (p. ej. un contenedor reiniciado)
+    return _pid_alive(pid)
+
+
+def idempotency_key(campaign_id: int, email: str) -> str:
+    """Stable key of one recipient within a campaign"""
+    return hashlib.sha1(f"{campaign_id}:{email.strip().lower()}".encode('utf-8')).hexdigest()[:24]
+
+
+class OutboundItem(NamedTuple):
+    id: int
+    campaign_id: int
+    contact_id: Optional[int]
+    email: str
+    data: Dict
+    attempts: int
+    idempotency_key: Optional[str] = None
+
+
+class OutboundQueue:
+    """Per-recipient outbound queue backed by a SQLite file"""
+
+    def __init__(self, path: str = 'outbound_queue.db', max_attempts: int = 3,
+                 retry_backoff: float = 60, chunk_size: int = 500, lease_timeout: float = 1800):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.chunk_size = chunk_size
+        self.lease_timeout = lease_timeout
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        # colas creadas antes de las claves de idempotencia
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(outbound)")}
+        if 'idempotency_key' not in columns:
+            conn.execute("ALTER TABLE outbound ADD COLUMN idempotency_key TEXT")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_outbound_key ON outbound (idempotency_key)")
+        # colas creadas antes de registrar qué proceso envía cada campaña
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(campaign_checkpoint)")}
+        if 'owner' not in columns:
+            conn.execute("ALTER TABLE campaign_checkpoint ADD COLUMN owner TEXT")
+
+    def _connection(self) -> sqlite3.Connection:
+        # una conexión por hilo: sqlite3 no comparte conexiones entre hilos
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, immediate: bool = False):
+        return _Transaction(self._connection(), immediate)
+
+    def enqueue(self, campaign_id: int, contacts: Iterable[Tuple[Optional[int], Dict]]) -> int:
+        """Queue (contact_id, data) pairs in contact id order; data must carry 'email'.
+
+        Recipients already queued for the campaign (same contact or same
+        address) are skipped. The highest contact id is committed with each
+        chunk as the campaign checkpoint.
+        """
+        added = 0
+        chunk: List[Tuple] = []
+
+        def flush():
+            nonlocal added
+            last_contact_id = max((row[1] for row in chunk if row[1] is not None), default=None)
+            with self._transaction() as conn:
+                before = conn.total_changes
+                conn.executemany(
+                    "INSERT OR IGNORE INTO outbound (campaign_id, contact_id, email, payload, idempotency_key) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    chunk
+                )
+                added += conn.total_changes - before
+                if last_contact_id is not None:
+                    conn.execute(
+                        "INSERT INTO campaign_checkpoint (campaign_id, last_contact_id, updated_at) "
+                        "VALUES (?, ?, ?) ON CONFLICT (campaign_id) DO UPDATE SET "
+                        "last_contact_id = MAX(last_contact_id, excluded.last_contact_id), "
+                        "updated_at = excluded.updated_at",
+                        (campaign_id, last_contact_id, time.time())
+                    )
+            chunk.clear()
+
+        for contact_id, data in contacts:
+            chunk.append((campaign_id, contact_id, data['email'], json.dumps(data, ensure_ascii=False),
+                          idempotency_key(campaign_id, data['email'])))
+            if len(chunk) >= self.chunk_size:
+                flush()
+        if chunk:
+            flush()
+        return added
+
+    def claim(self, campaign_id: int, limit: int, worker: str = None) -> List[OutboundItem]:
+        """Atomically move up to `limit` due rows to in_flight and return them"""
+        now = time.time()
+        worker = worker or f"{process_id()}:{threading.get_ident()}"
+        with self._transaction(immediate=True) as conn:
+            rows = conn.execute(
+                "SELECT id, campaign_id, contact_id, email, payload, attempts, idempotency_key FROM outbound "
+                "WHERE campaign_id = ? AND (state = ? OR (state = ? AND retry_at <= ?)) "
+                "ORDER BY id LIMIT ?",
+                (campaign_id, QUEUED, RETRY, now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbound SET state = ?, attempts = attempts + 1, claimed_by = ?, claimed_at = ? "
+                "WHERE id = ?",
+                [(IN_FLIGHT, worker, now, row[0]) for row in rows]
+            )
+        return [OutboundItem(row[0], row[1], row[2], row[3], json.loads(row[4]), row[5] + 1, row[6])
+                for row in rows]
+
+    def mark_sent(self, ids: Iterable[int]) -> int:
+        """Acknowledge delivered rows; rows already marked sent are left untouched"""
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE outbound SET state = ?, sent_at = ?, last_error = NULL WHERE id = ? AND state != ?",
+                [(SENT, now, item_id, SENT) for item_id in ids]
+            )
+            return conn.total_changes - before
+
+    def mark_failed(self, failures: Iterable[Tuple[OutboundItem, str]],
+                    retryable: bool = True) -> List[OutboundItem]:
+        """Schedule a retry with exponential back-off, or fail for good after max_attempts.
+
+        Returns the items that failed for good (no retry left).
+        """
+        now = time.time()
+        updates = []
+        final = []
+        for item, error in failures:
+            if retryable and item.attempts < self.max_attempts:
+                retry_at = now + self.retry_backoff * 2 ** (item.attempts - 1)
+                updates.append((RETRY, retry_at, error, item.id))
+            else:
+                updates.append((FAILED, None, error, item.id))
+                final.append(item)
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE outbound SET state = ?, retry_at = ?, last_error = ? WHERE id = ?", updates
+            )
+        return final
+
+    def recover(self, campaign_id: int = None, lease: float = None) -> int:
+        """Put rows left in_flight by a stopped process back in the queue.
+        
+        A row is recovered when the process that claimed it is no longer
+        running, or when it was claimed more than `lease` seconds ago
+        (lease_timeout by default); rows a live process is still sending are
+        left in_flight. lease=0 recovers every in_flight row.
+        """
+        lease = self.lease_timeout if lease is None else lease
+        expired = time.time() - lease
+        query = "SELECT id, claimed_by, claimed_at FROM outbound WHERE state = ?"
+        params: Tuple = (IN_FLIGHT,)
+        if campaign_id is not None:
+            query += " AND campaign_id = ?"
+            params += (campaign_id,)
+        with self._transaction(immediate=True) as conn:
+            alive: Dict[str, bool] = {}
+            ids = []
+            for row_id, claimed_by, claimed_at in conn.execute(query, params).fetchall():
+                if claimed_by not in alive:
+                    alive[claimed_by] = process_alive(claimed_by)
+                if not alive[claimed_by] or (claimed_at or 0) <= expired:
+                    ids.append(row_id)
+            conn.executemany("UPDATE outbound SET state = ? WHERE id = ? AND state = ?",
+                             [(QUEUED, row_id, IN_FLIGHT) for row_id in ids])
+        if ids:
+            logging.warning(f"🔁 {len(ids)} envíos en curso devueltos a la cola")
+        return len(ids)
+
+    def acquire_campaign(self, campaign_id: int, owner: str = None) -> bool:
+        """Record `owner` (this process) as the one draining the campaign.
+        
+        Returns False, changing nothing, while another live process holds it.
+        """
+        owner = owner or process_id()
+        with self._transaction(immediate=True) as conn:
+            row = conn.execute("SELECT owner FROM campaign_checkpoint WHERE campaign_id = ?",
+                               (campaign_id,)).fetchone()
+            current = row[0] if row else None
+            if current and current != owner and process_alive(current):
+                return False
+            conn.execute(
+                "INSERT INTO campaign_checkpoint (campaign_id, owner, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (campaign_id) DO UPDATE SET owner = excluded.owner",
+                (campaign_id, owner, time.time())
+            )
+        return True
+
+    def release_campaign(self, campaign_id: int, owner: str = None):
+        """Stop holding the campaign (only if `owner` still holds it)"""
+        with self._transaction() as conn:
+            conn.execute("UPDATE campaign_checkpoint SET owner = NULL WHERE campaign_id = ? AND owner = ?",
+                         (campaign_id, owner or process_id()))
+
+    def campaign_owner(self, campaign_id: int) -> Optional[str]:
+        """Live process draining the campaign, or None"""
+        row = self._connection().execute(
+            "SELECT owner FROM campaign_checkpoint WHERE campaign_id = ?", (campaign_id,)
+        ).fetchone()
+        owner = row[0] if row else None
+        return owner if process_alive(owner) else None
+
+    def retry_failed(self, campaign_id: int) -> int:
+        """Give rows that ran out of attempts a fresh set of retries"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE outbound SET state = ?, attempts = 0, retry_at = NULL WHERE campaign_id = ? AND state = ?",
+                (QUEUED, campaign_id, FAILED)
+            )
+            return cursor.rowcount
+
+    def checkpoint(self, campaign_id: int) -> int:
+        """Highest contact id already queued for the campaign (0 if none)"""
+        row = self._connection().execute(
+            "SELECT last_contact_id FROM campaign_checkpoint WHERE campaign_id = ?", (campaign_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def next_retry_in(self, campaign_id: int) -> Optional[float]:
+        """Seconds until the next retry is due, or None if nothing is waiting"""
+        row = self._connection().execute(
+            "SELECT MIN(retry_at) FROM outbound WHERE campaign_id = ? AND state = ?", (campaign_id, RETRY)
+        ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def has_campaign(self, campaign_id: int) -> bool:
+        return self._connection().execute(
+            "SELECT 1 FROM outbound WHERE campaign_id = ? LIMIT 1", (campaign_id,)
+        ).fetchone() is not None
+
+    def counts(self, campaign_id: int) -> Dict[str, int]:
+        """Rows per state for a campaign"""
+        counts = dict.fromkeys(STATES, 0)
+        for state, count in self._connection().execute(
+                "SELECT state, COUNT(*) FROM outbound WHERE campaign_id = ? GROUP BY state", (campaign_id,)):
+            counts[state] = count
+        return counts
+
+    def unfinished_campaigns(self) -> List[int]:
+        """Campaigns that still have rows to send"""
+        return [row[0] for row in self._connection().execute(
+            "SELECT DISTINCT campaign_id FROM outbound WHERE state IN (?, ?, ?)", (QUEUED, IN_FLIGHT, RETRY)
+        )]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class _Transaction:
+    """BEGIN ... COMMIT / ROLLBACK on an autocommit connection"""
+
+    def __init__(self, conn: sqlite3.Connection, immediate: bool):
+        self.conn = conn
+        self.immediate = immediate
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute('BEGIN IMMEDIATE' if self.immediate else 'BEGIN')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+_queue: Optional[OutboundQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_outbound_queue() -> OutboundQueue:
+    """Process-wide queue configured from Config"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = OutboundQueue(
+                path=Config.OUTBOUND_QUEUE_DB,
+                max_attempts=Config.OUTBOUND_MAX_ATTEMPTS,
+                retry_backoff=Config.OUTBOUND_RETRY_BACKOFF,
+                lease_timeout=Config.OUTBOUND_LEASE_TIMEOUT
+            )
+        return _queue
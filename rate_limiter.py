@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+RATE LIMITER - SHARED SENDING BUDGETS
+=====================================
+
+Token-bucket rate limiting shared by every sender:
+- Per-second, per-minute and per-hour buckets
+- Burst allowance on the per-second bucket
+- One limiter per provider and account, shared across threads
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from config import Config
+
+
+class TokenBucket:
+    """Token bucket holding up to `capacity` tokens, refilled at `rate` tokens per `per` seconds"""
+
+    def __init__(self, rate: float, per: float, capacity: float = None):
+        self.rate = rate
+        self.per = per
+        self.capacity = float(capacity if capacity else rate)
+        self.fill_rate = rate / per
+        self.scale = 1.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        """Add the tokens accumulated since the last update"""
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.fill_rate * self.scale)
+            self.updated = now
+
+    def wait_time(self, tokens: float) -> float:
+        """Seconds until `tokens` can be taken (0 if available now).
+
+        Requests larger than the capacity only wait for a full bucket and
+        leave it in debt, so they are paid back by the following sends.
+        """
+        needed = min(tokens, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / (self.fill_rate * self.scale)
+
+    def take(self, tokens: float):
+        """Remove tokens from the bucket"""
+        self.tokens -= tokens
+
+
+class RateLimiter:
+    """Combined per-second / per-minute / per-hour limiter"""
+
+    def __init__(self, per_second: float = None, per_minute: float = None,
+                 per_hour: float = None, burst: int = None, name: str = 'default'):
+        self.name = name
+        self.buckets: List[TokenBucket] = []
+        if per_second:
+            self.buckets.append(TokenBucket(per_second, 1, max(per_second, burst or 0)))
+        if per_minute:
+            self.buckets.append(TokenBucket(per_minute, 60))
+        if per_hour:
+            self.buckets.append(TokenBucket(per_hour, 3600))
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.waited = 0.0
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Take tokens from every bucket if all allow it.
+
+        Returns 0 on success, otherwise the seconds to wait before retrying.
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait = 0.0
+            for bucket in self.buckets:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(tokens))
+            if wait > 0:
+                return wait
+            for bucket in self.buckets:
+                bucket.take(tokens)
+            self.acquired += tokens
+            return 0.0
+
+    def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+        """Block until tokens are available; False if the timeout expires first"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            with self.lock:
+                self.waited += wait
+            time.sleep(wait)
+
+    def set_scale(self, scale: float):
+        """Run the buckets at a fraction of their configured refill rate"""
+        with self.lock:
+            now = time.monotonic()
+            for bucket in self.buckets:
+                bucket.refill(now)
+                bucket.scale = scale
+
+    def get_stats(self) -> Dict:
+        """Current budgets and counters"""
+        with self.lock:
+            now = time.monotonic()
+            buckets = []
+            for bucket in self.buckets:
+                bucket.refill(now)
+                buckets.append({
+                    'limit': bucket.rate,
+                    'per_seconds': bucket.per,
+                    'scale': round(bucket.scale, 3),
+                    'available': round(bucket.tokens, 2)
+                })
+            return {
+                'name': self.name,
+                'acquired': self.acquired,
+                'waited_seconds': round(self.waited, 2),
+                'buckets': buckets
+            }
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, account: str = None) -> RateLimiter:
+    """Shared limiter for a provider/account pair.
+
+    The budget comes from Config.PROVIDER_RATE_LIMITS, overridden by any
+    entry for the account in Config.ACCOUNT_RATE_LIMITS.
+    """
+    account = (account or '').lower()
+    key = (provider, account)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            budget = dict(Config.PROVIDER_RATE_LIMITS.get(provider, {}))
+            budget.update(Config.ACCOUNT_RATE_LIMITS.get(account, {}))
+            limiter = RateLimiter(name=f"{provider}:{account}" if account else provider, **budget)
+            _limiters[key] = limiter
+        return limiter
+
+
+def reset_rate_limiters(provider: Optional[str] = None):
+    """Forget shared limiters (all, or those of one provider)"""
+    with _limiters_lock:
+        for key in list(_limiters):
+            if provider is None or key[0] == provider:
+                del _limiters[key]
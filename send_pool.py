@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SEND WORKER POOL - CONCURRENT DELIVERY
+======================================
+
+Fixed pool of send threads fed from a bounded queue:
+- Keeps N sends in flight so network latency overlaps
+- Bounded queue gives back-pressure to the producer
+- Pace is still set by the shared rate limiter / adaptive throttle
+- Every item gets exactly one on_result(item, result) call; when the
+  handler raises, the exception itself is passed as the result
+"""
+
+import logging
+import queue
+import threading
+from typing import Any, Callable, Iterable, Optional
+
+_STOP = object()
+
+
+class SendWorkerPool:
+    """Pool of worker threads running `handler(item)` for every submitted item.
+    
+    on_result(item, result) is called once per item under a lock, with the
+    exception as result when the handler raised.
+    """
+
+    def __init__(self, handler: Callable[[Any], Any], workers: int = 4,
+                 queue_size: int = None, on_result: Callable[[Any, Any], None] = None,
+                 name: str = 'send-worker'):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.on_result = on_result
+        self.name = name
+        self.queue = queue.Queue(maxsize=queue_size or self.workers * 2)
+        self.threads = []
+        self.result_lock = threading.Lock()
+        self.processed = 0
+        self.errors = 0
+
+    def start(self):
+        """Start the worker threads"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i + 1}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, item: Any, timeout: Optional[float] = None):
+        """Queue an item, blocking while the queue is full"""
+        self.queue.put(item, timeout=timeout)
+
+    def close(self):
+        """Wait for queued items to finish and stop the workers"""
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            failed = False
+            try:
+                result = self.handler(item)
+            except Exception as e:
+                logging.error(f"{threading.current_thread().name}: error processing item: {str(e)}")
+                result, failed = e, True
+            with self.result_lock:
+                if failed:
+                    self.errors += 1
+                else:
+                    self.processed += 1
+                if self.on_result:
+                    try:
+                        self.on_result(item, result)
+                    except Exception as e:
+                        logging.error(f"{threading.current_thread().name}: error recording result: {str(e)}")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def run_pool(items: Iterable, handler: Callable[[Any], Any], workers: int = 4,
+             queue_size: int = None, on_result: Callable[[Any, Any], None] = None) -> SendWorkerPool:
+    """Run handler over items with a worker pool; on_result is called under a lock (see SendWorkerPool)"""
+    pool = SendWorkerPool(handler, workers, queue_size, on_result)
+    with pool:
+        for item in items:
+            pool.submit(item)
+    return pool
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ASYNC SENDGRID TRANSPORT
+========================
+
+Asyncio variant of SendGridDefinitive:
+- One pooled keep-alive aiohttp.ClientSession
+- Hundreds of /mail/send requests in flight on a single event loop
+- Contacts streamed through a semaphore-bounded set of tasks
+- Same rate limiter, adaptive throttle and batched personalizations as the sync sender
+
+Run `python sendgrid_async.py --stub` to benchmark against sendgrid_stub_server.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from typing import AsyncIterable, Dict, Iterable, List, Optional, Union
+
+from sendgrid_definitivo import SendGridDefinitive
+from template_engine import CompiledMessage, compile_template
+from adaptive_throttle import retry_after_from_response, HTTP_THROTTLE_STATUSES
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, only needed for the async transport
+    aiohttp = None
+
+Contacts = Union[Iterable[Dict], AsyncIterable[Dict]]
+
+
+class AsyncSendGridDefinitive(SendGridDefinitive):
+    """Asyncio SendGrid sender sharing budgets and helpers with SendGridDefinitive"""
+
+    def __init__(self, api_key=None, max_in_flight: int = 100, base_url: str = None,
+                 connect_timeout: float = 5, read_timeout: float = 30):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for AsyncSendGridDefinitive (pip install aiohttp)")
+        super().__init__(api_key, pool_size=max_in_flight,
+                         connect_timeout=connect_timeout, read_timeout=read_timeout)
+        if base_url:
+            self.base_url = base_url.rstrip('/')
+        self.max_in_flight = max_in_flight
+        self._client = None
+
+    @property
+    def client(self) -> 'aiohttp.ClientSession':
+        """Pooled keep-alive session, created on first use inside the running loop"""
+        if self._client is None:
+            self._client = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+                timeout=aiohttp.ClientTimeout(connect=self.timeout[0], sock_read=self.timeout[1])
+            )
+        return self._client
+
+    async def aclose(self):
+        """Close the async session and its connections"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def _acquire_rate(self):
+        """Async wait on the shared token buckets"""
+        while True:
+            wait = self.rate_limiter.try_acquire()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _post_mail(self, data: Dict) -> 'aiohttp.ClientResponse':
+        """POST /mail/send, backing off and retrying while SendGrid throttles"""
+        for attempt in range(self.max_retries + 1):
+            pause = self.throttle.pause_remaining()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._acquire_rate()
+            async with self.client.post(f"{self.base_url}/mail/send", json=data) as response:
+                # Read the body so the connection goes back to the keep-alive pool
+                await response.read()
+
+            if response.status not in HTTP_THROTTLE_STATUSES:
+                if response.status == 202:
+                    self.throttle.on_success()
+                return response
+
+            pause = self.throttle.on_throttle(retry_after_from_response(response))
+            logging.warning(f"THROTTLED by Twilio SendGrid ({response.status}), "
+                            f"backing off {pause:.1f}s (attempt {attempt + 1}/{self.max_retries + 1})")
+
+        return response
+
+    async def test_connection(self) -> bool:
+        """Test connection with Twilio SendGrid"""
+        try:
+            async with self.client.get(f"{self.base_url}/user/profile") as response:
+                if response.status == 200:
+                    user_data = await response.json()
+                    logging.info(f"SUCCESSFUL connection to Twilio SendGrid for {user_data.get('email', 'user')}")
+                    return True
+                logging.error(f"CONNECTION ERROR to Twilio SendGrid: {response.status}")
+                return False
+        except Exception as e:
+            logging.error(f"CONNECTION ERROR to Twilio SendGrid: {str(e)}")
+            return False
+
+    async def send_email(self, to_email: str, subject: str, body: str,
+                         sender_name: str = None, from_email: str = None,
+                         custom_headers: Dict = None) -> bool:
+        """Send one email"""
+        data = {
+            "personalizations": [
+                {
+                    "to": [{"email": to_email}],
+                    "headers": self.create_professional_headers(custom_headers)
+                }
+            ],
+            "from": {
+                "email": from_email or "heliopsis@outlook.be",
+                "name": sender_name or "Heliopsis"
+            },
+            "subject": subject,
+            "content": [{"type": "text/html", "value": body}]
+        }
+        try:
+            response = await self._post_mail(data)
+            if response.status == 202:
+                self._count(sent=1)
+                return True
+            self._count(failed=1)
+            logging.error(f"ERROR sending email to {to_email}: {response.status}")
+            return False
+        except Exception as e:
+            self._count(failed=1)
+            logging.error(f"ERROR sending email to {to_email}: {str(e)}")
+            return False
+
+    async def send_personalized_batch(self, emails: List[Dict], subject: str, body: str,
+                                      sender_name: str = None, from_email: str = None,
+                                      custom_headers: Dict = None) -> Dict:
+        """Send one multi-personalization request (see SendGridDefinitive.send_personalized_batch)"""
+        batch_results = {'sent': 0, 'failed': 0, 'errors': [], 'rejected': {}, 'error': None}
+        if not emails:
+            return batch_results
+
+        recipients = emails
+        try:
+            data, recipients, batch_results = self._prepare_personalized_batch(
+                emails, subject, body, sender_name, from_email, custom_headers)
+            if not recipients:
+                return batch_results
+            response = await self._post_mail(data)
+            if response.status == 202:
+                self._count(sent=len(recipients))
+                batch_results['sent'] = len(recipients)
+            else:
+                logging.error(f"ERROR sending batch of {len(recipients)} emails: {response.status}")
+                self._fail_personalized_batch(batch_results, recipients,
+                                              f"Error sending batch: {response.status}")
+        except Exception as e:
+            logging.error(f"ERROR sending batch of {len(recipients)} emails: {str(e)}")
+            self._fail_personalized_batch(batch_results, recipients, f"Error sending batch: {str(e)}")
+        return batch_results
+
+    async def _units(self, emails: Contacts, size: int):
+        """Yield contacts (size 1) or lists of contacts from a sync or async source"""
+        chunk = []
+        if hasattr(emails, '__aiter__'):
+            async for email_data in emails:
+                chunk.append(email_data)
+                if len(chunk) >= size:
+                    yield chunk
+                    chunk = []
+        else:
+            for email_data in emails:
+                chunk.append(email_data)
+                if len(chunk) >= size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    async def send_bulk_emails(self, emails: Contacts, subject: str, template: str,
+                               sender_name: str = None, from_email: str = None,
+                               custom_headers: Dict = None, batch_mode: bool = False,
+                               max_in_flight: Optional[int] = None) -> Dict:
+        """Stream contacts through at most max_in_flight concurrent requests"""
+        results = {'total': 0, 'sent': 0, 'failed': 0, 'errors': [], 'batches': 0}
+
+        if not await self.test_connection():
+            logging.error("COULD NOT establish connection to Twilio SendGrid")
+            return results
+
+        semaphore = asyncio.Semaphore(max_in_flight or self.max_in_flight)
+        tasks = set()
+        body = self.optimize_email_content(template, {}) if batch_mode else None
+        message = None if batch_mode else CompiledMessage(compile_template(subject), self.compile_content(template))
+
+        async def send(unit: List[Dict]):
+            try:
+                if batch_mode:
+                    unit_results = await self.send_personalized_batch(
+                        unit, subject, body, sender_name, from_email, custom_headers)
+                else:
+                    email_data = unit[0]
+                    personalized_subject, personalized_body = message.render(email_data)
+                    unit_results = {'sent': 0, 'failed': 0, 'errors': []}
+                    if await self.send_email(email_data['email'], personalized_subject, personalized_body,
+                                             sender_name, from_email, custom_headers):
+                        unit_results['sent'] = 1
+                    else:
+                        unit_results['failed'] = 1
+                        unit_results['errors'].append(f"Error sending to {email_data['email']}")
+                results['batches'] += 1
+                results['sent'] += unit_results['sent']
+                results['failed'] += unit_results['failed']
+                results['errors'].extend(unit_results['errors'])
+            finally:
+                semaphore.release()
+
+        size = self.max_personalizations if batch_mode else 1
+        async for unit in self._units(emails, size):
+            results['total'] += len(unit)
+            await semaphore.acquire()
+            task = asyncio.ensure_future(send(unit))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+        logging.info(f"ASYNC BULK SEND completed: {results['sent']} sent, {results['failed']} failed")
+        return results
+
+
+def main():
+    """Benchmark the async transport against the local SendGrid stub"""
+    from sendgrid_stub_server import SendGridStub
+    from rate_limiter import RateLimiter
+
+    parser = argparse.ArgumentParser(description='Async SendGrid transport benchmark')
+    parser.add_argument('--stub', action='store_true', help='run against a local stub server')
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--in-flight', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--batch', action='store_true', help='use multi-personalization requests')
+    args = parser.parse_args()
+
+    if not args.stub:
+        print("Use --stub to benchmark against the local stub server")
+        return
+
+    async def run():
+        stub = SendGridStub(latency=args.latency)
+        base_url = await stub.start()
+        emails = ({'email': f"user{i}@example.com", 'name': f"User {i}"} for i in range(args.count))
+
+        async with AsyncSendGridDefinitive(api_key='stub', max_in_flight=args.in_flight,
+                                           base_url=base_url) as sender:
+            sender.rate_limiter = RateLimiter(name='stub')  # measure the transport, not the budget
+            start = time.monotonic()
+            results = await sender.send_bulk_emails(
+                emails, "Hola {{name}}", "<html><body>Hola {{name}}</body></html>",
+                batch_mode=args.batch)
+            elapsed = time.monotonic() - start
+
+        await stub.stop()
+        print(f"📊 {results['sent']} sent, {results['failed']} failed in {elapsed:.2f}s "
+              f"({results['sent'] / elapsed:.0f} emails/s)")
+        print(f"🔌 Stub stats: {stub.stats}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -13,13 +13,24 @@ Optimized system with the definitive Twilio SendGrid account:
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
+import hashlib
 import logging
-from typing import List, Dict
+import threading
+from typing import Callable, List, Dict, Optional
 from tqdm import tqdm
 import os
 from datetime import datetime
+from rate_limiter import get_rate_limiter
+from adaptive_throttle import get_throttle, retry_after_from_response, HTTP_THROTTLE_STATUSES
+from config import Config
+from send_pool import run_pool
+from template_engine import CompiledMessage, clean_header, compile_template, extract_placeholders
+
+# Per-recipient key of the outbound queue, so duplicates can be traced downstream
+IDEMPOTENCY_HEADER = 'X-Idempotency-Key'
 
 # Configure logging
 logging.basicConfig(
@@ -34,7 +45,8 @@ logging.basicConfig(
 class SendGridDefinitive:
     """Definitive email sending system using Twilio SendGrid"""
     
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, pool_size: int = 10,
+                 connect_timeout: float = 5, read_timeout: float = 30):
         # Definitive Twilio SendGrid API Key
         self.api_key = api_key or "YOUR_SENDGRID_API_KEY"
         self.base_url = "https://api.sendgrid.com/v3"
@@ -44,6 +56,7 @@ class SendGridDefinitive:
         }
         self.sent_count = 0
         self.failed_count = 0
+        self._stats_lock = threading.Lock()
         
         # Definitive professional headers to avoid spam
         self.default_headers = {
@@ -56,18 +69,100 @@ class SendGridDefinitive:
             'X-Contact-Info': 'heliopsis@outlook.be'
         }
         
-        # Optimized sending configuration
-        self.emails_per_minute = 10
-        self.delay_between_emails = 6
+        # Sending pace: shared token buckets per account (see Config.PROVIDER_RATE_LIMITS)
+        account_id = hashlib.sha1(self.api_key.encode('utf-8')).hexdigest()[:12]
+        self.rate_limiter = get_rate_limiter('sendgrid', account_id)
+        # AIMD back-off on 429 + Retry-After, shared with other senders of the account
+        self.throttle = get_throttle('sendgrid', account_id)
+        self.max_retries = Config.THROTTLE_MAX_RETRIES
         
         # Large list handling
         self.max_batch_size = 100
-        self.batch_delay = 60  # seconds between batches
         
+        # Batched mode: recipients packed per /mail/send request (API limit is 1000)
+        self.max_personalizations = 1000
+        
+        # Keep-alive HTTP session shared by every call (and every worker thread)
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self._session = None
+        self._session_lock = threading.Lock()
+    
+    @property
+    def session(self) -> requests.Session:
+        """Pooled keep-alive session, created on first use"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    # pool_block makes extra threads wait for a free connection
+                    # instead of opening (and handshaking) throwaway ones
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                          pool_block=True)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+        return self._session
+    
+    def close(self):
+        """Close the pooled connections"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+    
+    def get_connection_stats(self) -> Dict:
+        """Connection reuse counters of the pooled session"""
+        stats = {'requests': 0, 'new_connections': 0, 'reused_connections': 0,
+                 'pool_size': self.pool_size}
+        session = self._session
+        if session is None:
+            return stats
+        
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    stats['requests'] += pool.num_requests
+                    stats['new_connections'] += pool.num_connections
+        
+        stats['reused_connections'] = max(0, stats['requests'] - stats['new_connections'])
+        return stats
+        
+    def _post_mail(self, data: Dict) -> requests.Response:
+        """POST /mail/send, backing off and retrying while SendGrid throttles"""
+        for attempt in range(self.max_retries + 1):
+            with self.throttle.slot():
+                self.rate_limiter.acquire()
+                response = self.session.post(
+                    f"{self.base_url}/mail/send",
+                    json=data,
+                    timeout=self.timeout
+                )
+            
+            if response.status_code not in HTTP_THROTTLE_STATUSES:
+                if response.status_code == 202:
+                    self.throttle.on_success()
+                return response
+            
+            pause = self.throttle.on_throttle(retry_after_from_response(response))
+            logging.warning(f"THROTTLED by Twilio SendGrid ({response.status_code}), "
+                            f"backing off {pause:.1f}s (attempt {attempt + 1}/{self.max_retries + 1})")
+        
+        return response
+    
+    def _count(self, sent: int = 0, failed: int = 0):
+        """Update the sending counters (called from worker threads)"""
+        with self._stats_lock:
+            self.sent_count += sent
+            self.failed_count += failed
+    
     def test_connection(self):
         """Test connection with Twilio SendGrid"""
         try:
-            response = requests.get(f"{self.base_url}/user/profile", headers=self.headers)
+            response = self.session.get(f"{self.base_url}/user/profile", timeout=self.timeout)
             if response.status_code == 200:
                 user_data = response.json()
                 logging.info(f"SUCCESSFUL connection to Twilio SendGrid for {user_data.get('email', 'user')}")
@@ -131,13 +226,8 @@ class SendGridDefinitive:
     def optimize_email_content(self, content: str, contact_data: Dict) -> str:
         """Optimize email content to avoid spam"""
         
-        # Personalize content
-        optimized_content = content
-        
-        # Replace placeholders
-        for key, value in contact_data.items():
-            placeholder = f"{{{{{key}}}}}"
-            optimized_content = optimized_content.replace(placeholder, str(value))
+        # Personalize content (compiled once, rendered in a single pass)
+        optimized_content = compile_template(content).render(contact_data)
         
         # If content is already HTML, return as is
         if content.strip().startswith('<!DOCTYPE html>') or content.strip().startswith('<html'):
@@ -174,42 +264,217 @@ class SendGridDefinitive:
                 ]
             }
             
-            response = requests.post(
-                f"{self.base_url}/mail/send",
-                headers=self.headers,
-                json=data
-            )
+            response = self._post_mail(data)
             
             if response.status_code == 202:
-                self.sent_count += 1
+                self._count(sent=1)
                 logging.info(f"EMAIL sent successfully to {to_email}")
                 return True
             else:
-                self.failed_count += 1
+                self._count(failed=1)
                 logging.error(f"ERROR sending email to {to_email}: {response.status_code}")
                 if response.text:
                     logging.error(f"Error details: {response.text}")
                 return False
                 
         except Exception as e:
-            self.failed_count += 1
+            self._count(failed=1)
             logging.error(f"ERROR sending email to {to_email}: {str(e)}")
             return False
     
+    def extract_placeholders(self, *contents: str) -> List[str]:
+        """Return the {{key}} placeholder names used in the given contents"""
+        return extract_placeholders(*contents)
+    
+    def build_personalized_request(self, emails: List[Dict], subject: str, body: str,
+                                   sender_name: str = None, from_email: str = None,
+                                   custom_headers: Dict = None, rejected: List = None) -> Dict:
+        """Build a /mail/send payload with one personalization per recipient.
+        
+        The body and subject keep their {{key}} placeholders; each recipient's
+        values travel as SendGrid substitutions, so the same request can carry
+        up to max_personalizations contacts. Values used in the subject are
+        sent without line breaks, like the subject itself.
+        
+        When a `rejected` list is given, a recipient whose personalization
+        cannot be built is appended to it as (email_data, error) and left out
+        of the request; otherwise the error is raised.
+        """
+        if len(emails) > self.max_personalizations:
+            raise ValueError(f"A single request accepts at most {self.max_personalizations} recipients")
+        
+        email_headers = self.create_professional_headers(custom_headers)
+        subject = clean_header(subject)
+        placeholders = self.extract_placeholders(subject, body)
+        subject_keys = set(self.extract_placeholders(subject))
+        
+        personalizations = []
+        for email_data in emails:
+            try:
+                personalization = {
+                    "to": [{"email": email_data['email']}],
+                    "headers": self._recipient_headers(email_headers, email_data)
+                }
+                substitutions = {
+                    f"{{{{{key}}}}}": clean_header(str(email_data[key])) if key in subject_keys else str(email_data[key])
+                    for key in placeholders if email_data.get(key) is not None
+                }
+            except Exception as e:
+                if rejected is None:
+                    raise
+                rejected.append((email_data, f"Error with {email_data.get('email')}: {str(e)}"))
+                continue
+            if substitutions:
+                personalization["substitutions"] = substitutions
+            personalizations.append(personalization)
+        
+        return {
+            "personalizations": personalizations,
+            "from": {
+                "email": from_email or "heliopsis@outlook.be",  # Verified email
+                "name": sender_name or "Heliopsis"
+            },
+            "subject": subject,
+            "content": [
+                {
+                    "type": "text/html",
+                    "value": body
+                }
+            ]
+        }
+    
+    def _prepare_personalized_batch(self, emails: List[Dict], subject: str, body: str,
+                                    sender_name: str, from_email: str, custom_headers: Dict):
+        """(payload, recipients in it, batch_results) for send_personalized_batch.
+        
+        Recipients that cannot be personalized are already counted as failed
+        in batch_results, with their error in batch_results['rejected']
+        ({id(email_data): error}).
+        """
+        batch_results = {'sent': 0, 'failed': 0, 'errors': [], 'rejected': {}, 'error': None}
+        rejected = []
+        data = self.build_personalized_request(emails, subject, body, sender_name,
+                                               from_email, custom_headers, rejected)
+        if rejected:
+            self._count(failed=len(rejected))
+            logging.error(f"{len(rejected)} recipients left out of the batch: {rejected[0][1]}")
+            batch_results['failed'] += len(rejected)
+            for email_data, error in rejected:
+                batch_results['rejected'][id(email_data)] = error
+                batch_results['errors'].append(error)
+        recipients = [email_data for email_data in emails if id(email_data) not in batch_results['rejected']]
+        return data, recipients, batch_results
+    
+    def _fail_personalized_batch(self, batch_results: Dict, recipients: List[Dict], error: str):
+        """Count every recipient of a failed request; error is the request-level message"""
+        self._count(failed=len(recipients))
+        batch_results['failed'] += len(recipients)
+        batch_results['error'] = error
+        batch_results['errors'].extend(
+            f"{error} ({email_data.get('email')})" for email_data in recipients
+        )
+    
+    def send_personalized_batch(self, emails: List[Dict], subject: str, body: str,
+                                sender_name: str = None, from_email: str = None,
+                                custom_headers: Dict = None) -> Dict:
+        """Send one /mail/send request carrying every recipient of the batch.
+        
+        A recipient whose personalization cannot be built (see
+        build_personalized_request) is reported as failed in
+        batch_results['rejected'] and the rest of the batch is still sent;
+        batch_results['error'] is set when the request itself failed.
+        """
+        batch_results = {'sent': 0, 'failed': 0, 'errors': [], 'rejected': {}, 'error': None}
+        if not emails:
+            return batch_results
+        
+        recipients = emails
+        try:
+            data, recipients, batch_results = self._prepare_personalized_batch(
+                emails, subject, body, sender_name, from_email, custom_headers
+            )
+            if not recipients:
+                return batch_results
+            
+            response = self._post_mail(data)
+            
+            if response.status_code == 202:
+                self._count(sent=len(recipients))
+                batch_results['sent'] = len(recipients)
+                logging.info(f"BATCH of {len(recipients)} emails accepted by Twilio SendGrid")
+            else:
+                logging.error(f"ERROR sending batch of {len(recipients)} emails: {response.status_code}")
+                if response.text:
+                    logging.error(f"Error details: {response.text}")
+                self._fail_personalized_batch(batch_results, recipients,
+                                              f"Error sending batch: {response.status_code}")
+        except Exception as e:
+            logging.error(f"ERROR sending batch of {len(recipients)} emails: {str(e)}")
+            self._fail_personalized_batch(batch_results, recipients, f"Error sending batch: {str(e)}")
+        
+        return batch_results
+    
     def send_bulk_emails(self, emails: List[Dict], subject: str, 
                          template: str, sender_name: str = None, 
-                         from_email: str = None, custom_headers: Dict = None) -> Dict:
-        """Send emails in bulk with definitive optimizations and large list handling"""
+                         from_email: str = None, custom_headers: Dict = None,
+                         batch_mode: bool = False, workers: int = 1,
+                         on_result: Callable[[Dict, Optional[str]], None] = None,
+                         check_connection: bool = True) -> Dict:
+        """Send emails in bulk with definitive optimizations and large list handling
+        
+        With batch_mode=True, recipients are packed into multi-personalization
+        requests of up to max_personalizations contacts instead of one request
+        per contact. With workers > 1, requests are sent by a pool of threads
+        so several are in flight at once (still paced by the rate limiter).
+        on_result(email_data, error) is called once per recipient (error is
+        None when it was sent).
+        """
         results = {'total': len(emails), 'sent': 0, 'failed': 0, 'errors': [], 'batches': 0}
         
-        if not self.test_connection():
+        if check_connection and not self.test_connection():
             logging.error("COULD NOT establish connection to Twilio SendGrid")
             return results
         
         logging.info(f"STARTING bulk send of {len(emails)} emails with definitive account")
         
+        if batch_mode:
+            # Placeholders stay in the body; per-contact values go as substitutions
+            body = self.optimize_email_content(template, {})
+            batches = [emails[i:i + self.max_personalizations]
+                       for i in range(0, len(emails), self.max_personalizations)]
+            
+            with tqdm(total=len(emails), desc="Sending batched") as pbar:
+                def merge(batch, batch_results):
+                    if isinstance(batch_results, Exception):
+                        # send() raised inside the worker pool: the whole request failed
+                        error = f"Error sending batch: {str(batch_results)}"
+                        batch_results = {'sent': 0, 'failed': len(batch), 'rejected': {}, 'error': error,
+                                         'errors': [f"{error} ({email_data['email']})" for email_data in batch]}
+                    results['batches'] += 1
+                    results['sent'] += batch_results['sent']
+                    results['failed'] += batch_results['failed']
+                    results['errors'].extend(batch_results['errors'])
+                    if on_result is not None:
+                        # Recipients left out of the request carry their own error
+                        for email_data in batch:
+                            on_result(email_data, batch_results['rejected'].get(id(email_data),
+                                                                                batch_results['error']))
+                    pbar.update(len(batch))
+                
+                def send(batch):
+                    logging.info(f"Sending request with {len(batch)} recipients")
+                    return self.send_personalized_batch(
+                        batch, subject, body, sender_name, from_email, custom_headers
+                    )
+                
+                if workers > 1:
+                    run_pool(batches, send, workers, on_result=merge)
+                else:
+                    for batch in batches:
+                        merge(batch, send(batch))
+        
         # Handle large lists in batches
-        if len(emails) > self.max_batch_size:
+        elif len(emails) > self.max_batch_size:
             logging.info(f"Large list detected ({len(emails)} emails). Processing in batches of {self.max_batch_size}")
             
             # Split into batches
@@ -220,20 +485,17 @@ class SendGridDefinitive:
                 results['batches'] += 1
                 
                 # Process batch
-                batch_results = self._process_batch(batch, subject, template, sender_name, from_email, custom_headers)
+                batch_results = self._process_batch(batch, subject, template, sender_name,
+                                                    from_email, custom_headers, workers, on_result)
                 
                 # Update results
                 results['sent'] += batch_results['sent']
                 results['failed'] += batch_results['failed']
                 results['errors'].extend(batch_results['errors'])
-                
-                # Delay between batches (except for the last one)
-                if batch_num < len(batches):
-                    logging.info(f"Waiting {self.batch_delay} seconds before next batch...")
-                    time.sleep(self.batch_delay)
         else:
             # Small list, process normally
-            batch_results = self._process_batch(emails, subject, template, sender_name, from_email, custom_headers)
+            batch_results = self._process_batch(emails, subject, template, sender_name,
+                                                from_email, custom_headers, workers, on_result)
             results['sent'] = batch_results['sent']
             results['failed'] = batch_results['failed']
             results['errors'] = batch_results['errors']
@@ -241,39 +503,74 @@ class SendGridDefinitive:
         logging.info(f"BULK SEND completed: {results['sent']} sent, {results['failed']} failed")
         return results
     
+    def compile_content(self, content: str):
+        """Compiled body template, wrapped once in the simple HTML layout if it is plain text"""
+        if not (content.strip().startswith('<!DOCTYPE html>') or content.strip().startswith('<html')):
+            content = self.create_simple_template("Email", content)
+        return compile_template(content)
+    
+    @staticmethod
+    def _recipient_headers(headers: Dict, email_data: Dict) -> Dict:
+        """Headers for one recipient, tagged with its idempotency key when it has one"""
+        key = email_data.get('idempotency_key')
+        if not key:
+            return headers
+        return dict(headers, **{IDEMPOTENCY_HEADER: key})
+    
+    def _send_contact(self, email_data: Dict, subject: str, personalized_body: str,
+                      sender_name: str, from_email: str, custom_headers: Dict) -> Optional[str]:
+        """Send one already personalized contact; returns an error message on failure"""
+        custom_headers = self._recipient_headers(custom_headers or {}, email_data)
+        try:
+            # Send email with optimized headers
+            if self.send_email(
+                email_data['email'], 
+                subject, 
+                personalized_body, 
+                sender_name, 
+                from_email,
+                custom_headers
+            ):
+                return None
+            return f"Error sending to {email_data['email']}"
+            
+        except Exception as e:
+            return f"Error with {email_data['email']}: {str(e)}"
+    
     def _process_batch(self, emails: List[Dict], subject: str, template: str, 
-                       sender_name: str, from_email: str, custom_headers: Dict) -> Dict:
+                       sender_name: str, from_email: str, custom_headers: Dict,
+                       workers: int = 1,
+                       on_result: Callable[[Dict, Optional[str]], None] = None) -> Dict:
         """Process a batch of emails"""
         batch_results = {'sent': 0, 'failed': 0, 'errors': []}
         
         with tqdm(total=len(emails), desc=f"Sending batch") as pbar:
-            for email_data in emails:
-                try:
-                    # Optimize content
-                    personalized_body = self.optimize_email_content(template, email_data)
-                    
-                    # Send email with optimized headers
-                    if self.send_email(
-                        email_data['email'], 
-                        subject, 
-                        personalized_body, 
-                        sender_name, 
-                        from_email,
-                        custom_headers
-                    ):
-                        batch_results['sent'] += 1
-                    else:
-                        batch_results['failed'] += 1
-                        batch_results['errors'].append(f"Error sending to {email_data['email']}")
-                    
-                    # Optimized delay between emails (6 seconds)
-                    time.sleep(self.delay_between_emails)
-                    pbar.update(1)
-                    
-                except Exception as e:
+            def merge(item, error):
+                if isinstance(error, Exception):
+                    # send() raised inside the worker pool
+                    error = f"Error with {item[0]['email']}: {str(error)}"
+                if error is None:
+                    batch_results['sent'] += 1
+                else:
                     batch_results['failed'] += 1
-                    batch_results['errors'].append(f"Error with {email_data['email']}: {str(e)}")
-                    pbar.update(1)
+                    batch_results['errors'].append(error)
+                if on_result is not None:
+                    on_result(item[0], error)
+                pbar.update(1)
+            
+            def send(item):
+                email_data, (personalized_subject, personalized_body) = item
+                return self._send_contact(email_data, personalized_subject, personalized_body,
+                                          sender_name, from_email, custom_headers)
+            
+            # Subjects and bodies are rendered lazily on the producer side, ahead of the send workers
+            message = CompiledMessage(compile_template(subject), self.compile_content(template))
+            items = zip(emails, message.render_records(emails))
+            if workers > 1:
+                run_pool(items, send, workers, on_result=merge)
+            else:
+                for item in items:
+                    merge(item, send(item))
         
         return batch_results
     
@@ -286,13 +583,16 @@ class SendGridDefinitive:
             'account': 'Twilio SendGrid - Definitive Account',
             'sender': 'heliopsis@outlook.be',
             'max_batch_size': self.max_batch_size,
-            'batch_delay': self.batch_delay
+            'rate_limit': self.rate_limiter.get_stats(),
+            'throttle': self.throttle.get_stats(),
+            'max_personalizations': self.max_personalizations,
+            'connections': self.get_connection_stats()
         }
     
     def get_account_info(self) -> Dict:
         """Get Twilio SendGrid account information"""
         try:
-            response = requests.get(f"{self.base_url}/user/profile", headers=self.headers)
+            response = self.session.get(f"{self.base_url}/user/profile", timeout=self.timeout)
             if response.status_code == 200:
                 user_data = response.json()
                 return {
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SENDGRID STUB SERVER - LOCAL TESTS AND BENCHMARKS
+================================================
+
+Minimal keep-alive HTTP/1.1 server that mimics the SendGrid v3 endpoints
+used by the senders, so bulk sends can be exercised without a real account:
+- POST /v3/mail/send  -> 202 (optionally 429 + Retry-After every N requests)
+- GET  /v3/user/profile -> 200 with a fake profile
+- Configurable latency per request
+- Counts connections, requests and recipients
+"""
+
+import argparse
+import asyncio
+import json
+from typing import Dict
+
+
+class SendGridStub:
+    """Asyncio stub of the SendGrid v3 API"""
+
+    def __init__(self, latency: float = 0.0, throttle_every: int = 0, retry_after: float = 1.0):
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.server = None
+        self.stats = {'connections': 0, 'requests': 0, 'mail_requests': 0,
+                      'recipients': 0, 'throttled': 0}
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Start listening; returns the base URL to give to the senders"""
+        self.server = await asyncio.start_server(self._handle, host, port, backlog=1024)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v3"
+
+    async def stop(self):
+        """Stop the server"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats['connections'] += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                status, extra_headers, payload = self._route(method, path, body)
+                writer.write(self._response(status, extra_headers, payload))
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def _route(self, method: str, path: str, body: bytes):
+        self.stats['requests'] += 1
+        path = path.split('?', 1)[0]
+
+        if method == 'GET' and path.endswith('/user/profile'):
+            return 200, {}, json.dumps({'email': 'stub@localhost', 'first_name': 'Stub',
+                                        'last_name': 'Server', 'company': 'Heliopsis'})
+
+        if method == 'POST' and path.endswith('/mail/send'):
+            self.stats['mail_requests'] += 1
+            if self.throttle_every and self.stats['mail_requests'] % self.throttle_every == 0:
+                self.stats['throttled'] += 1
+                return 429, {'Retry-After': str(self.retry_after)}, json.dumps(
+                    {'errors': [{'message': 'too many requests'}]})
+            try:
+                data = json.loads(body or b'{}')
+            except ValueError:
+                return 400, {}, json.dumps({'errors': [{'message': 'invalid JSON'}]})
+            for personalization in data.get('personalizations', []):
+                self.stats['recipients'] += len(personalization.get('to', []))
+            return 202, {}, ''
+
+        return 404, {}, json.dumps({'errors': [{'message': 'not found'}]})
+
+    @staticmethod
+    def _response(status: int, extra_headers: Dict, payload: str) -> bytes:
+        reasons = {200: 'OK', 202: 'Accepted', 400: 'Bad Request',
+                   404: 'Not Found', 429: 'Too Many Requests'}
+        body = payload.encode('utf-8')
+        lines = [f"HTTP/1.1 {status} {reasons.get(status, 'OK')}",
+                 'Content-Type: application/json',
+                 f"Content-Length: {len(body)}",
+                 'Connection: keep-alive']
+        lines += [f"{name}: {value}" for name, value in extra_headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def main():
+    """Run the stub server until interrupted"""
+    parser = argparse.ArgumentParser(description='SendGrid v3 stub server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per request')
+    parser.add_argument('--throttle-every', type=int, default=0, help='answer 429 every N mail requests')
+    args = parser.parse_args()
+
+    async def run():
+        stub = SendGridStub(args.latency, args.throttle_every)
+        base_url = await stub.start(args.host, args.port)
+        print(f"🧪 SendGrid stub listening on {base_url}")
+        try:
+            while True:
+                await asyncio.sleep(10)
+                print(f"📊 {stub.stats}")
+        finally:
+            await stub.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ASYNC SMTP TRANSPORT
+====================
+
+Asyncio variant of EmailSenderSMTP:
+- Several authenticated sessions multiplexed on one event loop
+- ESMTP PIPELINING: RSET/MAIL FROM/RCPT TO/DATA go out in a single write
+  when the server advertises it (one round trip per message instead of four)
+- Session rotation and one reconnect on 421 / disconnects / timeouts
+- Same rate limiter, adaptive throttle and per-connection counters as the sync sender
+
+Run `python smtp_async.py --sink` to benchmark against smtp_sink_server.
+"""
+
+import argparse
+import asyncio
+import base64
+import logging
+import re
+import smtplib
+import ssl
+import time
+from typing import AsyncIterable, Dict, Iterable, List, Optional, Tuple, Union
+
+from email_sender_smtp import EmailSenderSMTP
+from template_engine import compile_message
+from adaptive_throttle import smtp_throttle_code
+from config import Config
+
+Contacts = Union[Iterable[Dict], AsyncIterable[Dict]]
+
+# Errores que obligan a descartar la sesión y reconectar
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, asyncio.TimeoutError,
+                      asyncio.IncompleteReadError, ConnectionError)
+
+
+def _smtp_data(text: str) -> bytes:
+    """CRLF line endings, dot-stuffing and the terminating <CRLF>.<CRLF>"""
+    data = re.sub(r'\r\n|\n|\r', '\r\n', text)
+    data = re.sub(r'(?m)^\.', '..', data)
+    if not data.endswith('\r\n'):
+        data += '\r\n'
+    return (data + '.\r\n').encode('utf-8')
+
+
+class AsyncSMTPConnection:
+    """One asyncio ESMTP session (STARTTLS + AUTH), reconnected on demand"""
+
+    def __init__(self, host: str, port: int, username: str = None, password: str = None,
+                 starttls: bool = True, timeout: float = 30, name: str = 'smtp-async-1'):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.name = name
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.extensions: Dict[str, str] = {}
+        self.session_messages = 0
+
+        self.messages = 0
+        self.connections = 0
+        self.reconnects = 0
+        self.rotations = 0
+        self.pipelined = 0
+        self.transaction_time = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self.writer is not None
+
+    async def _read_reply(self) -> Tuple[int, str]:
+        """Read a (possibly multi-line) reply"""
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip().decode('utf-8', 'replace'))
+            if line[3:4] != b'-':
+                try:
+                    return int(line[:3]), '\n'.join(lines)
+                except ValueError:
+                    raise smtplib.SMTPResponseException(-1, line.decode('utf-8', 'replace'))
+
+    async def _command(self, line: str) -> Tuple[int, str]:
+        self.writer.write(line.encode('utf-8') + b'\r\n')
+        await self.writer.drain()
+        return await self._read_reply()
+
+    async def _ehlo(self):
+        code, message = await self._command('EHLO localhost')
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, message)
+        self.extensions = {}
+        for line in message.split('\n')[1:]:
+            keyword, _, params = line.partition(' ')
+            self.extensions[keyword.lower()] = params
+
+    async def _start_tls(self):
+        code, message = await self._command('STARTTLS')
+        if code != 220:
+            raise smtplib.SMTPNotSupportedError(message)
+        context = ssl.create_default_context()
+        if hasattr(self.writer, 'start_tls'):
+            await self.writer.start_tls(context, server_hostname=self.host)
+        else:
+            # Python < 3.11: cambiar el transporte a mano
+            loop = asyncio.get_running_loop()
+            transport = self.writer.transport
+            protocol = transport.get_protocol()
+            tls_transport = await loop.start_tls(transport, protocol, context,
+                                                 server_hostname=self.host)
+            self.writer._transport = tls_transport
+            protocol._transport = tls_transport
+            protocol._over_ssl = True
+
+    async def _login(self):
+        mechanisms = self.extensions.get('auth', '').upper().split()
+        user, password = self.username, self.password
+        if 'PLAIN' in mechanisms or 'LOGIN' not in mechanisms:
+            token = base64.b64encode(f"\0{user}\0{password}".encode('utf-8')).decode('ascii')
+            code, message = await self._command(f'AUTH PLAIN {token}')
+        else:
+            code, message = await self._command('AUTH LOGIN')
+            for value in (user, password):
+                if code != 334:
+                    break
+                code, message = await self._command(base64.b64encode(value.encode('utf-8')).decode('ascii'))
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, message)
+
+    async def open(self):
+        """Connect, STARTTLS and authenticate if not already connected"""
+        if self.writer is not None:
+            return
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, limit=2 ** 20), self.timeout)
+        try:
+            code, message = await self._read_reply()
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, message)
+            await self._ehlo()
+            if self.starttls:
+                # Como smtplib.starttls(): sin STARTTLS anunciado no se sigue (AUTH iría en claro)
+                if 'starttls' not in self.extensions:
+                    raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+                await self._start_tls()
+                await self._ehlo()
+            if self.username and 'auth' in self.extensions:
+                await self._login()
+        except BaseException:
+            self._drop()
+            raise
+        self.session_messages = 0
+        self.connections += 1
+
+    def _drop(self):
+        writer, self.writer, self.reader = self.writer, None, None
+        if writer is not None:
+            writer.close()
+
+    async def close(self):
+        """QUIT the session (or drop the socket if the server is gone)"""
+        if self.writer is None:
+            return
+        try:
+            await self._command('QUIT')
+        except (smtplib.SMTPException, asyncio.TimeoutError, OSError):
+            pass
+        self._drop()
+
+    async def _transaction(self, from_addr: str, to_addrs: List[str], data: bytes) -> Dict:
+        """One mail transaction; pipelined when the server supports it"""
+        commands = []
+        if self.session_messages:
+            # Limpiar el sobre anterior (y detectar un 421) en el mismo envío
+            commands.append('RSET')
+        commands.append(f'MAIL FROM:<{from_addr}>')
+        commands.extend(f'RCPT TO:<{to_addr}>' for to_addr in to_addrs)
+        commands.append('DATA')
+
+        if 'pipelining' in self.extensions:
+            self.pipelined += 1
+            self.writer.write(''.join(f'{command}\r\n' for command in commands).encode('utf-8'))
+            await self.writer.drain()
+            replies = [await self._read_reply() for _ in commands]
+        else:
+            replies = []
+            for command in commands:
+                replies.append(await self._command(command))
+                if replies[-1][0] == 421 or (command.startswith('MAIL') and replies[-1][0] != 250):
+                    break
+
+        for code, message in replies:
+            if code == 421:
+                raise smtplib.SMTPResponseException(code, message)
+        if commands[0] == 'RSET':
+            replies.pop(0)
+
+        mail_code, mail_message = replies[0]
+        refused = {to_addr: reply for to_addr, reply in zip(to_addrs, replies[1:1 + len(to_addrs)])
+                   if reply[0] not in (250, 251)}
+        data_reply = replies[1 + len(to_addrs)] if len(replies) > 1 + len(to_addrs) else None
+
+        if data_reply is not None and data_reply[0] == 354 and (mail_code != 250 or len(refused) == len(to_addrs)):
+            # DATA aceptado sin remitente o destinatarios válidos: cerrarlo vacío
+            self.writer.write(b'.\r\n')
+            await self.writer.drain()
+            await self._read_reply()
+        if mail_code != 250:
+            raise smtplib.SMTPSenderRefused(mail_code, mail_message, from_addr)
+        if len(refused) == len(to_addrs):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_reply[0] != 354:
+            raise smtplib.SMTPDataError(*data_reply)
+
+        self.writer.write(data)
+        await self.writer.drain()
+        code, message = await self._read_reply()
+        if code != 250:
+            if code == 421:
+                raise smtplib.SMTPResponseException(code, message)
+            raise smtplib.SMTPDataError(code, message)
+        return refused
+
+    async def sendmail(self, from_addr: str, to_addrs: Union[str, List[str]], text: str,
+                       max_messages: int = 100) -> Dict:
+        """Send one message, rotating and reconnecting the session as needed"""
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        data = _smtp_data(text)
+        if self.writer is not None and self.session_messages >= max_messages:
+            self.rotations += 1
+            await self.close()
+
+        for reconnect in (False, True):
+            try:
+                await self.open()
+                start = time.monotonic()
+                refused = await self._transaction(from_addr, to_addrs, data)
+                self.transaction_time += time.monotonic() - start
+                self.session_messages += 1
+                self.messages += 1
+                return refused
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != 421:
+                    # La sesión sigue viva; el siguiente envío empieza con RSET
+                    self.session_messages += 1
+                    raise
+                self._drop()
+                if reconnect:
+                    raise
+                self.reconnects += 1
+            except _CONNECTION_ERRORS as e:
+                self._drop()
+                if reconnect:
+                    raise
+                self.reconnects += 1
+                logging.warning(f"🔌 {self.name}: sesión SMTP perdida "
+                                f"({str(e) or type(e).__name__}), reconectando")
+
+    def get_stats(self) -> Dict:
+        """Counters for this connection"""
+        return {
+            'name': self.name,
+            'open': self.is_open,
+            'messages': self.messages,
+            'connections': self.connections,
+            'reconnects': self.reconnects,
+            'rotations': self.rotations,
+            'pipelined': self.pipelined,
+            'avg_latency_ms': round(1000 * self.transaction_time / self.messages, 1) if self.messages else 0.0
+        }
+
+
+class AsyncEmailSenderSMTP(EmailSenderSMTP):
+    """Asyncio SMTP sender sharing budgets and helpers with EmailSenderSMTP"""
+
+    def __init__(self, email=None, password=None, sessions: int = None,
+                 max_messages_per_session: int = 100, timeout: float = 30,
+                 host: str = None, port: int = None, starttls: bool = True):
+        super().__init__(email, password, max_messages_per_session=max_messages_per_session,
+                         timeout=timeout, pool_size=sessions)
+        if host:
+            self.smtp_server = host
+        if port:
+            self.smtp_port = port
+        self.starttls = starttls
+        self.sessions = sessions or Config.SMTP_POOL_SIZE
+        self.max_messages_per_session = max_messages_per_session
+        self.connections: List[AsyncSMTPConnection] = []
+        self._free = None
+
+    def _connections(self) -> asyncio.Queue:
+        """Free sessions, created on first use inside the running loop"""
+        if self._free is None:
+            self._free = asyncio.Queue()
+            for i in range(self.sessions):
+                connection = AsyncSMTPConnection(
+                    self.smtp_server, self.smtp_port, self.email, self.password,
+                    starttls=self.starttls, timeout=self.timeout,
+                    name=f"smtp-async:{self.email}-{i + 1}")
+                self.connections.append(connection)
+                self._free.put_nowait(connection)
+        return self._free
+
+    async def aclose(self):
+        """QUIT every session"""
+        await asyncio.gather(*(connection.close() for connection in self.connections))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def _acquire_rate(self):
+        """Async wait on the shared token buckets"""
+        while True:
+            wait = self.rate_limiter.try_acquire()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _sendmail(self, to_email: str, text: str):
+        free = self._connections()
+        connection = await free.get()
+        try:
+            return await connection.sendmail(self.email, to_email, text, self.max_messages_per_session)
+        finally:
+            free.put_nowait(connection)
+
+    async def open_session(self) -> bool:
+        """Open one session up front; doubles as a connection test"""
+        free = self._connections()
+        connection = await free.get()
+        try:
+            await connection.open()
+            logging.info(f"✅ Sesión SMTP abierta con {self.email}")
+            return True
+        except Exception as e:
+            logging.error(f"❌ Error de conexión SMTP: {str(e)}")
+            return False
+        finally:
+            free.put_nowait(connection)
+
+    async def send_email(self, to_email: str, subject: str, body: str,
+                         sender_name: str = None) -> bool:
+        """Enviar un email por una de las sesiones abiertas"""
+        try:
+            text = self.build_message(to_email, subject, body, sender_name)
+
+            # Reintentar si el servidor pide esperar (421/45x)
+            for attempt in range(self.max_retries + 1):
+                pause = self.throttle.pause_remaining()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                await self._acquire_rate()
+                try:
+                    await self._sendmail(to_email, text)
+                    break
+                except smtplib.SMTPException as e:
+                    code = smtp_throttle_code(e)
+                    if code is None or attempt == self.max_retries:
+                        raise
+                    pause = self.throttle.on_throttle()
+                    logging.warning(f"⏳ Servidor SMTP limitando envíos ({code}), esperando {pause:.1f}s")
+
+            self.throttle.on_success()
+            with self._stats_lock:
+                self.sent_count += 1
+            logging.debug(f"✅ Email enviado a {to_email}")
+            return True
+
+        except Exception as e:
+            with self._stats_lock:
+                self.failed_count += 1
+            logging.error(f"❌ Error enviando email a {to_email}: {str(e)}")
+            return False
+
+    async def send_bulk_emails(self, emails: Contacts, subject: str, template: str,
+                               sender_name: str = None, max_in_flight: Optional[int] = None) -> Dict:
+        """Stream contacts through the sessions with at most max_in_flight pending sends"""
+        results = {'total': 0, 'sent': 0, 'failed': 0, 'errors': []}
+
+        if not await self.open_session():
+            logging.error("❌ No se pudo establecer conexión SMTP")
+            return results
+
+        semaphore = asyncio.Semaphore(max_in_flight or self.sessions * 2)
+        tasks = set()
+        message = compile_message(subject, template)
+
+        async def send(email_data: Dict):
+            try:
+                personalized_subject, personalized_body = message.render(email_data.get('custom_data', {}))
+                if await self.send_email(email_data['email'], personalized_subject, personalized_body,
+                                         sender_name):
+                    results['sent'] += 1
+                else:
+                    results['failed'] += 1
+                    results['errors'].append(f"Error enviando a {email_data['email']}")
+            finally:
+                semaphore.release()
+
+        async def contacts():
+            if hasattr(emails, '__aiter__'):
+                async for email_data in emails:
+                    yield email_data
+            else:
+                for email_data in emails:
+                    yield email_data
+
+        async for email_data in contacts():
+            results['total'] += 1
+            await semaphore.acquire()
+            task = asyncio.ensure_future(send(email_data))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+        logging.info(f"✅ Envío asíncrono completado: {results['sent']} enviados, {results['failed']} fallidos")
+        return results
+
+    def get_sending_stats(self) -> Dict:
+        """Obtener estadísticas de envío"""
+        per_connection = [connection.get_stats() for connection in self.connections]
+        stats = super().get_sending_stats()
+        stats['session'] = {
+            'size': self.sessions,
+            'open': sum(1 for connection in per_connection if connection['open']),
+            'messages': sum(connection['messages'] for connection in per_connection),
+            'connections': sum(connection['connections'] for connection in per_connection),
+            'reconnects': sum(connection['reconnects'] for connection in per_connection),
+            'rotations': sum(connection['rotations'] for connection in per_connection),
+            'per_connection': per_connection
+        }
+        return stats
+
+
+def main():
+    """Benchmark the async transport against the local SMTP sink"""
+    from smtp_sink_server import SMTPSink
+    from rate_limiter import RateLimiter
+
+    parser = argparse.ArgumentParser(description='Async SMTP transport benchmark')
+    parser.add_argument('--sink', action='store_true', help='run against a local sink server')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05, help='sink round trip in seconds')
+    parser.add_argument('--no-pipelining', action='store_true', help='sink does not advertise PIPELINING')
+    args = parser.parse_args()
+
+    if not args.sink:
+        print("Use --sink to benchmark against the local SMTP sink")
+        return
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def run():
+        sink = SMTPSink(latency=args.latency, pipelining=not args.no_pipelining)
+        host, port = await sink.start()
+        emails = ({'email': f"user{i}@example.com", 'custom_data': {'name': f"User {i}"}}
+                  for i in range(args.count))
+
+        async with AsyncEmailSenderSMTP('bench@localhost', 'sink', sessions=args.sessions,
+                                        host=host, port=port, starttls=False) as sender:
+            sender.rate_limiter = RateLimiter(name='sink')  # measure the transport, not the budget
+            sender.throttle.rate_limiter = None
+            start = time.monotonic()
+            results = await sender.send_bulk_emails(
+                emails, "Hola", "<html><body>Hola {{name}}</body></html>")
+            elapsed = time.monotonic() - start
+            session = sender.get_sending_stats()['session']
+
+        await sink.stop()
+        print(f"📊 {results['sent']} sent, {results['failed']} failed in {elapsed:.2f}s "
+              f"({results['sent'] / elapsed:.0f} emails/s)")
+        print(f"🔌 Sessions: {session['connections']} connections, {session['reconnects']} reconnects")
+        print(f"🧪 Sink stats: {sink.stats}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
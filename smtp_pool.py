@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SMTP CONNECTION POOL - PARALLEL AUTHENTICATED SESSIONS
+======================================================
+
+Pool of K authenticated SMTP connections for one account:
+- Connections are opened lazily and reused (RSET between messages)
+- Rotation after N messages, one reconnect on 421 / disconnects / timeouts
+- NOOP health check before reusing a connection that sat idle
+- Idle connections are closed after `max_idle` seconds
+- Per-connection counters: messages, reconnects, average transaction latency
+"""
+
+import logging
+import smtplib
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+
+class SMTPConnection:
+    """One pooled SMTP channel, reconnected on demand"""
+
+    def __init__(self, connect: Callable[[], smtplib.SMTP], name: str = 'smtp-1'):
+        self._connect = connect
+        self.name = name
+        self.server: Optional[smtplib.SMTP] = None
+        self.session_messages = 0
+        self.last_used = time.monotonic()
+
+        self.messages = 0
+        self.connections = 0
+        self.reconnects = 0
+        self.rotations = 0
+        self.health_failures = 0
+        self.transaction_time = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self.server is not None
+
+    def open(self):
+        """Connect and authenticate if not already connected"""
+        if self.server is None:
+            self.server = self._connect()
+            self.session_messages = 0
+            self.connections += 1
+
+    def close(self):
+        """QUIT the session (or drop the socket if the server is gone)"""
+        server, self.server = self.server, None
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+
+    def is_healthy(self) -> bool:
+        """NOOP round-trip to check the session is still usable"""
+        if self.server is None:
+            return False
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def sendmail(self, from_addr: str, to_addr: str, text: str, max_messages: int = 100):
+        """Send one message, rotating and reconnecting the session as needed"""
+        if self.server is not None and self.session_messages >= max_messages:
+            self.rotations += 1
+            self.close()
+
+        for reconnect in (False, True):
+            try:
+                if self.server is None:
+                    self.open()
+                elif self.session_messages:
+                    # Limpiar el sobre anterior y comprobar que la sesión sigue viva
+                    code, message = self.server.rset()
+                    if code == 421:
+                        raise smtplib.SMTPResponseException(code, message)
+
+                start = time.monotonic()
+                self.server.sendmail(from_addr, to_addr, text)
+                self.transaction_time += time.monotonic() - start
+                self.session_messages += 1
+                self.messages += 1
+                return
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != 421:
+                    raise
+                # El servidor cierra el canal: descartar la sesión y reconectar
+                self.close()
+                if reconnect:
+                    raise
+                self.reconnects += 1
+            except (smtplib.SMTPServerDisconnected, socket.timeout, ConnectionError) as e:
+                self.close()
+                if reconnect:
+                    raise
+                self.reconnects += 1
+                logging.warning(f"🔌 {self.name}: sesión SMTP perdida "
+                                f"({str(e) or type(e).__name__}), reconectando")
+
+    def get_stats(self) -> Dict:
+        """Counters for this connection"""
+        return {
+            'name': self.name,
+            'open': self.is_open,
+            'messages': self.messages,
+            'connections': self.connections,
+            'reconnects': self.reconnects,
+            'rotations': self.rotations,
+            'health_failures': self.health_failures,
+            'avg_latency_ms': round(1000 * self.transaction_time / self.messages, 1) if self.messages else 0.0
+        }
+
+
+class SMTPConnectionPool:
+    """Up to `size` SMTPConnection objects handed out to one thread at a time"""
+
+    def __init__(self, connect: Callable[[], smtplib.SMTP], size: int = 3,
+                 max_messages_per_connection: int = 100, max_idle: float = 60,
+                 health_check_after: float = 15, name: str = 'smtp'):
+        self.connect = connect
+        self.size = max(1, size)
+        self.max_messages_per_connection = max_messages_per_connection
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.name = name
+
+        self.connections: List[SMTPConnection] = []
+        self._idle: List[SMTPConnection] = []
+        self.condition = threading.Condition()
+        self.evictions = 0
+
+    def checkout(self, timeout: float = None) -> SMTPConnection:
+        """Take a free connection, creating one while below `size`"""
+        with self.condition:
+            self._evict_idle()
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            while not self._idle and len(self.connections) >= self.size:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No free SMTP connection in pool {self.name}")
+                self.condition.wait(remaining)
+            if self._idle:
+                # LIFO: la conexión usada más recientemente es la que más probablemente siga viva
+                connection = self._idle.pop()
+            else:
+                connection = SMTPConnection(self.connect, f"{self.name}-{len(self.connections) + 1}")
+                self.connections.append(connection)
+
+        if connection.is_open and time.monotonic() - connection.last_used > self.health_check_after:
+            if not connection.is_healthy():
+                connection.health_failures += 1
+                connection.close()
+        return connection
+
+    def checkin(self, connection: SMTPConnection):
+        """Return a connection to the pool"""
+        with self.condition:
+            connection.last_used = time.monotonic()
+            self._idle.append(connection)
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Context manager around checkout()/checkin()"""
+        connection = self.checkout(timeout)
+        try:
+            yield connection
+        finally:
+            self.checkin(connection)
+
+    def sendmail(self, from_addr: str, to_addr: str, text: str):
+        """Send one message over any free connection"""
+        with self.connection() as connection:
+            connection.sendmail(from_addr, to_addr, text, self.max_messages_per_connection)
+
+    def warm(self) -> bool:
+        """Open one connection up front; doubles as a connection test"""
+        try:
+            with self.connection() as connection:
+                connection.open()
+            return True
+        except Exception as e:
+            logging.error(f"❌ Error de conexión SMTP: {str(e)}")
+            return False
+
+    def _evict_idle(self):
+        """Close idle connections unused for more than max_idle (caller holds the lock)"""
+        now = time.monotonic()
+        for connection in self._idle:
+            if connection.is_open and now - connection.last_used > self.max_idle:
+                connection.close()
+                self.evictions += 1
+
+    def evict_idle(self):
+        """Close connections idle for more than max_idle"""
+        with self.condition:
+            self._evict_idle()
+
+    def close(self):
+        """Close every idle connection; counters are kept"""
+        with self.condition:
+            for connection in self._idle:
+                connection.close()
+
+    def get_stats(self) -> Dict:
+        """Pool totals plus per-connection counters"""
+        with self.condition:
+            per_connection = [connection.get_stats() for connection in self.connections]
+            return {
+                'size': self.size,
+                'open': sum(1 for stats in per_connection if stats['open']),
+                'idle': len(self._idle),
+                'evictions': self.evictions,
+                'messages': sum(stats['messages'] for stats in per_connection),
+                'connections': sum(stats['connections'] for stats in per_connection),
+                'reconnects': sum(stats['reconnects'] for stats in per_connection),
+                'rotations': sum(stats['rotations'] for stats in per_connection),
+                'per_connection': per_connection
+            }
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SMTP SINK SERVER - LOCAL TESTS AND BENCHMARKS
+=============================================
+
+Minimal asyncio ESMTP server that accepts and discards mail, so the SMTP
+senders can be exercised without a real Hotmail/Gmail account:
+- Advertises PIPELINING and AUTH PLAIN/LOGIN (any credentials accepted)
+- One configurable delay per packet received, like a network round trip,
+  so pipelined commands pay it once instead of once per command
+- Optional 451 throttling every N messages and 421 disconnects after N messages
+- Counts connections, round trips, commands, messages and recipients
+"""
+
+import argparse
+import asyncio
+from typing import List, Tuple
+
+
+class _SinkSession(asyncio.Protocol):
+    """One client connection; packets are answered in order after `latency`"""
+
+    def __init__(self, sink: 'SMTPSink'):
+        self.sink = sink
+        self.transport = None
+        self.packets = asyncio.Queue()
+        self.buffer = b''
+        self.in_data = False
+        self.has_mail = False
+        self.recipients = 0
+        self.auth_step = None
+        self.session_messages = 0
+        self.closing = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.sink.stats['connections'] += 1
+        transport.write(b'220 sink.localhost ESMTP ready\r\n')
+        self.task = asyncio.ensure_future(self._process())
+
+    def data_received(self, data: bytes):
+        self.packets.put_nowait(data)
+
+    def connection_lost(self, exc):
+        self.packets.put_nowait(None)
+
+    async def _process(self):
+        while True:
+            data = await self.packets.get()
+            if data is None or self.closing:
+                return
+            self.sink.stats['round_trips'] += 1
+            replies = self._handle(data)
+            if self.sink.latency:
+                await asyncio.sleep(self.sink.latency)
+            if replies and not self.transport.is_closing():
+                self.transport.write(b''.join(replies))
+            if self.closing:
+                self.transport.close()
+                return
+
+    def _handle(self, data: bytes) -> List[bytes]:
+        self.buffer += data
+        replies = []
+        while not self.closing:
+            if self.in_data:
+                end = self.buffer.find(b'\r\n.\r\n')
+                if end < 0 and self.buffer.startswith(b'.\r\n'):
+                    end, skip = 0, 3
+                elif end < 0:
+                    break
+                else:
+                    skip = 5
+                self.buffer = self.buffer[end + skip:]
+                self.in_data = False
+                replies.append(self._end_of_data())
+                continue
+            line, sep, rest = self.buffer.partition(b'\r\n')
+            if not sep:
+                break
+            self.buffer = rest
+            replies.append(self._command(line.decode('utf-8', 'replace')))
+        return replies
+
+    def _end_of_data(self) -> bytes:
+        self.sink.stats['messages'] += 1
+        self.sink.stats['recipients'] += self.recipients
+        self.session_messages += 1
+        self.has_mail = False
+        self.recipients = 0
+        return b'250 2.0.0 queued\r\n'
+
+    def _command(self, line: str) -> bytes:
+        self.sink.stats['commands'] += 1
+        if self.auth_step is not None:
+            self.auth_step -= 1
+            if self.auth_step:
+                return b'334 UGFzc3dvcmQ6\r\n'
+            self.auth_step = None
+            return b'235 2.7.0 authenticated\r\n'
+
+        verb, _, argument = line.partition(' ')
+        verb = verb.upper()
+        if verb == 'EHLO':
+            return (b'250-sink.localhost\r\n'
+                    + (b'250-PIPELINING\r\n' if self.sink.pipelining else b'')
+                    + b'250-8BITMIME\r\n250 AUTH PLAIN LOGIN\r\n')
+        if verb == 'HELO':
+            return b'250 sink.localhost\r\n'
+        if verb == 'AUTH':
+            mechanism, _, initial = argument.partition(' ')
+            if mechanism.upper() == 'PLAIN' and initial:
+                return b'235 2.7.0 authenticated\r\n'
+            self.auth_step = 1 if mechanism.upper() == 'PLAIN' else 2
+            return b'334 \r\n' if mechanism.upper() == 'PLAIN' else b'334 VXNlcm5hbWU6\r\n'
+        if verb == 'MAIL':
+            sink = self.sink
+            if sink.drop_after and self.session_messages >= sink.drop_after:
+                self.closing = True
+                return b'421 4.7.0 too many messages, closing connection\r\n'
+            sink.stats['mail_commands'] += 1
+            if sink.throttle_every and sink.stats['mail_commands'] % sink.throttle_every == 0:
+                sink.stats['throttled'] += 1
+                return b'451 4.7.0 rate limited, try again later\r\n'
+            self.has_mail = True
+            return b'250 2.1.0 sender ok\r\n'
+        if verb == 'RCPT':
+            if not self.has_mail:
+                return b'503 5.5.1 need MAIL first\r\n'
+            self.recipients += 1
+            return b'250 2.1.5 recipient ok\r\n'
+        if verb == 'DATA':
+            if not self.recipients:
+                return b'554 5.5.1 no valid recipients\r\n'
+            self.in_data = True
+            return b'354 end data with <CR><LF>.<CR><LF>\r\n'
+        if verb == 'RSET':
+            self.sink.stats['rset'] += 1
+            self.has_mail = False
+            self.recipients = 0
+            return b'250 2.0.0 ok\r\n'
+        if verb == 'NOOP':
+            return b'250 2.0.0 ok\r\n'
+        if verb == 'QUIT':
+            self.closing = True
+            return b'221 2.0.0 bye\r\n'
+        return b'502 5.5.2 command not implemented\r\n'
+
+
+class SMTPSink:
+    """Asyncio ESMTP sink"""
+
+    def __init__(self, latency: float = 0.0, pipelining: bool = True,
+                 throttle_every: int = 0, drop_after: int = 0):
+        self.latency = latency
+        self.pipelining = pipelining
+        self.throttle_every = throttle_every
+        self.drop_after = drop_after
+        self.server = None
+        self.stats = {'connections': 0, 'round_trips': 0, 'commands': 0, 'mail_commands': 0,
+                      'messages': 0, 'recipients': 0, 'rset': 0, 'throttled': 0}
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> Tuple[str, int]:
+        """Start listening; returns (host, port) to give to the senders"""
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(lambda: _SinkSession(self), host, port, backlog=1024)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        """Stop the server"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+
+def main():
+    """Run the sink until interrupted"""
+    parser = argparse.ArgumentParser(description='Asyncio SMTP sink server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8026)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per round trip')
+    parser.add_argument('--no-pipelining', action='store_true', help='do not advertise PIPELINING')
+    parser.add_argument('--throttle-every', type=int, default=0, help='answer 451 every N messages')
+    args = parser.parse_args()
+
+    async def run():
+        sink = SMTPSink(args.latency, not args.no_pipelining, args.throttle_every)
+        host, port = await sink.start(args.host, args.port)
+        print(f"🧪 SMTP sink listening on {host}:{port}")
+        try:
+            while True:
+                await asyncio.sleep(10)
+                print(f"📊 {sink.stats}")
+        finally:
+            await sink.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+TEMPLATE ENGINE - COMPILED {{var}} PERSONALIZATION
+==================================================
+
+Shared compiler for the {{key}} placeholders used by every sender:
+- Templates are parsed once into static text and placeholder slots
+- Compiled templates are cached by template id and content
+- Each recipient is rendered with a single join instead of one
+  str.replace pass over the whole HTML per key
+- Missing keys keep their {{key}} placeholder, as str.replace did
+- Batch rendering over a columnar contact set, as a lazy stream that only
+  touches the fields the template references
+- Subject and body compiled together as one message, rendered in one call;
+  line breaks in a rendered subject (e.g. from contact data) become spaces,
+  so a subject is always a single header line
+"""
+
+import csv
+import hashlib
+import itertools
+import re
+import threading
+from collections import OrderedDict
+from typing import (Dict, Hashable, Iterable, Iterator, List, Mapping, NamedTuple,
+                    Optional, Sequence, Tuple)
+
+PLACEHOLDER_RE = re.compile(r'\{\{([^{}]+)\}\}')
+
+HEADER_BREAK_RE = re.compile(r'[ \t]*[\r\n]+[ \t]*')
+
+MISSING = object()
+
+
+class CompiledTemplate:
+    """A template split into static segments and placeholder slots"""
+
+    __slots__ = ('source', 'parts', 'slots', 'placeholders', '_content_hash')
+
+    def __init__(self, source: str):
+        self.source = source
+        # split() alterna texto estático y nombres de variable: [txt, var, txt, var, ..., txt]
+        parts = PLACEHOLDER_RE.split(source)
+        self.slots: Tuple[Tuple[int, str], ...] = tuple((i, parts[i]) for i in range(1, len(parts), 2))
+        for i, key in self.slots:
+            parts[i] = f"{{{{{key}}}}}"
+        self.parts: List[str] = parts
+        self.placeholders: Tuple[str, ...] = tuple(dict.fromkeys(key for _, key in self.slots))
+        self._content_hash = None
+
+    @property
+    def content_hash(self) -> str:
+        """SHA-1 of the source, usable as a template version"""
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha1(self.source.encode('utf-8')).hexdigest()
+        return self._content_hash
+
+    @property
+    def static_segments(self) -> List[str]:
+        """Text between placeholders (one more than len(slots))"""
+        return self.parts[0::2]
+
+    def render(self, values: Mapping) -> str:
+        """Fill the slots from values; missing keys keep their placeholder"""
+        if not self.slots:
+            return self.source
+        out = self.parts[:]
+        for i, key in self.slots:
+            value = values.get(key, MISSING)
+            if value is not MISSING:
+                out[i] = value if isinstance(value, str) else str(value)
+        return ''.join(out)
+
+    def render_rows(self, columns: Mapping[str, Sequence], count: int) -> Iterator[str]:
+        """Lazily render `count` rows of a columnar contact set"""
+        if not self.slots:
+            return itertools.repeat(self.source, count)
+        missing = itertools.repeat(MISSING, count)
+        position = {key: k for k, key in enumerate(self.placeholders)}
+        slots = [(i, position[key]) for i, key in self.slots]
+        rows = zip(*(columns.get(key, missing) for key in self.placeholders))
+        return self._join_rows(rows, slots)
+
+    def _join_rows(self, rows, slots) -> Iterator[str]:
+        parts = self.parts
+        for row in rows:
+            out = parts[:]
+            for i, k in slots:
+                value = row[k]
+                if value is not MISSING:
+                    out[i] = value
+            yield ''.join(out)
+
+    def __repr__(self):
+        return f"<CompiledTemplate {len(self.source)} chars, placeholders={list(self.placeholders)}>"
+
+
+class TemplateCache:
+    """LRU of compiled templates keyed by (template id, source)"""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self._compiled: 'OrderedDict[Tuple[Optional[Hashable], str], CompiledTemplate]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, source: str, template_id: Hashable = None) -> CompiledTemplate:
+        """Compiled template for source, compiling it on first use"""
+        key = (template_id, source)
+        with self.lock:
+            compiled = self._compiled.get(key)
+            if compiled is not None:
+                self._compiled.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        compiled = CompiledTemplate(source)
+        with self.lock:
+            self._compiled[key] = compiled
+            while len(self._compiled) > self.max_size:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def invalidate(self, template_id: Hashable):
+        """Drop every compiled version of a template id"""
+        with self.lock:
+            for key in [key for key in self._compiled if key[0] == template_id]:
+                del self._compiled[key]
+
+    def clear(self):
+        with self.lock:
+            self._compiled.clear()
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {'compiled': len(self._compiled), 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+_cache = TemplateCache()
+
+
+def compile_template(source: str, template_id: Hashable = None) -> CompiledTemplate:
+    """Compiled (and cached) version of a template"""
+    return _cache.get(source or '', template_id)
+
+
+def render(source: str, values: Mapping, template_id: Hashable = None) -> str:
+    """Render a template with values in one pass"""
+    return compile_template(source, template_id).render(values)
+
+
+def extract_placeholders(*sources: str) -> List[str]:
+    """Sorted placeholder names used in the given templates"""
+    keys = set()
+    for source in sources:
+        if source:
+            keys.update(compile_template(source).placeholders)
+    return sorted(keys)
+
+
+def referenced_fields(*templates: CompiledTemplate, extra: Iterable[str] = ('email',)) -> List[str]:
+    """Distinct fields needed to render the given templates (plus `extra`)"""
+    fields = dict.fromkeys(extra)
+    for template in templates:
+        fields.update(dict.fromkeys(template.placeholders))
+    return list(fields)
+
+
+class ContactColumns:
+    """Contacts stored column by column, holding only the fields that are needed.
+
+    Values are converted to str once; None or '' becomes the field default (''
+    unless given) and fields absent from a record keep their {{key}} placeholder.
+    """
+
+    def __init__(self, columns: Dict[str, List], count: int):
+        self.columns = columns
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def _text(value, default: str):
+        if value is None or value == '':
+            return default
+        if value is MISSING or isinstance(value, str):
+            return value
+        return str(value)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence], fields: Sequence[str],
+                  defaults: Mapping[str, str] = None) -> 'ContactColumns':
+        """Build from tuples whose positions match `fields` (e.g. a query's with_entities)"""
+        defaults = defaults or {}
+        columns = {field: [] for field in fields}
+        appends = [(columns[field].append, defaults.get(field, '')) for field in fields]
+        count = 0
+        text = cls._text
+        for row in rows:
+            for (append, default), value in zip(appends, row):
+                append(text(value, default))
+            count += 1
+        return cls(columns, count)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Mapping], fields: Sequence[str],
+                     defaults: Mapping[str, str] = None) -> 'ContactColumns':
+        """Build from dicts, reading only `fields` from each one"""
+        return cls.from_rows(([record.get(field, MISSING) for field in fields] for record in records),
+                             fields, defaults)
+
+    @classmethod
+    def from_csv(cls, path: str, fields: Sequence[str], delimiter: str = None,
+                 defaults: Mapping[str, str] = None) -> 'ContactColumns':
+        """Build from a CSV/TSV file with a header row, keeping only `fields`"""
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            if delimiter is None:
+                delimiter = '\t' if '\t' in f.readline() else ','
+                f.seek(0)
+            reader = csv.reader(f, delimiter=delimiter)
+            header = [name.strip().lower() for name in next(reader, [])]
+            positions = [header.index(field) if field in header else None for field in fields]
+            rows = ([row[i] if i is not None and i < len(row) else MISSING for i in positions]
+                    for row in reader if row)
+            return cls.from_rows(rows, fields, defaults)
+
+    def column(self, field: str) -> Sequence:
+        """Values of one field (the {{field}} placeholder when the field is unknown)"""
+        return self.columns.get(field) or [MISSING] * self.count
+
+    def records(self) -> Iterator[Dict[str, str]]:
+        """Rows back as dicts (only the loaded fields, without missing values)"""
+        fields = list(self.columns)
+        for row in zip(*(self.columns[field] for field in fields)):
+            yield {field: value for field, value in zip(fields, row) if value is not MISSING}
+
+
+class RenderedEmail(NamedTuple):
+    index: int
+    email: str
+    subject: str
+    body: str
+
+
+def render_batch(body: CompiledTemplate, contacts: ContactColumns,
+                 subject: CompiledTemplate = None) -> Iterator[RenderedEmail]:
+    """Lazy stream of personalized (index, email, subject, body) for every contact"""
+    count = len(contacts)
+    columns = contacts.columns
+    bodies = body.render_rows(columns, count)
+    subjects = subject.render_rows(columns, count) if subject is not None else itertools.repeat(None, count)
+    emails = contacts.column('email')
+    for index, email, rendered_subject, rendered_body in zip(range(count), emails, subjects, bodies):
+        yield RenderedEmail(index, email, rendered_subject, rendered_body)
+
+
+def render_records(template: CompiledTemplate, records: Sequence[Mapping]) -> Iterator[str]:
+    """Lazy stream of bodies for a list of dicts, collecting only the referenced fields"""
+    contacts = ContactColumns.from_records(records, template.placeholders)
+    return template.render_rows(contacts.columns, len(contacts))
+
+
+def clean_header(value: str) -> str:
+    """Header value on one line: every CR/LF run (and the blanks around it) becomes one space"""
+    if '\r' in value or '\n' in value:
+        return HEADER_BREAK_RE.sub(' ', value).strip()
+    return value
+
+
+class CompiledMessage:
+    """Subject and body compiled together; both are rendered from the same values"""
+
+    __slots__ = ('subject', 'body', 'placeholders')
+
+    def __init__(self, subject: CompiledTemplate, body: CompiledTemplate):
+        self.subject = subject
+        self.body = body
+        self.placeholders: Tuple[str, ...] = tuple(dict.fromkeys(subject.placeholders + body.placeholders))
+
+    def render_subject(self, values: Mapping) -> str:
+        """Subject for one recipient, without line breaks"""
+        return clean_header(self.subject.render(values))
+
+    def render(self, values: Mapping) -> Tuple[str, str]:
+        """(subject, body) for one recipient"""
+        return self.render_subject(values), self.body.render(values)
+
+    def render_batch(self, contacts: ContactColumns) -> Iterator[RenderedEmail]:
+        """Lazy stream of personalized messages for a columnar contact set"""
+        return (rendered._replace(subject=clean_header(rendered.subject))
+                for rendered in render_batch(self.body, contacts, self.subject))
+
+    def render_records(self, records: Sequence[Mapping]) -> Iterator[Tuple[str, str]]:
+        """Lazy stream of (subject, body) for a list of dicts"""
+        contacts = ContactColumns.from_records(records, self.placeholders)
+        return zip(map(clean_header, self.subject.render_rows(contacts.columns, len(contacts))),
+                   self.body.render_rows(contacts.columns, len(contacts)))
+
+
+def compile_message(subject: str, body: str, template_id: Hashable = None) -> CompiledMessage:
+    """Compiled (and cached) subject + body pair"""
+    return CompiledMessage(compile_template(subject, template_id), compile_template(body, template_id))
+
+
+def get_template_cache() -> TemplateCache:
+    """The process-wide compiled template cache"""
+    return _cache
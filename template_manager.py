@@ -11,42 +11,177 @@ Simple email template management system with:
 - Variable placeholders
 - Professional designs
 - Easy customization
+- Cached store: reloads only when the file changes on disk, writes behind
+  atomically re-serializing only the templates that changed, and keeps an
+  LRU of compiled templates for rendering
+
+With write_behind (the default) add/update/delete only apply the change in
+memory and schedule the write: their True means "accepted", not "on disk".
+Call flush() when the caller needs to know the file was written; pending
+changes are also flushed at interpreter exit.
 """
 
+import atexit
 import json
 import os
+import threading
+import time
+import weakref
 from typing import List, Dict, Optional
 from datetime import datetime
+from template_engine import TemplateCache
+
+# Gestores vivos con cambios que escribir al salir (un único hook de atexit para todos)
+_live_managers = weakref.WeakSet()
+
+def _flush_all():
+    for manager in list(_live_managers):
+        manager.flush()
+
+atexit.register(_flush_all)
 
 class TemplateManager:
     """Simple email template management system"""
     
-    def __init__(self, templates_file: str = "email_templates.json"):
+    def __init__(self, templates_file: str = "email_templates.json", write_behind: bool = True,
+                 flush_delay: float = 0.5, compiled_cache_size: int = 64,
+                 check_interval: float = 1.0):
         self.templates_file = templates_file
-        self.templates = self.load_templates()
+        self.write_behind = write_behind
+        self.flush_delay = flush_delay
+        self.check_interval = check_interval
+        self.lock = threading.RLock()
+        self.compiled = TemplateCache(compiled_cache_size)
+        
+        # Fragmentos JSON ya serializados por template; solo se regeneran los modificados
+        self._fragments: Dict[str, str] = {}
+        self._dirty = set()
+        self._pending = False
+        self._flush_timer = None
+        self._file_version = None
+        self._last_check = time.monotonic()
+        
+        self._templates = self.load_templates()
         self.init_default_templates()
+        _live_managers.add(self)
+    
+    @property
+    def templates(self) -> Dict:
+        """Templates by id, reloaded if the file was changed by someone else"""
+        self._refresh_if_changed()
+        return self._templates
+    
+    @templates.setter
+    def templates(self, value: Dict):
+        with self.lock:
+            self._templates = value
+            self._fragments.clear()
+            self._dirty = set(value)
+            self.compiled.clear()
+    
+    def _stat_file(self):
+        try:
+            st = os.stat(self.templates_file)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
     
     def load_templates(self) -> Dict:
         """Load templates from JSON file"""
         try:
             if os.path.exists(self.templates_file):
                 with open(self.templates_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    templates = json.load(f)
+                self._file_version = self._stat_file()
+                return templates
             else:
                 return {}
         except Exception as e:
             print(f"Error loading templates: {str(e)}")
             return {}
     
-    def save_templates(self):
-        """Save templates to JSON file"""
-        try:
-            with open(self.templates_file, 'w', encoding='utf-8') as f:
-                json.dump(self.templates, f, indent=2, ensure_ascii=False)
+    def _refresh_if_changed(self):
+        """Reload the file if its mtime/size changed (checked at most every check_interval)"""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        with self.lock:
+            self._last_check = now
+            # Pending writes are newer than whatever is on disk
+            if self._pending or self._stat_file() in (None, self._file_version):
+                return
+            old = self._templates
+            new = self.load_templates()
+            for template_id in set(old) | set(new):
+                if old.get(template_id) != new.get(template_id):
+                    self._fragments.pop(template_id, None)
+                    self.compiled.invalidate(template_id)
+            self._templates = new
+    
+    def _fragment(self, template_id: str) -> str:
+        """JSON of one entry, indented as json.dump(indent=2) would write it"""
+        fragment = self._fragments.get(template_id)
+        if fragment is None or template_id in self._dirty:
+            body = json.dumps(self._templates[template_id], indent=2, ensure_ascii=False)
+            fragment = f"  {json.dumps(template_id, ensure_ascii=False)}: {body.replace(chr(10), chr(10) + '  ')}"
+            self._fragments[template_id] = fragment
+        return fragment
+    
+    def _changed(self, template_id: str) -> bool:
+        """Record a change to one template and persist it.
+
+        Without write_behind the file is written now and the result of the
+        write is returned; with it, the write is scheduled and True returned.
+        """
+        with self.lock:
+            self._dirty.add(template_id)
+            if template_id not in self._templates:
+                self._fragments.pop(template_id, None)
+            self.compiled.invalidate(template_id)
+            self._pending = True
+            if not self.write_behind:
+                return self.flush()
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
             return True
-        except Exception as e:
-            print(f"Error saving templates: {str(e)}")
-            return False
+    
+    def flush(self) -> bool:
+        """Write pending changes now (atomically: temp file + rename).
+
+        Runs under the lock that add/update/delete hold while they change
+        the templates, so the file is written from a consistent snapshot
+        even when the write-behind timer fires on another thread.
+        Returns True once every change made so far is on disk.
+        """
+        with self.lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._pending:
+                return True
+            try:
+                fragments = [self._fragment(template_id) for template_id in self._templates]
+                content = "{\n" + ",\n".join(fragments) + "\n}" if fragments else "{}"
+                tmp_path = f"{self.templates_file}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                os.replace(tmp_path, self.templates_file)
+                self._file_version = self._stat_file()
+                self._dirty.clear()
+                self._pending = False
+                return True
+            except Exception as e:
+                print(f"Error saving templates: {str(e)}")
+                return False
+    
+    def save_templates(self):
+        """Save all templates to JSON file"""
+        with self.lock:
+            self._dirty = set(self._templates)
+            self._pending = True
+            return self.flush()
     
     def init_default_templates(self):
         """Initialize with professional default templates"""
@@ -293,44 +428,47 @@ class TemplateManager:
     
     def add_template(self, template_id: str, name: str, description: str, category: str, 
                     variables: List[str], content: str) -> bool:
-        """Add a new template"""
+        """Add a new template (with write_behind, saved on the next flush())"""
         try:
-            self.templates[template_id] = {
-                'name': name,
-                'description': description,
-                'category': category,
-                'variables': variables,
-                'content': content,
-                'created_date': datetime.now().isoformat(),
-                'last_modified': datetime.now().isoformat()
-            }
-            return self.save_templates()
+            with self.lock:
+                self.templates[template_id] = {
+                    'name': name,
+                    'description': description,
+                    'category': category,
+                    'variables': variables,
+                    'content': content,
+                    'created_date': datetime.now().isoformat(),
+                    'last_modified': datetime.now().isoformat()
+                }
+                return self._changed(template_id)
         except Exception as e:
             print(f"Error adding template: {str(e)}")
             return False
     
     def update_template(self, template_id: str, updates: Dict) -> bool:
-        """Update an existing template"""
+        """Update an existing template (with write_behind, saved on the next flush())"""
         try:
-            if template_id in self.templates:
-                for key, value in updates.items():
-                    if key in ['name', 'description', 'category', 'variables', 'content']:
-                        self.templates[template_id][key] = value
-                
-                self.templates[template_id]['last_modified'] = datetime.now().isoformat()
-                return self.save_templates()
-            return False
+            with self.lock:
+                if template_id in self.templates:
+                    for key, value in updates.items():
+                        if key in ['name', 'description', 'category', 'variables', 'content']:
+                            self.templates[template_id][key] = value
+                    
+                    self.templates[template_id]['last_modified'] = datetime.now().isoformat()
+                    return self._changed(template_id)
+                return False
         except Exception as e:
             print(f"Error updating template: {str(e)}")
             return False
     
     def delete_template(self, template_id: str) -> bool:
-        """Delete a template"""
+        """Delete a template (with write_behind, removed from disk on the next flush())"""
         try:
-            if template_id in self.templates:
-                del self.templates[template_id]
-                return self.save_templates()
-            return False
+            with self.lock:
+                if template_id in self.templates:
+                    del self.templates[template_id]
+                    return self._changed(template_id)
+                return False
         except Exception as e:
             print(f"Error deleting template: {str(e)}")
             return False
@@ -341,18 +479,21 @@ class TemplateManager:
     
     def get_templates_by_category(self, category: str) -> List[Dict]:
         """Get all templates in a specific category"""
-        return [template for template in self.templates.values() if template.get('category') == category]
+        with self.lock:
+            return [template for template in self.templates.values() if template.get('category') == category]
     
     def get_all_templates(self) -> List[Dict]:
         """Get all templates"""
-        return list(self.templates.values())
+        with self.lock:
+            return list(self.templates.values())
     
     def get_template_categories(self) -> List[str]:
         """Get all available template categories"""
         categories = set()
-        for template in self.templates.values():
-            if 'category' in template:
-                categories.add(template['category'])
+        with self.lock:
+            for template in self.templates.values():
+                if 'category' in template:
+                    categories.add(template['category'])
         return sorted(list(categories))
     
     def render_template(self, template_id: str, variables: Dict) -> str:
@@ -365,9 +506,7 @@ class TemplateManager:
         
         # Replace variables in content
         if isinstance(content, str):
-            for var_name, var_value in variables.items():
-                placeholder = f"{{{{{var_name}}}}}"
-                content = content.replace(placeholder, str(var_value))
+            content = self.compiled.get(content, template_id).render(variables)
         
         return content
     
@@ -16,6 +16,7 @@ import json
 import os
 from typing import Dict, List, Optional
 from datetime import datetime
+from template_engine import compile_template
 
 class TemplateOptimizado:
     """Template de email optimizado para evitar spam"""
@@ -64,14 +65,9 @@ class TemplateOptimizado:
         
     def personalizar_contenido(self, datos: Dict) -> str:
         """Personalizar contenido del template con datos del contacto"""
-        contenido_personalizado = self.contenido_html
-        
-        for variable in self.variables_disponibles:
-            valor = datos.get(variable, '')
-            placeholder = f"{{{{{variable}}}}}"
-            contenido_personalizado = contenido_personalizado.replace(placeholder, str(valor))
-            
-        return contenido_personalizado
+        # Las variables conocidas sin dato se sustituyen por cadena vacía
+        valores = {variable: datos.get(variable, '') for variable in self.variables_disponibles}
+        return compile_template(self.contenido_html, self.nombre).render(valores)
     
     def obtener_headers_finales(self, datos_adicionales: Dict = None) -> Dict:
         """Obtener headers finales para el envío"""
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import smtplib
+import time
+import types
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from adaptive_throttle import AdaptiveThrottle, retry_after_from_response, smtp_throttle_code
+from rate_limiter import RateLimiter
+
+
+def response(**headers):
+    return types.SimpleNamespace(headers=headers)
+
+
+def test_throttle_halves_concurrency_and_rate():
+    limiter = RateLimiter(per_second=10)
+    throttle = AdaptiveThrottle(limiter, max_concurrency=8)
+    assert throttle.on_throttle(retry_after=0) == 0
+    assert throttle.limit == 4
+    assert throttle.rate_scale == 0.5
+    assert limiter.buckets[0].scale == 0.5
+    throttle.on_throttle(retry_after=0)
+    assert throttle.limit == 2
+
+
+def test_limits_have_a_floor():
+    throttle = AdaptiveThrottle(max_concurrency=2, min_concurrency=1, min_rate_scale=0.2)
+    for _ in range(10):
+        throttle.on_throttle(retry_after=0)
+    assert throttle.limit == 1
+    assert throttle.rate_scale == 0.2
+
+
+def test_success_increases_back_to_budget():
+    throttle = AdaptiveThrottle(max_concurrency=4, rate_increase=0.1)
+    throttle.on_throttle(retry_after=0)
+    for _ in range(100):
+        throttle.on_success()
+    assert throttle.limit == 4
+    assert throttle.rate_scale == 1.0
+
+
+def test_pause_uses_retry_after_or_exponential_backoff():
+    throttle = AdaptiveThrottle(base_backoff=1, max_backoff=5)
+    assert throttle.on_throttle(retry_after=30) == 30
+    assert throttle.pause_remaining() == pytest.approx(30, abs=1)
+    assert [throttle.on_throttle() for _ in range(4)] == [2, 4, 5, 5]
+
+
+def test_success_resets_backoff():
+    throttle = AdaptiveThrottle(base_backoff=1)
+    throttle.on_throttle(retry_after=0)
+    throttle.on_throttle(retry_after=0)
+    throttle.on_success()
+    assert throttle.on_throttle() == 1
+
+
+def test_slot_waits_for_pause():
+    throttle = AdaptiveThrottle(max_concurrency=1)
+    throttle.on_throttle(retry_after=0.2)
+    start = time.monotonic()
+    with throttle.slot():
+        assert throttle.in_flight == 1
+    assert time.monotonic() - start >= 0.15
+    assert throttle.in_flight == 0
+
+
+def test_retry_after_headers():
+    assert retry_after_from_response(response(**{'Retry-After': '12'})) == 12
+    later = datetime.now(timezone.utc) + timedelta(seconds=60)
+    assert retry_after_from_response(response(**{'Retry-After': format_datetime(later)})) == pytest.approx(60, abs=2)
+    assert retry_after_from_response(response(**{'X-RateLimit-Reset': str(time.time() + 10)})) == pytest.approx(10, abs=1)
+    assert retry_after_from_response(response()) is None
+
+
+def test_smtp_throttle_codes():
+    assert smtp_throttle_code(smtplib.SMTPResponseException(421, b'busy')) == 421
+    assert smtp_throttle_code(smtplib.SMTPResponseException(550, b'no such user')) is None
+    refused = smtplib.SMTPRecipientsRefused({'a@x.com': (550, b'no'), 'b@x.com': (452, b'later')})
+    assert smtp_throttle_code(refused) == 452
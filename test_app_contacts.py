@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import subprocess
+import sys
+import threading
+import types
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+from app import (EmailCampaign, EmailContact, EmailList, EmailTemplate, User, app, contact_page, db,
+                 decode_cursor, drain_campaign_queue, encode_cursor, iter_campaign_contacts)
+from config import Config
+from outbound_queue import FAILED, IN_FLIGHT, SENT, OutboundQueue
+
+
+@pytest.fixture
+def ctx():
+    with app.app_context():
+        yield
+        db.session.rollback()
+
+
+@pytest.fixture
+def client(ctx):
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+def new_list(contacts=()):
+    admin = User.query.filter_by(username='admin').one()
+    email_list = EmailList(name='Pruebas', user_id=admin.id)
+    db.session.add(email_list)
+    db.session.flush()
+    db.session.add_all(EmailContact(list_id=email_list.id, **contact) for contact in contacts)
+    db.session.commit()
+    return email_list.id
+
+
+def emails(list_id):
+    return [contact.email for contact in EmailContact.query.filter_by(list_id=list_id).order_by(EmailContact.id)]
+
+
+def flashes(client):
+    with client.session_transaction() as session:
+        return session.get('_flashes', [])
+
+
+def test_cursor_roundtrip():
+    created = datetime(2024, 5, 1, 12, 30)
+    assert decode_cursor(encode_cursor('ana@x.com', 7), 'email') == ('ana@x.com', 7)
+    assert decode_cursor(encode_cursor(created, 9), 'created') == (created, 9)
+    with pytest.raises(ValueError):
+        decode_cursor('no-es-un-cursor', 'id')
+
+
+@pytest.mark.parametrize('sort', ['id', 'email', 'name', 'company', 'created'])
+@pytest.mark.parametrize('direction', ['asc', 'desc'])
+def test_keyset_pages_follow_the_full_ordering(ctx, sort, direction):
+    start = datetime(2024, 1, 1)
+    # claves repetidas a propósito: el desempate por id tiene que mantener el orden
+    list_id = new_list(dict(email=f'u{i:02d}@x.com', name=['ana', 'bob', ''][i % 3], company=f'c{i % 4}',
+                            created_at=start + timedelta(minutes=i % 5)) for i in range(23))
+    key = {'id': 'id', 'email': 'email', 'name': 'name', 'company': 'company', 'created': 'created_at'}[sort]
+    contacts = EmailContact.query.filter_by(list_id=list_id).all()
+    expected = sorted(contacts, key=lambda c: (getattr(c, key), c.id), reverse=direction == 'desc')
+
+    seen, cursor = [], None
+    while True:
+        page = contact_page(list_id, sort=sort, direction=direction, cursor=cursor, limit=4)
+        seen.extend(row.id for row in page['contacts'])
+        cursor = page['next']
+        if cursor is None:
+            break
+    assert seen == [contact.id for contact in expected]
+
+
+def test_search_pages(ctx):
+    list_id = new_list(dict(email=f'u{i}@{"acme" if i % 2 else "x"}.com', name='', company='') for i in range(9))
+    page = contact_page(list_id, q='acme', limit=3)
+    rest = contact_page(list_id, q='acme', cursor=page['next'], limit=3)
+    assert [row.email for row in page['contacts'] + rest['contacts']] == [f'u{i}@acme.com' for i in (1, 3, 5, 7)]
+    assert rest['next'] is None
+
+
+def test_empty_names_get_the_default(ctx):
+    list_id = new_list([dict(email='a@x.com', name=None), dict(email='b@x.com', name=''),
+                        dict(email='c@x.com', name='Carla')])
+    rows = [data for _, data in iter_campaign_contacts(list_id, ['email', 'name', 'company'])]
+    assert [row['name'] for row in rows] == ['Usuario', 'Usuario', 'Carla']
+    assert rows[0]['company'] == ''
+
+
+def test_edit_small_list_syncs(client):
+    list_id = new_list([dict(email='a@x.com'), dict(email='b@x.com')])
+    client.post(f'/lists/{list_id}/edit', data={'name': 'Pruebas', 'emails_data': 'b@x.com, Bob\nc@x.com'})
+    assert emails(list_id) == ['b@x.com', 'c@x.com']
+
+
+def test_edit_large_list_without_mode_only_appends(client, monkeypatch):
+    monkeypatch.setattr(Config, 'EDIT_TEXTAREA_LIMIT', 3)
+    list_id = new_list(dict(email=f'u{i}@x.com') for i in range(5))
+    # un formulario sin mode=append no puede borrar lo que no cabía en el textarea
+    client.post(f'/lists/{list_id}/edit', data={'name': 'Pruebas', 'emails_data': 'U1@x.com\nnuevo@x.com'})
+    assert emails(list_id) == [f'u{i}@x.com' for i in range(5)] + ['nuevo@x.com']
+
+
+def test_multipart_import_skips_duplicates(client):
+    list_id = new_list([dict(email='a@x.com')])
+    content = 'email,nombre\nA@x.com,Ana\nb@x.com,Bob\nb@x.com,Otra vez\nno-es-email,X\n'.encode('utf-8')
+    response = client.post(f'/lists/{list_id}/import', data={'file': (io.BytesIO(content), 'c.csv')},
+                           content_type='multipart/form-data')
+    status = response.get_json()
+    assert response.status_code == 200
+    assert (status['inserted'], status['duplicates'], status['invalid']) == (1, 2, 1)
+    assert status['filename'] == 'c.csv'
+    assert emails(list_id) == ['a@x.com', 'b@x.com']
+
+
+def test_import_without_file_field_fails(client):
+    list_id = new_list()
+    response = client.post(f'/lists/{list_id}/import', data={'other': 'x'}, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def test_import_while_another_runs(client):
+    list_id = new_list()
+    app_module.import_status[list_id] = {'status': 'running', 'user_id': None}
+    try:
+        response = client.post(f'/lists/{list_id}/import', data=b'email\na@x.com\n', content_type='text/csv')
+        assert response.status_code == 409
+    finally:
+        app_module.import_status.pop(list_id)
+    assert emails(list_id) == []
+
+
+def test_start_campaign_already_running(client, monkeypatch):
+    list_id = new_list([dict(email='a@x.com')])
+    admin = User.query.filter_by(username='admin').one()
+    template = EmailTemplate(name='T', subject='Hola', content='<p>{{name}}</p>', user_id=admin.id)
+    db.session.add(template)
+    db.session.flush()
+    campaign = EmailCampaign(name='C', template_id=template.id, list_id=list_id, user_id=admin.id, status='draft')
+    db.session.add(campaign)
+    db.session.commit()
+
+    release = threading.Event()
+    thread = threading.Thread(target=release.wait)
+    thread.start()
+    monkeypatch.setitem(app_module.current_campaigns, campaign.id, thread)
+    monkeypatch.setattr(app_module, 'launch_campaign', lambda campaign_id: pytest.fail('lanzada dos veces'))
+    try:
+        client.get(f'/campaigns/{campaign.id}/start')
+    finally:
+        release.set()
+        thread.join()
+    assert ('info', 'La campaña ya se está enviando') in flashes(client)
+    db.session.refresh(campaign)
+    assert campaign.status == 'draft'
+
+
+class FakeSender:
+    """send_bulk_emails con el contrato de SendGridDefinitive: un on_result por destinatario"""
+
+    max_personalizations = 7
+
+    def __init__(self, queue, campaign_id, fail=(), crash_after=None):
+        self.queue = queue
+        self.campaign_id = campaign_id
+        self.fail = set(fail)
+        self.crash_after = crash_after
+        self.sent = []
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def send_bulk_emails(self, emails_data, subject, content, sender_name, sender_email,
+                         batch_mode=True, on_result=None, check_connection=True):
+        with self.lock:
+            self.max_in_flight = max(self.max_in_flight, self.queue.counts(self.campaign_id)[IN_FLIGHT])
+        for email_data in emails_data:
+            with self.lock:
+                if self.crash_after is not None and len(self.sent) >= self.crash_after:
+                    raise RuntimeError('conexión perdida')
+                self.sent.append(email_data['email'])
+            on_result(email_data, ValueError('rechazado') if email_data['email'] in self.fail else None)
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'SEND_WORKERS', 3)
+    monkeypatch.setattr(Config, 'SENDGRID_BATCH_MODE', True)
+    queue = OutboundQueue(str(tmp_path / 'outbound.db'), max_attempts=2, retry_backoff=0)
+    yield queue
+    queue.close()
+
+
+TEMPLATE = types.SimpleNamespace(subject='Hola {{name}}', content='<p>{{name}}</p>')
+
+
+def enqueue(queue, count):
+    queue.enqueue(1, [(i, {'email': f'u{i}@x.com', 'name': 'U'}) for i in range(1, count + 1)])
+    return [f'u{i}@x.com' for i in range(1, count + 1)]
+
+
+def test_drain_acks_every_recipient_and_bounds_in_flight(queue):
+    addresses = enqueue(queue, 100)
+    sender = FakeSender(queue, 1, fail={'u5@x.com'})
+    drain_campaign_queue(queue, 1, sender, TEMPLATE)
+    counts = queue.counts(1)
+    assert (counts[SENT], counts[FAILED], counts[IN_FLIGHT]) == (99, 1, 0)
+    # u5 agota sus dos intentos; el resto se envía una sola vez
+    assert sorted(sender.sent) == sorted(addresses + ['u5@x.com'])
+    assert sender.max_in_flight <= Config.SEND_WORKERS * FakeSender.max_personalizations
+
+
+def test_drain_retries_a_batch_cut_by_an_exception(queue):
+    addresses = enqueue(queue, 30)
+    sender = FakeSender(queue, 1, crash_after=10)
+    drain_campaign_queue(queue, 1, sender, TEMPLATE)
+    # los que no tuvieron resultado se reintentan; ninguno confirmado se repite
+    assert len(set(sender.sent)) == len(sender.sent) == 10
+    assert queue.counts(1)[FAILED] == 20
+    sender.crash_after = None
+    queue.retry_failed(1)
+    drain_campaign_queue(queue, 1, sender, TEMPLATE)
+    assert sorted(sender.sent) == sorted(addresses)
+
+
+def test_crash_then_recover_resends_only_in_flight_rows(queue):
+    addresses = enqueue(queue, 40)
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    dead = f'{process.pid}:deadbeef:1'
+    # el proceso caído había confirmado 10 envíos y tenía 7 en vuelo (ya enviados, sin confirmar)
+    acked = queue.claim(1, 10, worker=dead)
+    queue.mark_sent([item.id for item in acked])
+    in_flight = queue.claim(1, 7, worker=dead)
+    assert queue.recover() == 7
+
+    sender = FakeSender(queue, 1)
+    drain_campaign_queue(queue, 1, sender, TEMPLATE)
+    assert queue.counts(1)[SENT] == 40
+    assert sorted(sender.sent) == sorted(addresses[10:])
+    assert not {item.email for item in acked} & set(sender.sent)
+    assert {item.email for item in in_flight} <= set(sender.sent)
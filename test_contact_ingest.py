@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+
+import pytest
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table, create_engine, func, select, text
+from sqlalchemy.exc import IntegrityError
+
+from contact_ingest import (ContactRow, bulk_insert_contacts, clean_contacts, iter_csv_contacts,
+                            open_multipart_file, open_text_stream, parse_contact_lines, sync_contacts)
+
+metadata = MetaData()
+contacts = Table(
+    'email_contact', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('list_id', Integer, nullable=False),
+    Column('email', String(120), nullable=False),
+    Column('name', String(100)),
+    Column('company', String(100)),
+    Column('phone', String(20)),
+)
+Index('uq_email_contact_list_lower_email', contacts.c.list_id, func.lower(contacts.c.email), unique=True)
+
+
+@pytest.fixture
+def conn():
+    engine = create_engine('sqlite://')
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        yield conn
+    engine.dispose()
+
+
+def stored(conn, list_id=1):
+    return conn.execute(
+        select(contacts.c.id, contacts.c.email, contacts.c.name, contacts.c.company, contacts.c.phone)
+        .where(contacts.c.list_id == list_id).order_by(contacts.c.id)
+    ).all()
+
+
+def sync(conn, lines, list_id=1):
+    return sync_contacts(conn, contacts, list_id, parse_contact_lines(lines), stored(conn, list_id), chunk_size=2)
+
+
+def test_parse_contact_lines():
+    rows = list(parse_contact_lines('a@x.com, Ana\n\n  \nb@x.com,Bob,ACME,123,extra'))
+    assert rows == [ContactRow('a@x.com', 'Ana'), ContactRow('b@x.com', 'Bob', 'ACME', '123')]
+
+
+def test_clean_contacts_counts_invalid_and_duplicates():
+    stats = {'processed': 0, 'invalid': 0, 'duplicates': 0}
+    seen = {'old@x.com'}
+    rows = [ContactRow('a@x.com'), ContactRow('A@X.com'), ContactRow('no-es-email'), ContactRow('OLD@x.com')]
+    assert list(clean_contacts(rows, seen, stats)) == [ContactRow('a@x.com')]
+    assert stats == {'processed': 4, 'invalid': 1, 'duplicates': 2}
+
+
+def test_csv_with_and_without_header():
+    with_header = ['Nombre;Correo;Empresa\n', 'Ana;ana@x.com;ACME\n', '\n']
+    assert list(iter_csv_contacts(with_header)) == [ContactRow('ana@x.com', 'Ana', 'ACME', '')]
+    positional = ['bob@x.com\tBob\n', 'eva@x.com\tEva\tEVA SL\t600\n']
+    assert list(iter_csv_contacts(positional)) == [ContactRow('bob@x.com', 'Bob'),
+                                                   ContactRow('eva@x.com', 'Eva', 'EVA SL', '600')]
+
+
+def test_text_stream_strips_bom():
+    stream = open_text_stream(io.BytesIO('﻿email\nñ@x.com\n'.encode('utf-8')))
+    assert list(iter_csv_contacts(stream)) == [ContactRow('ñ@x.com')]
+
+
+def test_bulk_insert_in_chunks(conn):
+    chunks = []
+    rows = [ContactRow(f'u{i}@x.com') for i in range(5)]
+    assert bulk_insert_contacts(conn, contacts, 1, rows, chunk_size=2, on_chunk=chunks.append) == 5
+    assert chunks == [2, 2, 1]
+    assert len(stored(conn)) == 5
+
+
+def test_sync_only_touches_changed_rows(conn):
+    assert sync(conn, 'a@x.com, Ana\nb@x.com, Bob\nc@x.com, Carla') == \
+        {'inserted': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'duplicates': 0}
+    ids = {email: contact_id for contact_id, email, *_ in stored(conn)}
+
+    result = sync(conn, 'a@x.com, Ana\nb@x.com, Roberto\nd@x.com, Dani')
+    assert result == {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1, 'duplicates': 0}
+    rows = {email: (contact_id, name) for contact_id, email, name, *_ in stored(conn)}
+    assert rows['a@x.com'] == (ids['a@x.com'], 'Ana')
+    assert rows['b@x.com'] == (ids['b@x.com'], 'Roberto')
+    assert 'c@x.com' not in rows and 'd@x.com' in rows
+
+
+def test_sync_case_change_updates_in_place(conn):
+    sync(conn, 'ana@x.com, Ana')
+    (contact_id, *_), = stored(conn)
+    assert sync(conn, 'Ana@X.com, Ana')['updated'] == 1
+    assert stored(conn) == [(contact_id, 'Ana@X.com', 'Ana', '', '')]
+
+
+def test_sync_keeps_one_copy_of_repeated_addresses(conn):
+    result = sync(conn, 'a@x.com, Ana\nA@x.com, Otra\nb@x.com\na@x.com')
+    assert result['inserted'] == 2
+    assert result['duplicates'] == 2
+    assert [row[1:3] for row in stored(conn)] == [('a@x.com', 'Ana'), ('b@x.com', '')]
+
+
+def test_sync_deletes_stored_duplicates_before_updating(conn):
+    # dos copias de la misma dirección que quedaron de antes del índice único
+    conn.execute(text('DROP INDEX uq_email_contact_list_lower_email'))
+    conn.execute(contacts.insert(), [dict(list_id=1, email='a@x.com', name='Uno'),
+                                     dict(list_id=1, email='A@x.com', name='Dos')])
+    result = sync(conn, 'A@x.com, Dos')
+    assert (result['unchanged'], result['deleted']) == (1, 1)
+    assert [row[1:3] for row in stored(conn)] == [('A@x.com', 'Dos')]
+
+
+def test_unique_index_rejects_case_variant(conn):
+    sync(conn, 'a@x.com')
+    with pytest.raises(IntegrityError):
+        conn.execute(contacts.insert(), [dict(list_id=1, email='A@X.COM')])
+
+
+def multipart(boundary, *parts):
+    body = b''
+    for headers, content in parts:
+        body += b'--' + boundary + b'\r\n' + headers + b'\r\n\r\n' + content + b'\r\n'
+    return body + b'--' + boundary + b'--\r\n'
+
+
+def test_multipart_file_is_streamed_in_blocks():
+    boundary = b'----test'
+    content = ''.join(f'user{i}@x.com,Usuario {i}\n' for i in range(500)).encode('utf-8')
+    body = multipart(boundary,
+                     (b'Content-Disposition: form-data; name="list_id"', b'7'),
+                     (b'Content-Disposition: form-data; name="file"; filename="c.csv"\r\n'
+                      b'Content-Type: text/csv', content),
+                     (b'Content-Disposition: form-data; name="after"', b'x'))
+    reader = open_multipart_file(io.BytesIO(body), boundary)
+    reader.block_size = 100
+    assert reader.filename == 'c.csv'
+    assert io.BufferedReader(reader, buffer_size=64).read() == content
+
+
+def test_multipart_without_file_field():
+    boundary = b'----test'
+    body = multipart(boundary, (b'Content-Disposition: form-data; name="list_id"', b'7'))
+    with pytest.raises(ValueError):
+        open_multipart_file(io.BytesIO(body), boundary)
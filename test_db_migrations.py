@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from db_migrations import (MIGRATIONS, DuplicateContactsError, applied_migrations, dedupe_contacts,
+                           explain_query_plan, plan_problems, run_migrations)
+
+# Esquema de una base creada antes de los índices (como la dejaba db.create_all())
+OLD_SCHEMA = [
+    "CREATE TABLE email_list (id INTEGER PRIMARY KEY, user_id INTEGER, name VARCHAR(100), created_at DATETIME)",
+    "CREATE TABLE email_template (id INTEGER PRIMARY KEY, user_id INTEGER, created_at DATETIME)",
+    "CREATE TABLE email_campaign (id INTEGER PRIMARY KEY, user_id INTEGER, list_id INTEGER, created_at DATETIME)",
+    "CREATE TABLE email_contact (id INTEGER PRIMARY KEY, list_id INTEGER NOT NULL, email VARCHAR(120) NOT NULL, "
+    "name VARCHAR(100), company VARCHAR(100), phone VARCHAR(20), created_at DATETIME)",
+]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'emails.db'}")
+    with engine.begin() as conn:
+        for statement in OLD_SCHEMA:
+            conn.execute(text(statement))
+    yield engine
+    engine.dispose()
+
+
+def add_contacts(engine, *rows):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO email_contact (list_id, email, name) VALUES (:list_id, :email, :name)"),
+                     [dict(list_id=list_id, email=email, name=name) for list_id, email, name in rows])
+
+
+def indexes(engine):
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+
+
+def contact_count(engine):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM email_contact")).scalar()
+
+
+def test_old_database_is_migrated_once(engine):
+    add_contacts(engine, (1, 'a@x.com', None), (2, 'A@x.com', 'Ana'))
+    assert run_migrations(engine) == [migration.version for migration in MIGRATIONS]
+    assert {'uq_email_contact_list_lower_email', 'ix_email_contact_list_id_id',
+            'ix_email_contact_list_id_name_id', 'ix_email_campaign_list_id'} <= indexes(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM email_contact WHERE name IS NULL")).scalar() == 0
+    assert run_migrations(engine) == []
+    assert applied_migrations(engine) == [migration.version for migration in MIGRATIONS]
+
+
+def test_duplicate_emails_stop_the_migration_without_deleting(engine):
+    add_contacts(engine, (1, 'a@x.com', 'Uno'), (1, 'A@X.com', 'Dos'), (1, 'b@x.com', ''), (2, 'a@x.com', ''))
+    with pytest.raises(DuplicateContactsError) as error:
+        run_migrations(engine)
+    assert [row[:3] for row in error.value.duplicates] == [(1, 'a@x.com', 2)]
+    assert 'lista 1: a@x.com x2' in str(error.value)
+    assert contact_count(engine) == 4
+    assert 'uq_email_contact_list_lower_email' not in indexes(engine)
+    assert applied_migrations(engine) == []
+    # los pasos son idempotentes: tras corregir los datos la migración se repite entera
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE email_contact SET list_id = 3 WHERE email = 'A@X.com'"))
+    assert run_migrations(engine) == [migration.version for migration in MIGRATIONS]
+    assert contact_count(engine) == 4
+
+
+def test_dedupe_then_migrate_keeps_the_oldest_contact(engine):
+    add_contacts(engine, (1, 'a@x.com', 'Uno'), (1, 'A@X.com', 'Dos'), (1, 'a@x.com', 'Tres'))
+    assert dedupe_contacts(engine) == 2
+    assert run_migrations(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT email, name FROM email_contact")).all() == [('a@x.com', 'Uno')]
+
+
+def test_migrated_indexes_serve_the_contact_page(engine):
+    run_migrations(engine)
+    with engine.connect() as conn:
+        plan = [row[-1] for row in conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM email_contact WHERE list_id = 1 AND id > 10 ORDER BY id LIMIT 50"
+        ))]
+        assert plan_problems(plan, ['email_contact']) == []
+        plan = [row[-1] for row in conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM email_contact WHERE phone = '1' ORDER BY name"
+        ))]
+        assert len(plan_problems(plan, ['email_contact'])) == 2
+
+
+def test_plan_problems_reads_both_sqlite_formats():
+    plan = ['SCAN TABLE email_contact', 'SCAN email_list', 'SEARCH email_campaign USING INDEX x (list_id=?)',
+            'USE TEMP B-TREE FOR ORDER BY']
+    assert plan_problems(plan, ['email_contact']) == ['SCAN TABLE email_contact', 'USE TEMP B-TREE FOR ORDER BY']
+
+
+def test_explain_query_plan_of_a_statement(engine):
+    run_migrations(engine)
+    with engine.connect() as conn:
+        statement = text("SELECT id FROM email_contact WHERE list_id = 1 ORDER BY id").columns()
+        plan = explain_query_plan(conn, statement)
+    assert any('ix_email_contact_list_id_id' in line for line in plan)
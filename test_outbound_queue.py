@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from outbound_queue import FAILED, IN_FLIGHT, QUEUED, RETRY, SENT, OutboundQueue, process_alive, process_id
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = OutboundQueue(str(tmp_path / 'outbound.db'), max_attempts=2, retry_backoff=60, chunk_size=3)
+    yield queue
+    queue.close()
+
+
+def contacts(count, start=1):
+    return [(i, {'email': f'user{i}@example.com', 'name': f'U{i}'}) for i in range(start, start + count)]
+
+
+@pytest.fixture
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture
+def live_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    yield process.pid
+    process.kill()
+    process.wait()
+
+
+def test_enqueue_is_idempotent_and_checkpointed(queue):
+    assert queue.enqueue(1, contacts(10)) == 10
+    assert queue.checkpoint(1) == 10
+    # mismo contacto, o misma dirección con otras mayúsculas: no se vuelve a encolar
+    again = contacts(10) + [(99, {'email': 'USER1@example.com'})]
+    assert queue.enqueue(1, again) == 0
+    assert queue.counts(1)[QUEUED] == 10
+    # otra campaña tiene sus propias claves
+    assert queue.enqueue(2, contacts(2)) == 2
+
+
+def test_claim_never_hands_out_a_row_twice(queue):
+    queue.enqueue(1, contacts(5))
+    first = queue.claim(1, 3)
+    second = queue.claim(1, 3)
+    assert [item.contact_id for item in first] == [1, 2, 3]
+    assert [item.contact_id for item in second] == [4, 5]
+    assert queue.claim(1, 3) == []
+    assert all(item.attempts == 1 for item in first + second)
+    assert queue.counts(1)[IN_FLIGHT] == 5
+
+
+def test_sent_and_failed_states(queue):
+    queue.enqueue(1, contacts(3))
+    items = queue.claim(1, 3)
+    assert queue.mark_sent([items[0].id]) == 1
+    assert queue.mark_sent([items[0].id]) == 0
+    # primer fallo: reintento programado; el segundo agota max_attempts
+    assert queue.mark_failed([(items[1], 'boom')]) == []
+    assert queue.counts(1)[RETRY] == 1
+    assert queue.next_retry_in(1) == pytest.approx(60, abs=1)
+    assert queue.mark_failed([(items[2], 'rechazado')], retryable=False) == [items[2]]
+    assert queue.counts(1) == {QUEUED: 0, IN_FLIGHT: 0, SENT: 1, FAILED: 1, RETRY: 1}
+
+
+def test_retry_is_claimed_when_due_then_fails_for_good(queue):
+    queue.retry_backoff = 0
+    queue.enqueue(1, contacts(1))
+    item, = queue.claim(1, 10)
+    queue.mark_failed([(item, 'boom')])
+    retried, = queue.claim(1, 10)
+    assert retried.attempts == 2
+    assert queue.mark_failed([(retried, 'boom')]) == [retried]
+    assert queue.counts(1)[FAILED] == 1
+    assert queue.next_retry_in(1) is None
+    assert queue.retry_failed(1) == 1
+    assert queue.claim(1, 10)[0].attempts == 1
+
+
+def test_recover_after_crash_only_requeues_rows_of_dead_processes(queue, dead_pid, live_pid):
+    queue.enqueue(1, contacts(8))
+    crashed = queue.claim(1, 2, worker=f'{dead_pid}:deadbeef:1')
+    sending = queue.claim(1, 2, worker=f'{live_pid}:cafebabe:1')
+    mine = queue.claim(1, 2)
+    assert queue.recover() == 2
+    requeued = {item.id for item in queue.claim(1, 10)}
+    # las dos filas del proceso caído más las dos que nadie había reclamado
+    assert {item.id for item in crashed} <= requeued
+    assert len(requeued) == 4
+    assert not {item.id for item in sending + mine} & requeued
+
+
+def test_recover_requeues_expired_leases(queue, live_pid):
+    queue.enqueue(1, contacts(2))
+    old, recent = queue.claim(1, 2, worker=f'{live_pid}:cafebabe:1')
+    with queue._transaction() as conn:
+        conn.execute("UPDATE outbound SET claimed_at = ? WHERE id = ?", (time.time() - 7200, old.id))
+    assert queue.recover(lease=3600) == 1
+    assert queue.counts(1)[IN_FLIGHT] == 1
+    # lease=0: ningún proceso envía la campaña, todo vuelve a la cola
+    assert queue.recover(1, lease=0) == 1
+    assert queue.counts(1)[QUEUED] == 2
+
+
+def test_recovered_rows_are_sent_once_more_at_most(queue, dead_pid):
+    queue.enqueue(1, contacts(6))
+    sent = []
+    batch = queue.claim(1, 3, worker=f'{dead_pid}:deadbeef:1')
+    # el proceso caído confirmó el primer envío antes de morir
+    sent.append(batch[0].email)
+    queue.mark_sent([batch[0].id])
+    queue.recover()
+    while True:
+        items = queue.claim(1, 2)
+        if not items:
+            break
+        sent.extend(item.email for item in items)
+        queue.mark_sent([item.id for item in items])
+    assert sorted(sent) == sorted(data['email'] for _, data in contacts(6))
+    assert queue.unfinished_campaigns() == []
+
+
+def test_one_live_owner_per_campaign(queue, live_pid, dead_pid):
+    other = f'{live_pid}:cafebabe'
+    assert queue.acquire_campaign(1, owner=other)
+    assert not queue.acquire_campaign(1)
+    assert queue.campaign_owner(1) == other
+    queue.release_campaign(1)  # no es el dueño: no cambia nada
+    assert queue.campaign_owner(1) == other
+    queue.release_campaign(1, owner=other)
+    assert queue.campaign_owner(1) is None
+    assert queue.acquire_campaign(1, owner=f'{dead_pid}:deadbeef')
+    assert queue.campaign_owner(1) is None
+    assert queue.acquire_campaign(1)
+    assert queue.campaign_owner(1) == process_id()
+
+
+def test_process_alive(dead_pid, live_pid):
+    assert process_alive(process_id())
+    assert process_alive(f'{process_id()}:1234')
+    assert process_alive(f'{live_pid}:cafebabe:1')
+    assert not process_alive(f'{dead_pid}:deadbeef:1')
+    # un proceso anterior con nuestro mismo pid (contenedor reiniciado)
+    assert not process_alive(f'{os.getpid()}:00000000:1')
+    assert not process_alive(None)
+    assert not process_alive('basura')
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import types
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, 'time', types.SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    return clock
+
+
+def test_burst_then_wait(clock):
+    limiter = RateLimiter(per_second=2, burst=5)
+    assert [limiter.try_acquire() for _ in range(5)] == [0.0] * 5
+    assert limiter.try_acquire() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter.try_acquire() == 0.0
+
+
+def test_tightest_bucket_wins(clock):
+    limiter = RateLimiter(per_second=10, per_minute=3)
+    for _ in range(3):
+        assert limiter.try_acquire() == 0.0
+    # el bucket por minuto manda: un token cada 20 s
+    assert limiter.try_acquire() == pytest.approx(20.0)
+
+
+def test_acquire_times_out(clock):
+    limiter = RateLimiter(per_minute=1)
+    assert limiter.acquire()
+    assert not limiter.acquire(timeout=5)
+    assert limiter.acquire(timeout=60)
+    assert limiter.get_stats()['acquired'] == 2
+
+
+def test_request_larger_than_capacity_leaves_debt(clock):
+    bucket = TokenBucket(rate=2, per=1)
+    assert bucket.wait_time(10) == 0.0
+    bucket.take(10)
+    assert bucket.tokens == -8
+    assert bucket.wait_time(1) == pytest.approx(4.5)
+
+
+def test_scale_slows_refill(clock):
+    limiter = RateLimiter(per_second=4)
+    for _ in range(4):
+        limiter.try_acquire()
+    assert limiter.try_acquire() == pytest.approx(0.25)
+    limiter.set_scale(0.5)
+    assert limiter.try_acquire() == pytest.approx(0.5)
+    assert limiter.get_stats()['buckets'][0]['scale'] == 0.5
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from send_pool import SendWorkerPool, run_pool
+
+
+def test_every_item_gets_one_result():
+    results = {}
+
+    def handler(item):
+        if item % 3 == 0:
+            raise ValueError(item)
+        return item * 2
+
+    pool = run_pool(range(30), handler, workers=4, on_result=results.__setitem__)
+    assert sorted(results) == list(range(30))
+    assert all(isinstance(results[i], ValueError) for i in range(0, 30, 3))
+    assert results[4] == 8
+    assert (pool.processed, pool.errors) == (20, 10)
+
+
+def test_failing_on_result_does_not_stop_workers():
+    seen = []
+
+    def on_result(item, result):
+        seen.append(item)
+        if item == 0:
+            raise RuntimeError('callback')
+
+    run_pool(range(10), lambda item: item, workers=2, on_result=on_result)
+    assert sorted(seen) == list(range(10))
+
+
+def test_sends_overlap_up_to_workers():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def handler(item):
+        with lock:
+            running.append(item)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(item)
+
+    with SendWorkerPool(handler, workers=3) as pool:
+        for item in range(12):
+            pool.submit(item)
+    assert max(peak) == 3
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import email
+import quopri
+from email import policy
+from email.errors import HeaderParseError
+
+import pytest
+
+from mime_template import EncodedTemplate, encode_header, format_from, format_to
+from template_engine import (CompiledTemplate, ContactColumns, TemplateCache, clean_header, compile_message,
+                             extract_placeholders, render_records)
+
+
+def test_render_fills_slots_and_keeps_missing_placeholders():
+    template = CompiledTemplate('Hola {{nombre}}, tu email es {{email}} ({{nombre}})')
+    assert template.placeholders == ('nombre', 'email')
+    assert template.render({'nombre': 'Ana', 'email': 'ana@x.com'}) == 'Hola Ana, tu email es ana@x.com (Ana)'
+    assert template.render({'email': 7}) == 'Hola {{nombre}}, tu email es 7 ({{nombre}})'
+    assert CompiledTemplate('sin variables').render({'a': 1}) == 'sin variables'
+
+
+def test_render_rows_matches_render():
+    template = CompiledTemplate('<p>{{name}}</p><p>{{email}}</p>')
+    records = [{'name': 'Ana', 'email': 'ana@x.com'}, {'email': 'bob@x.com'}]
+    assert list(render_records(template, records)) == [template.render(record) for record in records]
+
+
+def test_contact_columns_default_for_empty_values():
+    contacts = ContactColumns.from_rows([('a@x.com', None), ('b@x.com', ''), ('c@x.com', 'Carla')],
+                                        ['email', 'name'], defaults={'name': 'Usuario'})
+    assert contacts.column('name') == ['Usuario', 'Usuario', 'Carla']
+    assert list(CompiledTemplate('{{name}}').render_rows(contacts.columns, len(contacts))) == \
+        ['Usuario', 'Usuario', 'Carla']
+
+
+def test_cache_reuses_and_invalidates():
+    cache = TemplateCache(max_size=2)
+    first = cache.get('{{a}}', template_id=1)
+    assert cache.get('{{a}}', template_id=1) is first
+    cache.invalidate(1)
+    assert cache.get('{{a}}', template_id=1) is not first
+    cache.get('x', 2)
+    cache.get('y', 3)
+    assert cache.get_stats()['compiled'] == 2
+    assert extract_placeholders('{{b}} {{a}}', None, '{{a}}') == ['a', 'b']
+
+
+def test_subject_is_one_header_line():
+    assert clean_header('Hola \r\n  Bcc: x@y.com') == 'Hola Bcc: x@y.com'
+    message = compile_message('Oferta para {{name}}', '<p>{{name}}</p>')
+    assert message.render({'name': 'Ana\nBcc: x@y.com'}) == ('Oferta para Ana Bcc: x@y.com',
+                                                             '<p>Ana\nBcc: x@y.com</p>')
+
+
+@pytest.mark.parametrize('eol', ['\n', '\r\n'])
+def test_spliced_qp_body_decodes_to_rendered_html(eol):
+    html = '<html><body>' + 'Estático con acentos: áéíóú = ' * 20 + '{{name}}<br>{{empresa}}' \
+        + '<p>' + 'x' * 200 + '</p>{{missing}}</body></html>'
+    template = CompiledTemplate(html)
+    encoded = EncodedTemplate(template, eol=eol)
+    values = {'name': 'José Ñúñez =?utf-8?', 'empresa': 12}
+    body = encoded.encode_body(values)
+    assert all(len(line) <= 76 for line in body.split(eol))
+    assert quopri.decodestring(body.encode('ascii')).decode('utf-8') == template.render(values)
+
+
+def test_built_message_parses():
+    encoded = EncodedTemplate(CompiledTemplate('<p>Hola {{name}}</p>'))
+    raw = encoded.build_message(format_from('yo@x.com', 'Señor Pérez'), 'ana@x.com', 'Asunto ñ', {'name': 'Ana'})
+    message = email.message_from_string(raw, policy=policy.default)
+    assert message['Subject'] == 'Asunto ñ'
+    assert message['To'] == 'ana@x.com'
+    part, = message.iter_parts()
+    assert part.get_content().strip() == '<p>Hola Ana</p>'
+
+
+def test_header_injection_is_rejected():
+    encoded = EncodedTemplate(CompiledTemplate('x'))
+    with pytest.raises(HeaderParseError):
+        format_to('ana@x.com\r\nBcc: x@y.com')
+    with pytest.raises(HeaderParseError):
+        encode_header('Asunto\nBcc: x@y.com', 'Subject')
+    with pytest.raises(HeaderParseError):
+        format_from('yo@x.com', 'Yo\r\nBcc: x@y.com')
+    with pytest.raises(HeaderParseError):
+        encoded.build_message('yo@x.com', 'ana@x.com', 'Asunto\r\nBcc: x@y.com', {})
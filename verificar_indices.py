@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+VERIFICACIÓN DE ÍNDICES - PLANES DE LAS CONSULTAS FRECUENTES
+============================================================
+
+Aplica las migraciones pendientes y pide a SQLite el plan (EXPLAIN QUERY
+PLAN) de las consultas que la web ejecuta en cada página, construidas con
+las mismas funciones de app.py que usan las rutas:
+- Páginas de view_list (contact_page_query) con cada orden y dirección,
+  primera página, página siguiente (cursor) y búsqueda
+- Lectura keyset de contactos, recuento por lista y de varias listas,
+  muestra de la vista de campaña
+- Listas, templates y campañas del usuario; últimas campañas por fecha
+
+Si alguna recorre una tabla entera ("SCAN email_contact" en lugar de
+"SEARCH ... USING INDEX") u ordena las filas por su cuenta ("USE TEMP
+B-TREE") el script termina con código 1, para poder usarlo como
+comprobación antes de desplegar un cambio en modelos o consultas.
+
+La búsqueda (ILIKE '%q%') pasa si se limita al índice de la lista: filtra
+los contactos de esa lista en orden, sin índice propio para el texto.
+
+Uso: python verificar_indices.py [--verbose]
+"""
+
+import argparse
+import sys
+from datetime import datetime
+
+import app as web
+from db_migrations import check_query_plans, explain_query_plan, run_migrations
+
+TABLES = ('email_contact', 'email_list', 'email_template', 'email_campaign')
+
+# Valor de ejemplo del cursor para cada orden de view_list
+CURSOR_VALUES = {'id': 1, 'email': 'a@example.com', 'name': 'Ana', 'company': 'Heliopsis',
+                 'created': datetime(2025, 1, 1)}
+
+
+def hot_queries(user_id: int = 1, list_id: int = 1):
+    """(nombre, consulta) de las consultas de app.py que deben usar un índice"""
+    queries = []
+    for sort in web.CONTACT_SORTS:
+        cursor = web.encode_cursor(CURSOR_VALUES[sort], 1)
+        for direction in ('asc', 'desc'):
+            queries.append((f"view_list {sort} {direction}",
+                            web.contact_page_query(list_id, '', sort, direction)))
+            queries.append((f"view_list {sort} {direction} (página siguiente)",
+                            web.contact_page_query(list_id, '', sort, direction, cursor)))
+        queries.append((f"view_list {sort} (búsqueda)",
+                        web.contact_page_query(list_id, 'ana', sort, 'asc', cursor)))
+    queries.extend([
+        ('contactos por lista (keyset id)',
+         web.contact_rows_query(list_id, [web.EmailContact.email], 0, web.Config.CONTACT_CHUNK_SIZE)),
+        ('recuento de contactos de una lista', web.contact_count_query(list_id)),
+        ('recuento de contactos por lista', web.contact_counts_query([list_id, list_id + 1])),
+        ('muestra de contactos de la campaña', web.contact_preview_query(list_id)),
+        ('listas del usuario', web.user_lists_query(user_id)),
+        ('templates del usuario', web.user_templates_query(user_id)),
+        ('campañas del usuario', web.user_campaigns_query(user_id)),
+        ('últimas campañas (dashboard)', web.recent_campaigns_query(user_id)),
+    ])
+    return queries
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Comprobar que las consultas frecuentes usan índices')
+    parser.add_argument('--verbose', action='store_true', help='mostrar el plan de todas las consultas')
+    args = parser.parse_args()
+
+    with web.app.app_context():
+        applied = run_migrations(web.db.engine)
+        if applied:
+            print(f"🗄️  Migraciones aplicadas: {', '.join(applied)}")
+
+        queries = hot_queries()
+        with web.db.engine.connect() as conn:
+            if args.verbose:
+                for name, statement in queries:
+                    print(f"📋 {name}")
+                    for detail in explain_query_plan(conn, statement):
+                        print(f"     {detail}")
+            failures = check_query_plans(conn, queries, TABLES)
+
+    if failures:
+        print(f"❌ {len(failures)} consultas recorren una tabla completa u ordenan sin índice:")
+        for name, plan in failures:
+            print(f"   - {name}")
+            for detail in plan:
+                print(f"       {detail}")
+        return 1
+
+    print(f"✅ Las {len(queries)} consultas frecuentes usan índices")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())